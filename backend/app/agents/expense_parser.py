@@ -1,17 +1,21 @@
-import os
+import asyncio
+import logging
+import threading
 from datetime import datetime, timezone
-from typing import List, Optional
-from pydantic import BaseModel, Field, validator
-from langchain_core.output_parsers import PydanticOutputParser
-from langchain_core.prompts import PromptTemplate
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from cachetools import TTLCache, cached
+from pydantic import BaseModel, Field, field_validator
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
-from dotenv import load_dotenv
 from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
 import time
 from .usage_tracker import track_openai_api_call
+from .llm import get_chat_model
 
-# Load environment variables from .env file
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 class ExpenseData(BaseModel):
     """Data structure for parsed expense information"""
@@ -23,55 +27,78 @@ class ExpenseData(BaseModel):
     main_tag_icon: Optional[str] = Field(default=None, description="Font Awesome icon name for the primary area tag")
     
     # Add validation to ensure amount is positive
-    @validator('amount')
+    @field_validator('amount')
+    @classmethod
     def amount_must_be_positive(cls, v):
         if v < 0:
             raise ValueError("Amount must be positive")
         return v
 
-def create_expense_parser(db_client, default_currency):
-    """Create a LangChain parser for expense data"""
-    # Get API key from environment variable
-    api_key = os.environ.get("OPENAI_API_KEY")
-    
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY environment variable not found")
-    
-    # Remove quotes if they're present in the API key
-    if api_key.startswith('"') and api_key.endswith('"'):
-        api_key = api_key[1:-1]
-    
-    print(f"Using API key starting with: {api_key[:5]}...")
-    
-    model = ChatOpenAI(
-        model="gpt-4.1-nano",  # Fastest, cheapest model available
-        temperature=0.3,  # Low temperature for more deterministic outputs
-        openai_api_key=api_key,  # Explicitly pass the API key
+# How long the `tags` collection snapshot (prompt examples + icons) is
+# reused before the collection is read again
+TAGS_CACHE_TTL_SECONDS = 300
+
+# How long a user's default currency is reused before re-reading their profile
+USER_CURRENCY_TTL_SECONDS = 300
+
+_CURRENCY_CACHE = TTLCache(maxsize=4096, ttl=USER_CURRENCY_TTL_SECONDS)
+_CURRENCY_LOCK = threading.Lock()
+
+# How long the parse of a given expense text is reused (identical inputs skip the LLM call)
+PARSE_CACHE_TTL_SECONDS = 3600
+
+_PARSE_CACHE = TTLCache(maxsize=10_000, ttl=PARSE_CACHE_TTL_SECONDS)
+_PARSE_LOCK = threading.Lock()
+
+# Small pool used to overlap the Firestore reads done before the LLM call
+_PREFETCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="expense-prefetch")
+
+class TagsSnapshot(NamedTuple):
+    """What the parsers need from the `tags` collection"""
+    area_examples: str
+    context_examples: str
+    icons: Dict[str, str]  # tag document id -> Font Awesome icon
+
+def _get_model() -> ChatOpenAI:
+    """Chat model of the expense parsers (cached and sharing the app-wide HTTP connection pool)"""
+    return get_chat_model("gpt-4.1-nano", 0.3)  # Fastest, cheapest model available, low temperature
+
+def _active_tags(db_client, facet: str) -> List[Tuple[str, dict]]:
+    """(doc id, data) of the active tags of one facet, filtered server-side"""
+    query = (
+        db_client.collection('tags')
+        .where(filter=FieldFilter('active', '==', True))
+        .where(filter=FieldFilter('facet', '==', facet))
+        .select(['tag_id', 'icon'])
     )
+    return [(doc.id, doc.to_dict() or {}) for doc in query.stream()]
+
+@cached(
+    cache=TTLCache(maxsize=1, ttl=TAGS_CACHE_TTL_SECONDS),
+    key=lambda db_client: "tags",
+    lock=threading.Lock(),
+)
+def _load_tags(db_client) -> TagsSnapshot:
+    """Fetch the active area and context tags and index them (cached with a TTL)"""
+    area_docs = _active_tags(db_client, 'area')
+    context_docs = _active_tags(db_client, 'context')
     
-    # Set up the Pydantic output parser with our ExpenseData model
-    parser = PydanticOutputParser(pydantic_object=ExpenseData)
-    
-    # Fetch tags dynamically from Firestore
-    tags_docs = db_client.collection('tags').stream()
-    area_tags = []
-    context_tags = []
-    for doc in tags_docs:
-        data = doc.to_dict()
-        if not data.get("active", False):
-            continue
-        tag_id = data.get("tag_id", doc.id)
-        facet = data.get("facet", "")
-        if facet == "area":
-            area_tags.append(tag_id)
-        elif facet == "context":
-            context_tags.append(tag_id)
-    area_examples = ", ".join(area_tags)
-    context_examples = ", ".join(context_tags)
-
-    # Create a prompt template with improved handling for simple formats
-    prompt = PromptTemplate( 
-    template=""" 
+    area_tags = [data.get("tag_id", doc_id) for doc_id, data in area_docs]
+    context_tags = [data.get("tag_id", doc_id) for doc_id, data in context_docs]
+    icons = {doc_id: data['icon'] for doc_id, data in area_docs + context_docs if 'icon' in data}
+    return TagsSnapshot(", ".join(area_tags), ", ".join(context_tags), icons)
+
+def _icon_map(db_client) -> Dict[str, str]:
+    """Mapping of tag id to icon for every tag that defines one"""
+    return _load_tags(db_client).icons
+
+def invalidate_tags_snapshot() -> None:
+    """Drop the cached tags snapshot, e.g. after a tag was created, updated or deleted"""
+    _load_tags.cache_clear()
+
+# Static instructions of the expense parser: kept free of per-user values so
+# the prompt prefix is identical across requests and eligible for prompt caching
+_EXPENSE_SYSTEM_PROMPT = """
         You are an AI assistant that extracts expense information from text. 
         Extract the following details from the user's expense description: 
  
@@ -79,15 +106,15 @@ def create_expense_parser(db_client, default_currency):
  
         2. The currency - REQUIRED 
            - Always return a 3-letter currency code (USD, EUR, GBP, etc.) 
-           - If the user doesn't specify a currency, assume {default_currency} 
+           - If the user doesn't specify a currency, assume the default currency given with the expense
  
         3. Area tags (REQUIRED): Tags that categorize what the expense is for, the object actually bought (could be multiple!).  
-           Create appropriate tags for the expense category. Common examples include: {area_examples}
+           Create appropriate tags for the expense category, preferring the common area tags given with the expense.
            But feel free to create other relevant category tags as needed.
  
         4. Context tags (OPTIONAL): Tags that provide additional context, the people or events associated with the expense (could be multiple!). 
            This can include people's names, occasions, locations, or other relevant details.
-           Examples include: {context_examples}
+           The common context tags given with the expense are examples.
            Create any context tags that help describe the circumstances of the expense.
  
         5. Short text (REQUIRED): A brief description (1–4 words) of what was purchased. Include brands if provided or relevant details. 
@@ -100,25 +127,154 @@ def create_expense_parser(db_client, default_currency):
         - If the expense is in a different language, adapt the tags to the language used in the expense description
         - Don't use similar tags for area and context (e.g. "gift" and "gifts")
         - For food, assign the tag "food" but also try to infer if it also should have a "groceries" or "restaurant" tag
- 
-        {format_instructions} 
- 
-        User expense: {query} 
-        """, 
-            input_variables=["query"], 
-            partial_variables={
-                "format_instructions": parser.get_format_instructions(), 
-                "area_examples": area_examples, 
-                "context_examples": context_examples, 
-                "default_currency": default_currency
-            }, 
-        )
+        """
 
+@lru_cache(maxsize=32)
+def _build_chain(default_currency: str, area_examples: str, context_examples: str):
+    """Build the prompt+model chain for a given currency and set of tag examples"""
+    # The model replies through function calling, so it returns an ExpenseData directly
+    model = _get_model().with_structured_output(ExpenseData)
+
+    # Per-user values go in the last message, after the static instructions,
+    # so every request shares the same prompt prefix (cached by the provider)
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", _EXPENSE_SYSTEM_PROMPT),
+        ("human", """
+        Default currency: {default_currency}
+        Common area tags: {area_examples}
+        Common context tags: {context_examples}
+        
+        User expense: {query}
+        """),
+    ]).partial(
+        area_examples=area_examples,
+        context_examples=context_examples,
+        default_currency=default_currency
+    )
     
     # Create the chain
-    prompt_and_model = prompt | model
+    return prompt | model
+
+@cached(cache=_CURRENCY_CACHE, key=lambda db_client, user_id: user_id, lock=_CURRENCY_LOCK)
+def get_default_currency(db_client, user_id: str) -> str:
+    """Return the user's preferred currency, falling back to EUR (cached per user with a TTL)"""
+    user_doc = db_client.collection('users').document(user_id).get()
+    if user_doc.exists and 'currency' in user_doc.to_dict():
+        return user_doc.to_dict()['currency']
+    return 'EUR'
+
+def invalidate_default_currency(user_id: str) -> None:
+    """Drop the cached currency of a user, e.g. after they update their profile"""
+    with _CURRENCY_LOCK:
+        _CURRENCY_CACHE.pop(user_id, None)
+
+def prefetch_parser_inputs(db_client, user_id: str) -> Tuple[str, TagsSnapshot]:
+    """Read the user's currency and the tags snapshot concurrently (both are cached when warm)"""
+    tags_future = _PREFETCH_POOL.submit(_load_tags, db_client)
+    default_currency = get_default_currency(db_client, user_id)
+    return default_currency, tags_future.result()
+
+def fetch_main_tag_icon(db_client, area_tags: Optional[List[str]]) -> str:
+    """Return the Font Awesome icon of the first area tag, or the default 'tag' icon"""
+    if not area_tags:
+        return "tag"
+    
+    first_area_tag_id = area_tags[0].lower() # Assuming tag_ids are stored in lowercase
+    try:
+        return _icon_map(db_client).get(first_area_tag_id, "tag")
+    except Exception as e:
+        logger.warning("Error fetching tags from Firestore: %s", e)
+        return "tag"
+
+def attach_main_tag_icons(db_client, expenses: List[ExpenseData]) -> List[ExpenseData]:
+    """Set `main_tag_icon` on many parsed expenses from the cached tag icon map"""
+    try:
+        icons = _icon_map(db_client)
+    except Exception as e:
+        logger.warning("Error fetching tags from Firestore: %s", e)
+        icons = {}
     
-    return prompt_and_model, parser
+    for expense in expenses:
+        expense.main_tag_icon = icons.get(expense.area_tags[0].lower(), "tag") if expense.area_tags else "tag"
+    return expenses
+
+def create_expense_parser(db_client, default_currency, tags: Optional[TagsSnapshot] = None):
+    """Create the LangChain chain turning an expense text into an ExpenseData"""
+    # Fetch tags dynamically from Firestore (cached between calls)
+    if tags is None:
+        tags = _load_tags(db_client)
+    
+    return _build_chain(default_currency, tags.area_examples, tags.context_examples)
+
+def _parse_cache_key(text: str, default_currency: str, tags: TagsSnapshot) -> tuple:
+    """
+    Key of a parse in the result cache.
+    
+    Besides the whitespace-normalized text, it includes everything else the prompt
+    is built from, so a change of currency or of the tag examples misses the cache.
+    """
+    return (" ".join(text.split()), default_currency, tags.area_examples, tags.context_examples)
+
+def _get_cached_parse(key: tuple) -> Optional[ExpenseData]:
+    """Copy of a cached parse (callers set fields like `main_tag_icon` on it), or None"""
+    with _PARSE_LOCK:
+        result = _PARSE_CACHE.get(key)
+    return result.model_copy(deep=True) if result is not None else None
+
+def _cache_parse(key: tuple, result: ExpenseData) -> None:
+    """Store a successful parse in the result cache"""
+    with _PARSE_LOCK:
+        _PARSE_CACHE[key] = result.model_copy(deep=True)
+
+def _track_expense_parse(user_id: str, db_client, text: str, result: ExpenseData, request_duration: float, function: str):
+    """Record the LLM usage of an expense parse, never failing the parse itself"""
+    try:
+        output_text = str(result.model_dump()) if hasattr(result, 'model_dump') else str(result)
+        track_openai_api_call(
+            user_id=user_id,
+            db_client=db_client,
+            agent_name="expense_parser",
+            model="gpt-4.1-nano",
+            input_text=text,
+            output_text=output_text,
+            request_duration=request_duration,
+            metadata={"function": function, "success": True}
+        )
+    except Exception as e:
+        logger.warning("Failed to track usage: %s", e)
+
+def _utc_now_iso() -> str:
+    """Current UTC time as an ISO 8601 string with a 'Z' suffix"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def _to_result_dict(result: ExpenseData, text: str, user_id: str) -> dict:
+    """Convert a parsed expense to the dict returned to callers"""
+    # Convert to dict and add the user_id, timestamp, and raw_text
+    result_dict = result.model_dump()
+    result_dict["user_id"] = user_id
+    
+    # Use the original text directly
+    result_dict["raw_text"] = text
+    
+    # Always use current timestamp
+    result_dict["timestamp"] = _utc_now_iso()
+    return result_dict
+
+def _fallback_expense(text: str, user_id: str) -> dict:
+    """Basic structure returned when parsing fails, keeping the raw text"""
+    fallback = {
+        "user_id": user_id,
+        "amount": 0.0,
+        "currency": "EUR",  # Default currency
+        "timestamp": _utc_now_iso(),
+        "raw_text": text,
+        "area_tags": [],
+        "context_tags": [],
+        "short_text": "generic purchase",
+        "main_tag_icon": "tag" # Default icon for fallback
+    }
+    logger.debug("Returning fallback: %s", fallback)
+    return fallback
 
 def parse_expense(text: str, user_id: str, db_client: firestore.Client) -> dict:
     """
@@ -132,94 +288,86 @@ def parse_expense(text: str, user_id: str, db_client: firestore.Client) -> dict:
     Returns:
         A dictionary containing the parsed expense information
     """
-    print(f"Parsing expense: '{text}' for user: {user_id}")
+    logger.debug("Parsing expense: %r for user: %s", text, user_id)
     
     try:
-        # Fetch user's default currency
-        user_doc = db_client.collection('users').document(user_id).get()
-        if user_doc.exists and 'currency' in user_doc.to_dict():
-            default_currency = user_doc.to_dict()['currency']
-        else:
-            default_currency = 'EUR'
-        
-        # Create the parser chain
-        prompt_and_model, parser = create_expense_parser(db_client, default_currency)
-        
-        # Get the model output
-        print(f"Sending to LLM: '{text}'")
-        start_time = time.time()
-        output = prompt_and_model.invoke({"query": text})
-        end_time = time.time()
-        print(f"LLM output: {output}")
-        
-        # Parse the output into our Pydantic model
-        result = parser.invoke(output)
-        print(f"Parsed result: {result}")
-        
-        # Track the API call
-        try:
-            output_text = str(result.dict()) if hasattr(result, 'dict') else str(result)
-            track_openai_api_call(
-                user_id=user_id,
-                db_client=db_client,
-                agent_name="expense_parser",
-                model="gpt-4.1-nano",
-                input_text=text,
-                output_text=output_text,
-                request_duration=end_time - start_time,
-                metadata={"function": "parse_expense", "success": True}
-            )
-        except Exception as e:
-            print(f"Warning: Failed to track usage: {e}")
-        
-        # Convert to dict and add the user_id, timestamp, and raw_text
-        result_dict = result.dict()  # Use .dict() instead of model_dump() in Pydantic v1
-        result_dict["user_id"] = user_id
+        # Fetch user's default currency and the tags in parallel
+        default_currency, tags = prefetch_parser_inputs(db_client, user_id)
         
-        # Use the original text directly
-        result_dict["raw_text"] = text
+        cache_key = _parse_cache_key(text, default_currency, tags)
+        result = _get_cached_parse(cache_key)
+        if result is not None:
+            logger.debug("Parse cache hit for: %r", text)
+        else:
+            # Create the parser chain
+            chain = create_expense_parser(db_client, default_currency, tags)
+            
+            # Get the structured model output
+            logger.debug("Sending to LLM: %r", text)
+            start_time = time.time()
+            result = chain.invoke({"query": text})
+            end_time = time.time()
+            logger.debug("Parsed result: %s", result)
+            _cache_parse(cache_key, result)
+            
+            # Track the API call
+            _track_expense_parse(user_id, db_client, text, result, end_time - start_time, "parse_expense")
         
-        # Always use current timestamp (fix deprecated warning)
-        result_dict["timestamp"] = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+        result_dict = _to_result_dict(result, text, user_id)
 
         # Fetch icon for the first area_tag
-        result_dict["main_tag_icon"] = "tag" # Default icon
-        if result_dict.get("area_tags") and len(result_dict["area_tags"]) > 0:
-            first_area_tag_id = result_dict["area_tags"][0].lower() # Assuming tag_ids are stored in lowercase
-            try:
-                tag_ref = db_client.collection('tags').document(first_area_tag_id)
-                tag_doc = tag_ref.get()
-                if tag_doc.exists:
-                    tag_data = tag_doc.to_dict()
-                    if tag_data and 'icon' in tag_data:
-                        result_dict["main_tag_icon"] = tag_data['icon']
-                        print(f"Found icon '{tag_data['icon']}' for tag '{first_area_tag_id}'")
-                    else:
-                        print(f"Tag '{first_area_tag_id}' found but has no icon field.")
-                else:
-                    print(f"Tag '{first_area_tag_id}' not found in Firestore.")
-            except Exception as e:
-                print(f"Error fetching tag '{first_area_tag_id}' from Firestore: {str(e)}")
+        result_dict["main_tag_icon"] = fetch_main_tag_icon(db_client, result_dict.get("area_tags"))
         
-        print(f"Final result with icon: {result_dict}")
+        logger.debug("Final result with icon: %s", result_dict)
         return result_dict
     except Exception as e:
-        # Print the error for debugging
-        print(f"Error parsing expense: {str(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
+        # Log the error with its traceback for debugging
+        logger.exception("Error parsing expense: %s", e)
         
         # If parsing fails, return a basic structure with the raw text
-        fallback = {
-            "user_id": user_id,
-            "amount": 0.0,
-            "currency": "EUR",  # Default currency
-            "timestamp": datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
-            "raw_text": text,
-            "area_tags": [],
-            "context_tags": [],
-            "short_text": "generic purchase",
-            "main_tag_icon": "tag" # Default icon for fallback
-        }
-        print(f"Returning fallback: {fallback}")
-        return fallback
+        return _fallback_expense(text, user_id)
+
+async def aparse_expense_data(text: str, user_id: str, db_client: firestore.Client) -> ExpenseData:
+    """
+    Parse one expense text into a validated ExpenseData, awaiting the LLM call.
+    
+    The (sync) Firestore lookups are offloaded to worker threads so the event loop
+    stays free while they run. Raises on failure and leaves `main_tag_icon` unset,
+    so callers can attach icons of many expenses together with `attach_main_tag_icons`.
+    """
+    default_currency, tags = await asyncio.gather(
+        asyncio.to_thread(get_default_currency, db_client, user_id),
+        asyncio.to_thread(_load_tags, db_client),
+    )
+    cache_key = _parse_cache_key(text, default_currency, tags)
+    result = _get_cached_parse(cache_key)
+    if result is not None:
+        return result
+    
+    chain = create_expense_parser(db_client, default_currency, tags)
+    
+    start_time = time.time()
+    result = await chain.ainvoke({"query": text})
+    end_time = time.time()
+    _cache_parse(cache_key, result)
+    
+    await asyncio.to_thread(
+        _track_expense_parse, user_id, db_client, text, result, end_time - start_time, "aparse_expense"
+    )
+    return result
+
+async def aparse_expense(text: str, user_id: str, db_client: firestore.Client) -> dict:
+    """
+    Async variant of `parse_expense` that awaits the LLM call instead of blocking a thread.
+    
+    `main_tag_icon` is left for the caller to resolve.
+    """
+    logger.debug("Parsing expense (async): %r for user: %s", text, user_id)
+    
+    try:
+        result = await aparse_expense_data(text, user_id, db_client)
+        return _to_result_dict(result, text, user_id)
+    except Exception as e:
+        logger.exception("Error parsing expense: %s", e)
+        
+        return _fallback_expense(text, user_id)
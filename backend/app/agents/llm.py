@@ -0,0 +1,76 @@
+import os
+from functools import lru_cache
+from typing import Optional
+import httpx
+from langchain_openai import ChatOpenAI
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+def _clean_api_key(api_key: Optional[str]) -> Optional[str]:
+    """Remove the quotes that sometimes wrap the key in .env files"""
+    if api_key and api_key.startswith('"') and api_key.endswith('"'):
+        return api_key[1:-1]
+    return api_key
+
+# OpenAI API key, read once at import (None when not configured)
+OPENAI_API_KEY = _clean_api_key(os.environ.get("OPENAI_API_KEY"))
+
+def require_api_key() -> str:
+    """Return the OpenAI API key, raising if it is not configured"""
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY environment variable not found")
+    return OPENAI_API_KEY
+
+# HTTP connection pools shared by every chat model, so TCP/TLS sessions
+# to the OpenAI API are reused across requests and agents. HTTP/2 multiplexes
+# concurrent calls (e.g. batched tag generation) over the same connections.
+_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+# Fail fast when the API is unreachable, but leave long generations time to finish
+_HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+_sync_client = httpx.Client(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT, http2=True)
+_async_client = httpx.AsyncClient(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT, http2=True)
+
+# Client for raw REST calls to the OpenAI API (e.g. vision requests), with the
+# base URL and auth headers set once instead of on every request
+_openai_rest_client = httpx.AsyncClient(
+    base_url="https://api.openai.com/v1",
+    headers={"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"} if OPENAI_API_KEY else {},
+    timeout=httpx.Timeout(30.0, connect=5.0),
+    limits=_HTTP_LIMITS,
+    http2=True,
+)
+
+def get_openai_rest_client() -> httpx.AsyncClient:
+    """Async HTTP client bound to the OpenAI API, for calls made without LangChain or the SDK"""
+    return _openai_rest_client
+
+@lru_cache(maxsize=1)
+def get_openai_client() -> AsyncOpenAI:
+    """Raw OpenAI SDK client (files, batches, ...) on the shared async HTTP client"""
+    return AsyncOpenAI(api_key=require_api_key(), http_client=_async_client)
+
+@lru_cache(maxsize=None)
+def get_chat_model(model: str, temperature: float, max_tokens: Optional[int] = None) -> ChatOpenAI:
+    """
+    Return the (cached) chat model for a model name and temperature, on the shared HTTP clients
+    
+    max_tokens caps the length of each reply (no cap by default).
+    """
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        timeout=_HTTP_TIMEOUT,
+        openai_api_key=require_api_key(),
+        http_client=_sync_client,
+        http_async_client=_async_client,
+    )
+
+async def aclose_http_clients() -> None:
+    """Close the shared HTTP clients (called on application shutdown)"""
+    _sync_client.close()
+    await _async_client.aclose()
+    await _openai_rest_client.aclose()
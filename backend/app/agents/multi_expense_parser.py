@@ -1,55 +1,141 @@
-import os
+import re
+import logging
 import time
 import asyncio
+from dataclasses import dataclass
 from datetime import datetime, timezone
+from functools import lru_cache
 from typing import List, Dict, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from pydantic import BaseModel, Field
-from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-from dotenv import load_dotenv
 from google.cloud import firestore
 from .usage_tracker import track_openai_api_call
-from .expense_parser import parse_expense, ExpenseData
+from .llm import get_chat_model
+from .expense_parser import (
+    aparse_expense_data,
+    ExpenseData,
+    get_default_currency,
+    attach_main_tag_icons,
+    _get_model,
+    _load_tags,
+)
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-class MultiExpenseResult(BaseModel):
-    """Result structure for multi-expense parsing"""
-    expenses: List[ExpenseData] = Field(description="List of parsed expense objects")
-    total_count: int = Field(description="Total number of expenses parsed")
-    processing_time: float = Field(description="Time taken to process in seconds")
-    original_text: str = Field(description="Original input text")
-    error: str = Field(default="", description="Error message if any")
+# Match monetary patterns: "10 euros", "$5", "€3.50", etc.
+MONEY_RE = re.compile(
+    r'(?:€|£|\$|¥)?\d+(?:\.\d{2})?(?:\s*(?:euros?|dollars?|pounds?|yen|gbp|usd|eur|jpy))?',
+    re.IGNORECASE
+)
+
+# Deadline of each individual expense parse in the split fallback path
+EXPENSE_PARSE_TIMEOUT_SECONDS = 8
+
+@dataclass(slots=True)
+class MultiExpenseResult:
+    """Result structure for multi-expense parsing (plain container, never validated against LLM output)"""
+    expenses: List[ExpenseData]  # List of parsed expense objects
+    total_count: int  # Total number of expenses parsed
+    processing_time: float  # Time taken to process in seconds
+    original_text: str  # Original input text
+    error: str = ""  # Error message if any
 
 class ExpenseListData(BaseModel):
     """Data structure for splitting multi-expense text into individual expense strings"""
     individual_expenses: List[str] = Field(description="List of individual expense descriptions extracted from the text")
 
-async def split_multi_expense_text(text: str, user_id: str, db_client: firestore.Client) -> List[str]:
+class ExpenseBatchData(BaseModel):
+    """Data structure for all the expenses extracted from a multi-expense text in one LLM call"""
+    expenses: List[ExpenseData] = Field(description="List of parsed expenses, one per purchase mentioned in the text, in order")
+
+@lru_cache(maxsize=32)
+def _build_batch_chain(default_currency: str, area_examples: str, context_examples: str):
+    """Build the prompt+model chain that extracts every expense of a text in a single call"""
+    prompt = PromptTemplate(
+        template="""
+        You are an AI assistant that extracts expense information from text.
+        The user's text may contain several expenses: extract EACH of them as a separate expense object.
+        
+        For every expense extract:
+        1. The amount spent - REQUIRED
+        2. The currency - REQUIRED, as a 3-letter code (USD, EUR, GBP, etc.). If not specified, assume {default_currency}
+        3. Area tags (REQUIRED): what the expense is for (could be multiple). Common examples include: {area_examples}
+        4. Context tags (OPTIONAL): people, occasions or events associated with the expense (could be multiple). Examples include: {context_examples}
+        5. Short text (REQUIRED): a brief description (1–4 words) of what was purchased
+        
+        Guidelines:
+        - Preserve the original amount and currency of each expense
+        - Be consistent with tag naming (use lowercase, simple terms)
+        - If a person is mentioned include their name as a context tag
+        - If the expenses are in a different language, adapt the tags to the language used
+        - Don't use similar tags for area and context (e.g. "gift" and "gifts")
+        - For food, assign the tag "food" but also try to infer if it also should have a "groceries" or "restaurant" tag
+        
+        Examples:
+        [1] Input: "$10 for coffee, $15 for lunch"
+            Expenses: (10 USD, area: food, coffee, "coffee"), (15 USD, area: food, restaurant, "lunch")
+        [2] Input: "Morning coffee was 4.50, then a 20 euro gift for Anna"
+            Expenses: (4.50 {default_currency}, area: food, coffee, "morning coffee"), (20 EUR, area: gifts, context: gift, Anna, "gift for Anna")
+        
+        Multi-expense text: {query}
+        """,
+        input_variables=["query"],
+        partial_variables={
+            "area_examples": area_examples,
+            "context_examples": context_examples,
+            "default_currency": default_currency
+        },
+    )
+    
+    return prompt | _get_model().with_structured_output(ExpenseBatchData)
+
+async def parse_expenses_batch(text: str, user_id: str, db_client: firestore.Client) -> List[ExpenseData]:
     """
-    Use GPT-4o-nano to intelligently split multi-expense text into individual expense strings
+    Extract all expenses from a multi-expense text with a single LLM call.
+    
+    Raises if the model output does not validate against the expected schema,
+    so callers can fall back to the split + per-expense parsing path.
     """
-    # Get API key from environment variable
-    api_key = os.environ.get("OPENAI_API_KEY")
+    default_currency, tags = await asyncio.gather(
+        asyncio.to_thread(get_default_currency, db_client, user_id),
+        asyncio.to_thread(_load_tags, db_client),
+    )
+    chain = _build_batch_chain(default_currency, tags.area_examples, tags.context_examples)
     
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY environment variable not found")
+    start_time = time.time()
+    result = await chain.ainvoke({"query": text})
+    end_time = time.time()
     
-    # Remove quotes if they're present in the API key
-    if api_key.startswith('"') and api_key.endswith('"'):
-        api_key = api_key[1:-1]
+    # Track the API call
+    try:
+        await asyncio.to_thread(
+            track_openai_api_call,
+            user_id=user_id,
+            db_client=db_client,
+            agent_name="multi_expense_parser",
+            model="gpt-4.1-nano",
+            input_text=text,
+            output_text=str(result.expenses),
+            request_duration=end_time - start_time,
+            metadata={"function": "parse_expenses_batch", "success": True}
+        )
+    except Exception as e:
+        logger.warning("Failed to track usage: %s", e)
     
-    model = ChatOpenAI(
-        model="gpt-4.1-nano",
-        temperature=0.1,  # Very low temperature for consistent splitting
-        openai_api_key=api_key,
-    )
+    expenses = []
+    for expense in result.expenses:
+        if expense.amount <= 0:
+            logger.debug("Skipping expense with invalid amount: %s", expense)
+            continue
+        expenses.append(expense)
     
-    # Set up the Pydantic output parser for expense list
-    parser = PydanticOutputParser(pydantic_object=ExpenseListData)
+    # Resolve all icons from the cached tag icon map
+    return await asyncio.to_thread(attach_main_tag_icons, db_client, expenses)
+
+@lru_cache(maxsize=1)
+def _build_split_chain():
+    """Build the prompt+model chain splitting a multi-expense text into individual expense strings"""
+    model = get_chat_model("gpt-4.1-nano", 0.1)  # Very low temperature for consistent splitting
     
     # Create a prompt template for splitting expenses
     prompt = PromptTemplate(
@@ -73,16 +159,18 @@ async def split_multi_expense_text(text: str, user_id: str, db_client: firestore
         Input: "Morning coffee was $4.50, then lunch at $18.75"
         Output: ["Morning coffee was $4.50", "lunch at $18.75"]
         
-        {format_instructions}
-        
         Multi-expense text: {query}
         """,
         input_variables=["query"],
-        partial_variables={"format_instructions": parser.get_format_instructions()},
     )
     
-    # Create the chain
-    chain = prompt | model | parser
+    return prompt | model.with_structured_output(ExpenseListData)
+
+async def split_multi_expense_text(text: str, user_id: str, db_client: firestore.Client) -> List[str]:
+    """
+    Use GPT-4o-nano to intelligently split multi-expense text into individual expense strings
+    """
+    chain = _build_split_chain()
     
     try:
         start_time = time.time()
@@ -92,7 +180,8 @@ async def split_multi_expense_text(text: str, user_id: str, db_client: firestore
         # Track the API call
         try:
             output_text = str(result.individual_expenses) if hasattr(result, 'individual_expenses') else str(result)
-            track_openai_api_call(
+            await asyncio.to_thread(
+                track_openai_api_call,
                 user_id=user_id,
                 db_client=db_client,
                 agent_name="multi_expense_parser_splitter",
@@ -103,15 +192,38 @@ async def split_multi_expense_text(text: str, user_id: str, db_client: firestore
                 metadata={"function": "split_multi_expense_text", "success": True}
             )
         except Exception as e:
-            print(f"Warning: Failed to track usage: {e}")
+            logger.warning("Failed to track usage: %s", e)
         
         return result.individual_expenses
     except Exception as e:
-        print(f"Error splitting multi-expense text: {e}")
+        logger.warning("Error splitting multi-expense text, using naive split: %s", e)
         # Fallback: simple comma/and splitting
         parts = text.replace(' and ', ', ').split(',')
         return [part.strip() for part in parts if part.strip()]
 
+async def _parse_single_expense(expense_text: str, text: str, user_id: str, db_client: firestore.Client, start_time: float) -> MultiExpenseResult:
+    """Parse one expense with the regular parser and wrap it in a MultiExpenseResult"""
+    try:
+        expense_data = await aparse_expense_data(expense_text, user_id, db_client)
+    except Exception as e:
+        logger.warning("Expense parsing failed for %r: %s", expense_text, e)
+        return MultiExpenseResult(
+            expenses=[],
+            total_count=0,
+            processing_time=time.time() - start_time,
+            original_text=text,
+            error="Failed to parse single expense"
+        )
+    
+    await asyncio.to_thread(attach_main_tag_icons, db_client, [expense_data])
+    return MultiExpenseResult(
+        expenses=[expense_data],
+        total_count=1,
+        processing_time=time.time() - start_time,
+        original_text=text,
+        error=""
+    )
+
 async def parse_multiple_expenses(text: str, user_id: str, db_client: firestore.Client) -> MultiExpenseResult:
     """
     Parse multiple expenses from text using parallel processing
@@ -119,62 +231,65 @@ async def parse_multiple_expenses(text: str, user_id: str, db_client: firestore.
     start_time = time.time()
     
     try:
-        print(f"Starting multi-expense parsing for: '{text}'")
+        logger.debug("Starting multi-expense parsing for: %r", text)
         
-        # Step 1: Split the text into individual expense descriptions (async)
-        expense_texts = await split_multi_expense_text(text, user_id, db_client)
+        # At most one amount in the text: skip the splitting/batching and parse it directly
+        if detect_expense_count(text) == 'single':
+            return await _parse_single_expense(text, text, user_id, db_client, start_time)
         
-        print(f"Split into {len(expense_texts)} parts: {expense_texts}")
-        
-        if len(expense_texts) == 1:
-            # Single expense detected, use regular parser
-            result_dict = parse_expense(expense_texts[0], user_id, db_client)
-            if result_dict:
-                # Convert dict to ExpenseData object
-                expense_data = ExpenseData(**result_dict)
+        # Fast path: extract every expense with a single batched LLM call
+        try:
+            expenses = await parse_expenses_batch(text, user_id, db_client)
+            if expenses:
                 return MultiExpenseResult(
-                    expenses=[expense_data],
-                    total_count=1,
+                    expenses=expenses,
+                    total_count=len(expenses),
                     processing_time=time.time() - start_time,
                     original_text=text,
                     error=""
                 )
-            else:
-                return MultiExpenseResult(
-                    expenses=[],
-                    total_count=0,
-                    processing_time=time.time() - start_time,
-                    original_text=text,
-                    error="Failed to parse single expense"
-                )
+            logger.debug("Batched parse returned no valid expenses, falling back to split parsing")
+        except Exception as e:
+            logger.info("Batched parse failed, falling back to split parsing: %s", e)
+        
+        # Step 1: Split the text into individual expense descriptions (async)
+        expense_texts = await split_multi_expense_text(text, user_id, db_client)
+        
+        logger.debug("Split into %d parts: %s", len(expense_texts), expense_texts)
         
-        # Step 2: Process all expenses in parallel using ThreadPoolExecutor
+        if len(expense_texts) == 1:
+            # Single expense detected, use regular parser
+            return await _parse_single_expense(expense_texts[0], text, user_id, db_client, start_time)
+        
+        # Step 2: Process all expenses concurrently on the event loop
         expenses = []
         errors = []
         
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            # Submit all parsing tasks
-            future_to_text = {
-                executor.submit(parse_expense, expense_text, user_id, db_client): expense_text
+        # Each expense gets its own deadline, so one slow call doesn't sink the others
+        results = await asyncio.gather(
+            *[
+                asyncio.wait_for(aparse_expense_data(expense_text, user_id, db_client), timeout=EXPENSE_PARSE_TIMEOUT_SECONDS)
                 for expense_text in expense_texts
-            }
-            
-            # Collect results as they complete (with timeout)
-            for future in as_completed(future_to_text, timeout=30):
-                expense_text = future_to_text[future]
-                try:
-                    result_dict = future.result()
-                    if result_dict and result_dict.get('amount', 0) > 0:  # Only add successful parses with valid amounts
-                        # Convert dict to ExpenseData object
-                        expense_data = ExpenseData(**result_dict)
-                        expenses.append(expense_data)
-                        print(f"Successfully parsed: {expense_text} -> {expense_data.short_text}")
-                    else:
-                        print(f"Failed to parse or invalid result for: {expense_text}")
-                        errors.append(f"Failed to parse: {expense_text}")
-                except Exception as exc:
-                    print(f'Expense parsing failed for "{expense_text}": {exc}')
-                    errors.append(f"Error parsing '{expense_text}': {str(exc)}")
+            ],
+            return_exceptions=True
+        )
+        
+        for expense_text, expense_data in zip(expense_texts, results):
+            if isinstance(expense_data, asyncio.TimeoutError):
+                logger.warning("Expense parsing timed out for %r", expense_text)
+                errors.append(f"Timeout parsing '{expense_text}'")
+            elif isinstance(expense_data, Exception):
+                logger.warning("Expense parsing failed for %r: %s", expense_text, expense_data)
+                errors.append(f"Error parsing '{expense_text}': {str(expense_data)}")
+            elif expense_data.amount > 0:  # Only add successful parses with valid amounts
+                expenses.append(expense_data)
+                logger.debug("Successfully parsed: %s -> %s", expense_text, expense_data.short_text)
+            else:
+                logger.debug("Failed to parse or invalid result for: %s", expense_text)
+                errors.append(f"Failed to parse: {expense_text}")
+        
+        # Resolve all icons from the cached tag icon map
+        await asyncio.to_thread(attach_main_tag_icons, db_client, expenses)
         
         return MultiExpenseResult(
             expenses=expenses,
@@ -193,7 +308,7 @@ async def parse_multiple_expenses(text: str, user_id: str, db_client: firestore.
             error="Timeout while processing expenses"
         )
     except Exception as e:
-        print(f"Error in parse_multiple_expenses: {e}")
+        logger.exception("Error in parse_multiple_expenses: %s", e)
         return MultiExpenseResult(
             expenses=[],
             total_count=0,
@@ -206,12 +321,5 @@ def detect_expense_count(text: str) -> str:
     """
     Detect if text contains single or multiple expenses based on monetary amounts
     """
-    # Match monetary patterns: "10 euros", "$5", "€3.50", etc.
-    import re
-    money_regex = r'(?:€|£|\$|¥)?\d+(?:\.\d{2})?(?:\s*(?:euros?|dollars?|pounds?|yen|gbp|usd|eur|jpy))?'
-    matches = re.findall(money_regex, text, re.IGNORECASE)
-    
-    if not matches or len(matches) <= 1:
-        return 'single'  # 0 or 1 monetary amount = single expense parser
-    else:
-        return 'multiple'  # 2+ monetary amounts = multi-expense parser
+    # 0 or 1 monetary amount = single expense parser, 2+ = multi-expense parser
+    return 'multiple' if len(MONEY_RE.findall(text)) > 1 else 'single'
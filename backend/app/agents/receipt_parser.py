@@ -5,19 +5,118 @@ This module handles receipt image processing using GPT-4o vision to extract
 expense items and integrate them with the multi-expense parser.
 """
 
-import os
+import asyncio
 import base64
-from typing import Dict, List, Any
-from datetime import datetime, timezone
+import io
+import logging
+import re
+from typing import BinaryIO, Dict, List, Any, Optional, Tuple
+from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException, status
+from google.api_core.exceptions import FailedPrecondition
 from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from PIL import Image, ImageOps
 from .multi_expense_parser import parse_multiple_expenses
 from .usage_tracker import track_openai_api_call
+from .llm import OPENAI_API_KEY, get_openai_rest_client, get_openai_client
+from app.db import commit_in_batches, get_db
 import time
-import requests
+import httpx
+import orjson
+from tenacity import RetryCallState, retry, retry_if_exception_type, retry_if_result, stop_after_attempt, wait_exponential_jitter
+
+logger = logging.getLogger(__name__)
+
+# Firestore collection tracking receipts submitted to the OpenAI Batch API
+RECEIPT_BATCHES_COLLECTION = "receipt_batches"
+
+# How long a collect may hold a receipt batch before another one can take it over
+RECEIPT_BATCH_CLAIM_SECONDS = 900
+
+# Rate limiting and server-side errors are worth retrying
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Upper bound on a server-requested Retry-After wait, in seconds
+RETRY_AFTER_MAX_SECONDS = 10
+
+_backoff = wait_exponential_jitter(initial=1, max=10)
+
+def _retry_wait(retry_state: RetryCallState) -> float:
+    """Honour OpenAI's Retry-After header when present, otherwise back off exponentially with jitter"""
+    outcome = retry_state.outcome
+    if outcome is not None and not outcome.failed:
+        retry_after = outcome.result().headers.get("retry-after")
+        try:
+            return min(float(retry_after), RETRY_AFTER_MAX_SECONDS)
+        except (TypeError, ValueError):
+            pass
+    return _backoff(retry_state)
+
+# Receipt photos are downscaled to this long edge and re-encoded as JPEG before upload
+RECEIPT_MAX_DIMENSION = 1024
+RECEIPT_JPEG_QUALITY = 80
+
+# Images this small are sent with the "low" vision detail (fixed, cheaper token cost)
+LOW_DETAIL_MAX_DIMENSION = 512
+
+# Largest receipt upload accepted, checked before the image is read
+MAX_RECEIPT_BYTES = 20 * 1024 * 1024
+
+# Sentinel the model answers with when the image has no expenses (matched in any case)
+_NO_EXPENSES_RE = re.compile(r'NO_EXPENSES_FOUND', re.IGNORECASE)
+
+# Instructions sent with every receipt image. Kept byte-identical across calls
+# (text before the image) so OpenAI can reuse its prompt cache
+_RECEIPT_PROMPT = """
+                        Analyze this receipt image and extract all purchased items with their prices.
+                        
+                        Format your response as a simple text list that can be parsed by an expense parser.
+                        Each line should contain: item name and price (with currency symbol if visible).
+                        
+                        Rules:
+                        1. Only include actual purchased items (not tax, tips, subtotals, discounts, etc.)
+                        2. Add an expense called "Receipt Adjustments" to account for tax, tips, discounts, etc. to get to the total of the receipt (e.g. food 7$, drink 3$, taxes 2$, service 3$, discount 10%, subtotal 15$, Total 13.5$, "Receipt Adjustments" is 3.5 because it's the delta between 10$ of food and drink and 13.5$ of total). on this one write also between brackets (tag: "other")
+                        3. Include the currency symbol if clearly visible, otherwise use $ as default
+                        4. Be concise but descriptive for each item
+                        5. If no expenses are found in the image, respond with exactly: "NO_EXPENSES_FOUND"
+                        
+                        Example format:
+                        Coffee $4.50
+                        Sandwich $8.99
+                        Chips $2.25
+                        
+                        If this is not a receipt or contains no expenses, respond with: NO_EXPENSES_FOUND
+                        """
+
+def _prepare_receipt_image(image_file: BinaryIO) -> Tuple[bytes, str]:
+    """
+    Downscale and re-encode a receipt photo as JPEG, dropping its EXIF metadata.
+    
+    The upload is decoded straight from its file, so the original (possibly
+    multi-MB) image is never held in memory as a whole.
+    
+    Returns:
+        The image bytes to send and the vision "detail" level to request
+    """
+    try:
+        with Image.open(image_file) as image:
+            # Apply the EXIF orientation before the metadata is dropped
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((RECEIPT_MAX_DIMENSION, RECEIPT_MAX_DIMENSION))
+            detail = "low" if max(image.size) <= LOW_DETAIL_MAX_DIMENSION else "auto"
+            
+            buffer = io.BytesIO()
+            image.convert("RGB").save(buffer, "JPEG", quality=RECEIPT_JPEG_QUALITY, optimize=True)
+            return buffer.getvalue(), detail
+    except Exception as e:
+        # Unreadable by Pillow: let the vision model try the original upload
+        logger.warning("Could not re-encode receipt image, sending it as-is: %s", e)
+        image_file.seek(0)
+        return image_file.read(), "auto"
 
 async def parse_receipt_image(
-    image_content: bytes,
+    image_file: BinaryIO,
     user_id: str,
     save_to_db: bool = False,
     filename: str = "receipt.jpg"
@@ -29,7 +128,7 @@ async def parse_receipt_image(
     with their prices, then processes them through the multi-expense parser.
     
     Args:
-        image_content: Raw image bytes
+        image_file: Binary file of the uploaded image
         user_id: User ID for expense ownership
         save_to_db: Whether to save extracted expenses to database
         filename: Original filename for reference
@@ -40,39 +139,38 @@ async def parse_receipt_image(
     Raises:
         HTTPException: If image processing fails or no expenses found
     """
+    # Holds the usage update of the vision call until it is committed with the expenses
+    usage_batch = None
     try:
-        print(f"Processing receipt image: {filename}")
+        logger.info("Processing receipt image: %s", filename)
         
-        # Convert image to base64 for OpenAI Vision API
-        image_base64 = base64.b64encode(image_content).decode('utf-8')
-        
-        # Initialize OpenAI client
-        api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
+        # OpenAI API key (read once at import, validated at startup)
+        if not OPENAI_API_KEY:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="OpenAI API key not configured"
             )
         
-        # Remove quotes if present
-        if api_key.startswith('"') and api_key.endswith('"'):
-            api_key = api_key[1:-1]
+        # Shrink the photo before sending it to OpenAI Vision API
+        image_content, detail = await asyncio.to_thread(_prepare_receipt_image, image_file)
         
         # Initialize Firestore client
-        db = firestore.Client()
+        db = get_db()
+        if save_to_db:
+            usage_batch = db.batch()
         
         # Extract receipt items using GPT-4o vision
-        extracted_text = await _extract_receipt_items(image_base64, api_key, user_id, db)
+        extracted_text = await _extract_receipt_items(image_content, user_id, db, detail, usage_batch)
         
         # Check if no expenses were found
-        if "NO_EXPENSES_FOUND" in extracted_text.upper():
+        if _NO_EXPENSES_RE.search(extracted_text):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="No expenses found in the uploaded image. Please ensure this is a clear receipt photo."
             )
         
         # Process the extracted text through the multi-expense parser
-        print("Processing extracted text through multi-expense parser...")
+        logger.debug("Processing extracted text through multi-expense parser")
         multi_expense_result = await parse_multiple_expenses(extracted_text, user_id, db)
         
         # Check if any expenses were successfully parsed
@@ -84,28 +182,30 @@ async def parse_receipt_image(
         
         # If save_to_db is true, save all expenses to Firestore (using same logic as multi-expense parser)
         if save_to_db and multi_expense_result.expenses:
-            print(f"Saving {len(multi_expense_result.expenses)} expenses from receipt to Firestore")
+            logger.info("Saving %d expenses from receipt to Firestore", len(multi_expense_result.expenses))
             
             # Enhance expenses with database info (same as multi-expense parser endpoint)
-            enhanced_expenses = []
-            for expense in multi_expense_result.expenses:
-                # Convert ExpenseData to dict for saving
-                expense_dict = expense.dict()
-                expense_dict.update({
-                    "user_id": user_id,
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                    "raw_text": extracted_text,  # Use extracted text for context
-                    "receipt_source": True  # Flag to indicate this came from a receipt
-                })
-                
-                # Save to Firestore
-                doc_ref = db.collection('expenses').add(expense_dict)
-                expense_id = doc_ref[1].id
-                print(f"Receipt expense saved with ID: {expense_id}")
-                
-                # Add the database ID to the expense
-                expense_dict["id"] = expense_id
-                enhanced_expenses.append(expense_dict)
+            common_fields = {
+                "user_id": user_id,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "raw_text": extracted_text,  # Use extracted text for context
+                "receipt_source": True  # Flag to indicate this came from a receipt
+            }
+            enhanced_expenses = [{**expense.model_dump(), **common_fields} for expense in multi_expense_result.expenses]
+            
+            # Pre-generate the documents so all expenses are saved in one batch
+            expenses_collection = db.collection('expenses')
+            writes = [(expenses_collection.document(), expense_dict) for expense_dict in enhanced_expenses]
+            
+            # Save to Firestore, along with the usage of the vision call
+            await asyncio.to_thread(commit_in_batches, db, writes, usage_batch)
+            usage_batch = None
+            
+            # Add the database IDs to the expenses (after saving, so they are not stored in the documents)
+            for doc_ref, expense_dict in writes:
+                expense_dict["id"] = doc_ref.id
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Receipt expenses saved with IDs: %s", [doc_ref.id for doc_ref, _ in writes])
             
             # Return the enhanced result with full expense data
             return {
@@ -119,7 +219,7 @@ async def parse_receipt_image(
         
         # Return parsed result without saving (convert ExpenseData objects to dicts)
         return {
-            "expenses": [expense.dict() for expense in multi_expense_result.expenses],
+            "expenses": [expense.model_dump() for expense in multi_expense_result.expenses],
             "total_count": multi_expense_result.total_count,
             "processing_time": multi_expense_result.processing_time,
             "original_text": f"Receipt items: {extracted_text}",
@@ -127,74 +227,37 @@ async def parse_receipt_image(
             "receipt_filename": filename
         }
         
-    except HTTPException:
-        # Re-raise HTTP exceptions as-is
-        raise
-    except Exception as e:
-        import traceback
-        print(f"Error in parse_receipt_image: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error processing receipt: {str(e)}"
-        )
+    finally:
+        # Nothing was saved (e.g. no expenses found): still record the vision call usage
+        if usage_batch is not None:
+            try:
+                await asyncio.to_thread(usage_batch.commit)
+            except Exception as e:
+                logger.warning("Failed to track usage: %s", e)
 
 
-async def _extract_receipt_items(image_base64: str, api_key: str, user_id: str = None, db: firestore.Client = None) -> str:
-    """
-    Extract receipt items using OpenAI GPT-4o vision API.
-    
-    Args:
-        image_base64: Base64 encoded image
-        api_key: OpenAI API key
-        user_id: Optional user ID for usage tracking
-        db: Firestore client for usage tracking
-        
-    Returns:
-        Extracted text containing receipt items
-        
-    Raises:
-        HTTPException: If API call fails
-    """
-    # Call OpenAI Vision API to extract receipt items
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-    
-    payload = {
+def _image_data_url(image_content: bytes) -> str:
+    """Base64 data URL of a JPEG image, built without an intermediate base64 str"""
+    return (b"data:image/jpeg;base64," + base64.b64encode(image_content)).decode("ascii")
+
+def _vision_payload(image_content: bytes, detail: str = "auto") -> Dict[str, Any]:
+    """Chat completions request body asking GPT-4o to list the items of a receipt image"""
+    return {
         "model": "gpt-4o",
         "messages": [
+            # Static instructions first, so every request shares the same cacheable prefix
+            {
+                "role": "system",
+                "content": _RECEIPT_PROMPT
+            },
             {
                 "role": "user",
                 "content": [
-                    {
-                        "type": "text",
-                        "text": """
-                        Analyze this receipt image and extract all purchased items with their prices.
-                        
-                        Format your response as a simple text list that can be parsed by an expense parser.
-                        Each line should contain: item name and price (with currency symbol if visible).
-                        
-                        Rules:
-                        1. Only include actual purchased items (not tax, tips, subtotals, discounts, etc.)
-                        2. Add an expense called "Receipt Adjustments" to account for tax, tips, discounts, etc. to get to the total of the receipt (e.g. food 7$, drink 3$, taxes 2$, service 3$, discount 10%, subtotal 15$, Total 13.5$, "Receipt Adjustments" is 3.5 because it's the delta between 10$ of food and drink and 13.5$ of total). on this one write also between brackets (tag: "other")
-                        3. Include the currency symbol if clearly visible, otherwise use $ as default
-                        4. Be concise but descriptive for each item
-                        5. If no expenses are found in the image, respond with exactly: "NO_EXPENSES_FOUND"
-                        
-                        Example format:
-                        Coffee $4.50
-                        Sandwich $8.99
-                        Chips $2.25
-                        
-                        If this is not a receipt or contains no expenses, respond with: NO_EXPENSES_FOUND
-                        """
-                    },
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_base64}"
+                            "url": _image_data_url(image_content),
+                            "detail": detail
                         }
                     }
                 ]
@@ -203,32 +266,64 @@ async def _extract_receipt_items(image_base64: str, api_key: str, user_id: str =
         "max_tokens": 500,
         "temperature": 0.1
     }
+
+@retry(
+    retry=retry_if_exception_type(httpx.TransportError) | retry_if_result(lambda r: r.status_code in RETRYABLE_STATUS_CODES),
+    stop=stop_after_attempt(3),
+    wait=_retry_wait,
+    retry_error_callback=lambda state: state.outcome.result(),  # Hand back the last response (or raise its error)
+)
+async def _post_chat_completion(body: bytes) -> httpx.Response:
+    """POST a JSON body to the chat completions endpoint, retrying 429/5xx with exponential backoff"""
+    return await get_openai_rest_client().post("/chat/completions", content=body)
+
+async def _extract_receipt_items(
+    image_content: bytes,
+    user_id: str = None,
+    db: firestore.Client = None,
+    detail: str = "auto",
+    usage_batch: Optional[firestore.WriteBatch] = None
+) -> str:
+    """
+    Extract receipt items using OpenAI GPT-4o vision API.
+    
+    Args:
+        image_content: JPEG image bytes
+        user_id: Optional user ID for usage tracking
+        db: Firestore client for usage tracking
+        detail: Vision detail level ("low", "high" or "auto")
+        usage_batch: Optional WriteBatch the usage update is queued on instead of written directly
+        
+    Returns:
+        Extracted text containing receipt items
+        
+    Raises:
+        HTTPException: If API call fails
+    """
+    # Serialize the request once with orjson (also reused by retries); the payload holds the whole image
+    body = orjson.dumps(_vision_payload(image_content, detail))
     
-    print("Calling OpenAI Vision API...")
+    logger.debug("Calling OpenAI Vision API")
     start_time = time.time()
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions",
-        headers=headers,
-        json=payload,
-        timeout=30
-    )
+    response = await _post_chat_completion(body)
     end_time = time.time()
     
     if response.status_code != 200:
-        print(f"OpenAI API error: {response.status_code} - {response.text}")
+        logger.error("OpenAI API error: %s - %s", response.status_code, response.text)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"OpenAI Vision API error: {response.status_code}"
         )
     
-    result = response.json()
+    result = orjson.loads(response.content)
     extracted_text = result['choices'][0]['message']['content'].strip()
-    print(f"Extracted text from receipt: {extracted_text}")
+    logger.debug("Extracted text from receipt: %s", extracted_text)
     
     # Track usage if user_id and db are provided
     if user_id and db:
         try:
-            track_openai_api_call(
+            await asyncio.to_thread(
+                track_openai_api_call,
                 user_id=user_id,
                 db_client=db,
                 agent_name="receipt_parser_vision",
@@ -236,9 +331,195 @@ async def _extract_receipt_items(image_base64: str, api_key: str, user_id: str =
                 input_text="[Receipt Image Analysis]",
                 output_text=extracted_text,
                 request_duration=end_time - start_time,
-                metadata={"function": "receipt_vision", "success": True}
+                metadata={"function": "receipt_vision", "success": True},
+                batch=usage_batch
             )
         except Exception as e:
-            print(f"Warning: Failed to track usage: {e}")
+            logger.warning("Failed to track usage: %s", e)
     
     return extracted_text
+
+
+async def submit_receipt_batch(images: List[BinaryIO], user_id: str, db: firestore.Client) -> str:
+    """
+    Submit receipt images to the OpenAI Batch API for non-interactive parsing.
+    
+    Batched requests cost half of the synchronous endpoint but complete within 24h,
+    so this is meant for bulk imports, not for uploads the user is waiting on.
+    The batch is recorded in the `receipt_batches` collection; call
+    `collect_receipt_batch` later to parse and save its expenses.
+    
+    Args:
+        images: Binary file of each receipt image
+        user_id: User ID for expense ownership
+        db: Firestore client instance
+    
+    Returns:
+        The OpenAI batch ID
+    """
+    prepared = await asyncio.to_thread(lambda: [_prepare_receipt_image(image) for image in images])
+    lines = [
+        orjson.dumps({
+            "custom_id": f"receipt-{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": _vision_payload(image, detail)
+        })
+        for i, (image, detail) in enumerate(prepared)
+    ]
+    
+    client = get_openai_client()
+    batch_file = await client.files.create(file=("receipts.jsonl", b"\n".join(lines)), purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    
+    await asyncio.to_thread(db.collection(RECEIPT_BATCHES_COLLECTION).document(batch.id).set, {
+        "user_id": user_id,
+        "status": batch.status,
+        "image_count": len(images),
+        "processed": False,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+    logger.info("Submitted receipt batch %s with %d images", batch.id, len(images))
+    return batch.id
+
+
+def _is_claimed(batch_data: Dict[str, Any]) -> bool:
+    """Whether another caller is collecting the batch (a claim older than the timeout has been abandoned)"""
+    claimed_at = batch_data.get("claimed_at")
+    return claimed_at is not None and datetime.now(timezone.utc) - claimed_at < timedelta(seconds=RECEIPT_BATCH_CLAIM_SECONDS)
+
+async def _claim_receipt_batch(db: firestore.Client, batch_ref: firestore.DocumentReference, batch_doc) -> bool:
+    """
+    Mark a batch as being collected, unless it changed since batch_doc was read
+    (e.g. claimed by a concurrent collect): the update is conditioned on its update time.
+    """
+    try:
+        await asyncio.to_thread(
+            batch_ref.update,
+            {"claimed_at": datetime.now(timezone.utc)},
+            option=db.write_option(last_update_time=batch_doc.update_time)
+        )
+    except FailedPrecondition:
+        return False
+    return True
+
+async def collect_receipt_batch(batch_id: str, user_id: str, db: firestore.Client) -> Dict[str, Any]:
+    """
+    Check a submitted receipt batch and, once completed, parse and save its expenses.
+    
+    Args:
+        batch_id: ID returned by `submit_receipt_batch`
+        user_id: User ID owning the batch
+        db: Firestore client instance
+    
+    Returns:
+        The batch status, plus the saved expenses once the batch is processed
+        
+    Raises:
+        HTTPException: If the batch does not exist or belongs to another user
+    """
+    batch_ref = db.collection(RECEIPT_BATCHES_COLLECTION).document(batch_id)
+    batch_doc = await asyncio.to_thread(batch_ref.get)
+    if not batch_doc.exists or batch_doc.to_dict().get("user_id") != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Receipt batch not found"
+        )
+    
+    batch_data = batch_doc.to_dict()
+    if batch_data.get("processed"):
+        return {"batch_id": batch_id, "status": batch_data["status"], "expense_ids": batch_data.get("expense_ids", [])}
+    if _is_claimed(batch_data):
+        return {"batch_id": batch_id, "status": "processing", "expense_ids": []}
+    
+    client = get_openai_client()
+    batch = await client.batches.retrieve(batch_id)
+    if batch.status != "completed" or not batch.output_file_id:
+        await asyncio.to_thread(batch_ref.update, {"status": batch.status})
+        return {"batch_id": batch_id, "status": batch.status, "expense_ids": []}
+    
+    # Claim the batch first, so concurrent collects don't parse and save it twice
+    if not await _claim_receipt_batch(db, batch_ref, batch_doc):
+        return {"batch_id": batch_id, "status": "processing", "expense_ids": []}
+    
+    try:
+        output = await client.files.content(batch.output_file_id)
+    
+        writes = []
+        errors = []
+        expenses_collection = db.collection('expenses')
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            item = orjson.loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") != 200:
+                errors.append(f"{item['custom_id']}: request failed")
+                continue
+        
+            extracted_text = response["body"]['choices'][0]['message']['content'].strip()
+            if _NO_EXPENSES_RE.search(extracted_text):
+                errors.append(f"{item['custom_id']}: no expenses found")
+                continue
+        
+            try:
+                await asyncio.to_thread(
+                    track_openai_api_call,
+                    user_id=user_id,
+                    db_client=db,
+                    agent_name="receipt_parser_vision_batch",
+                    model="gpt-4o",
+                    input_text="[Receipt Image Analysis]",
+                    output_text=extracted_text,
+                    request_duration=0.0,
+                    metadata={"function": "receipt_vision_batch", "batch_id": batch_id, "success": True}
+                )
+            except Exception as e:
+                logger.warning("Failed to track usage: %s", e)
+        
+            multi_expense_result = await parse_multiple_expenses(extracted_text, user_id, db)
+            if multi_expense_result.error:
+                errors.append(f"{item['custom_id']}: {multi_expense_result.error}")
+        
+            common_fields = {
+                "user_id": user_id,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "raw_text": extracted_text,
+                "receipt_source": True,
+                "receipt_batch_id": batch_id
+            }
+            writes.extend(
+                (expenses_collection.document(), {**expense.model_dump(), **common_fields})
+                for expense in multi_expense_result.expenses
+            )
+    
+        # Save to Firestore, marking the batch processed in the same commit as the first expenses
+        expense_ids = [doc_ref.id for doc_ref, _ in writes]
+        write_batch = db.batch()
+        write_batch.update(batch_ref, {
+            "status": batch.status,
+            "processed": True,
+            "expense_ids": expense_ids,
+            "errors": errors,
+            "claimed_at": firestore.DELETE_FIELD
+        })
+        await asyncio.to_thread(commit_in_batches, db, writes, write_batch)
+        return {"batch_id": batch_id, "status": batch.status, "expense_ids": expense_ids, "errors": errors}
+    except Exception:
+        # Release the claim so the batch can be collected again
+        await asyncio.to_thread(batch_ref.update, {"claimed_at": firestore.DELETE_FIELD})
+        raise
+
+async def collect_pending_receipt_batches(user_id: str, db: firestore.Client) -> List[Dict[str, Any]]:
+    """Run `collect_receipt_batch` on every unprocessed receipt batch of a user (e.g. from a scheduled job)"""
+    query = (
+        db.collection(RECEIPT_BATCHES_COLLECTION)
+        .where(filter=FieldFilter('user_id', '==', user_id))
+        .where(filter=FieldFilter('processed', '==', False))
+    )
+    pending = await asyncio.to_thread(lambda: [doc.id for doc in query.stream()])
+    return [await collect_receipt_batch(batch_id, user_id, db) for batch_id in pending]
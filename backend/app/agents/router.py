@@ -1,26 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Response, status, File, UploadFile, Form
 from pydantic import BaseModel
-from typing import Dict, List, Optional
-from datetime import datetime, timezone
-import base64
-import io
+from typing import List, Literal, Optional
+import asyncio
+import logging
 from app.auth.dependencies import get_current_user
-from .expense_parser import parse_expense as ai_parse_expense, ExpenseData
-from .multi_expense_parser import parse_multiple_expenses, detect_expense_count, MultiExpenseResult
-from .tag_generator import generate_tag as ai_generate_tag
-from .receipt_parser import parse_receipt_image
-from .usage_service import UsageService
-from google.cloud import firestore
-import requests
-import os
+from app.db import acommit_in_batches, get_async_db, get_db
+from app.tags.cache import invalidate_tag
+from .expense_parser import parse_expense as ai_parse_expense, _utc_now_iso
+from .multi_expense_parser import parse_multiple_expenses
+from .tag_generator import generate_tag as ai_generate_tag, generate_tags_batch as ai_generate_tags_batch, TAG_BATCH_SIZE
+from .receipt_parser import MAX_RECEIPT_BYTES, parse_receipt_image, submit_receipt_batch, collect_receipt_batch, collect_pending_receipt_batches
+from .usage_service import get_usage_service
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["Agents"])
 
+# Content types accepted for receipt images
+_ALLOWED_IMAGE_TYPES = frozenset({'image/jpeg', 'image/jpg', 'image/png', 'image/webp'})
+_ALLOWED_IMAGE_TYPES_DETAIL = "Allowed types: image/jpeg, image/jpg, image/png, image/webp"
+
+# Maximum number of tag batches generated (LLM calls) at the same time by the bulk endpoint
+BULK_TAG_CONCURRENCY = 10
+
 class ExpenseQuery(BaseModel):
     """Request model for expense parsing"""
     text: str
     save_to_db: bool = False
 
+class TagQuery(BaseModel):
+    """Request model for single tag generation"""
+    tag_id: str
+    facet: Literal["area", "context"]
+
 class TagGenerationQuery(BaseModel):
     """Request model for bulk tag generation"""
     area: List[str] = []
@@ -35,8 +47,58 @@ class ReceiptParseQuery(BaseModel):
     """Request model for receipt parsing"""
     save_to_db: bool = False
 
+class ExpenseOut(BaseModel):
+    """A parsed expense, with its database fields when it was saved"""
+    amount: float
+    currency: str
+    area_tags: List[str] = []
+    context_tags: List[str] = []
+    short_text: str
+    main_tag_icon: Optional[str] = None
+    id: Optional[str] = None
+    user_id: Optional[str] = None
+    timestamp: Optional[str] = None
+    raw_text: Optional[str] = None
+    receipt_source: Optional[bool] = None
+
+class ReceiptParseResponse(BaseModel):
+    """Response model for receipt parsing"""
+    expenses: List[ExpenseOut]
+    total_count: int
+    processing_time: float
+    original_text: str
+    error: str = ""
+    receipt_filename: Optional[str] = None
+
+def _is_supported_image(header: bytes) -> bool:
+    """Whether the first bytes of a file are a JPEG, PNG or WEBP signature"""
+    return (
+        header.startswith(b"\xff\xd8\xff")
+        or header.startswith(b"\x89PNG\r\n\x1a\n")
+        or (header[:4] == b"RIFF" and header[8:12] == b"WEBP")
+    )
+
+async def _check_receipt_upload(file: UploadFile) -> None:
+    """
+    Reject a receipt upload that is too large or not actually an image, before any
+    tokens are spent on it (the declared content type is client-controlled).
+    """
+    if file.size is not None and file.size > MAX_RECEIPT_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File {file.filename} is too large. Maximum size: {MAX_RECEIPT_BYTES // (1024 * 1024)} MB"
+        )
+    
+    header = await file.read(12)
+    await file.seek(0)
+    if not _is_supported_image(header):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File {file.filename} is not a JPEG, PNG or WEBP image"
+        )
+
 @router.post('/expense_parser/')
-def parse_expense(query: ExpenseQuery, current_user: dict = Depends(get_current_user)):
+async def parse_expense(query: ExpenseQuery, current_user: dict = Depends(get_current_user)):
     """
     Parse expense information from text using AI.
     
@@ -58,47 +120,40 @@ def parse_expense(query: ExpenseQuery, current_user: dict = Depends(get_current_
             "id": "expense_id"  # Only included if save_to_db is true
         }
     """
-    try:
-        print(f"Expense parser endpoint called with: {query.dict()}")
-        
-        # Get the user ID from the authenticated user
-        user_id = current_user["user_id"]
-        print(f"User ID: {user_id}")
-        
-        # Initialize Firestore client before calling the parser
-        db = firestore.Client()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Expense parser endpoint called with: %s", query.model_dump())
+    
+    # Get the user ID from the authenticated user
+    user_id = current_user["user_id"]
+    logger.debug("User ID: %s", user_id)
+    
+    # Initialize Firestore client before calling the parser
+    db = get_db()
 
-        # Parse the expense information using our AI parser, passing the db client
-        print(f"Calling AI parser with text: '{query.text}'")
-        result = ai_parse_expense(query.text, user_id, db_client=db)
-        print(f"AI parser result: {result}")
-        
-        # If save_to_db is true, save the expense to Firestore
-        if query.save_to_db:
-            print(f"Saving expense to Firestore (save_to_db={query.save_to_db})")
-            # db client is already initialized
-            doc_ref = db.collection('expenses').add(result)
-            expense_id = doc_ref[1].id
-            print(f"Expense saved with ID: {expense_id}")
-            
-            # Add the ID to the response
-            result["id"] = expense_id
-        else:
-            print("Not saving to database (save_to_db=False)")
-        
-        print(f"Returning result: {result}")
-        return result
-    except Exception as e:
-        import traceback
-        print(f"Error in parse_expense: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error parsing expense: {str(e)}"
-        )
+    # Parse the expense information using our AI parser, passing the db client
+    logger.debug("Calling AI parser with text: %r", query.text)
+    result = await asyncio.to_thread(ai_parse_expense, query.text, user_id, db_client=db)
+    logger.debug("AI parser result: %s", result)
+    
+    # If save_to_db is true, save the expense to Firestore
+    if query.save_to_db:
+        logger.debug("Saving expense to Firestore")
+        # The document ID is generated client-side, so it is known without waiting for the write
+        doc_ref = get_async_db().collection('expenses').document()
+        await doc_ref.set(result)
+        expense_id = doc_ref.id
+        logger.info("Expense saved with ID: %s", expense_id)
+        
+        # Add the ID to the response
+        result["id"] = expense_id
+    else:
+        logger.debug("Not saving to database (save_to_db=False)")
+    
+    logger.debug("Returning result: %s", result)
+    return result
 
 @router.post('/tag_generator/')
-def generate_tag(query: TagGenerationQuery, current_user: dict = Depends(get_current_user)):
+async def generate_tag(query: TagQuery, current_user: dict = Depends(get_current_user)):
     """
     Generate tag information using AI and save it to the database.
     
@@ -119,29 +174,21 @@ def generate_tag(query: TagGenerationQuery, current_user: dict = Depends(get_cur
             "active": true
         }
     """
-    try:
-        # Initialize Firestore client
-        db = firestore.Client()
-        
-        # Generate the tag data using the AI generator
-        tag_data = ai_generate_tag(query.area, query.context, current_user["user_id"], db)
-        
-        # Save the tag to Firestore
-        doc_ref = db.collection('tags').document(query.area)
-        doc_ref.set(tag_data)
-        
-        return tag_data
-    except HTTPException:
-        # Re-raise HTTP exceptions
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error generating tag: {str(e)}"
-        )
+    # Initialize Firestore client
+    db = get_db()
+    
+    # Generate the tag data using the AI generator
+    tag_data = await ai_generate_tag(query.tag_id, query.facet, current_user["user_id"], db)
+    
+    # Save the tag to Firestore
+    doc_ref = get_async_db().collection('tags').document(query.tag_id)
+    await doc_ref.set(tag_data)
+    invalidate_tag(query.tag_id)
+    
+    return tag_data
 
 @router.post('/bulk_tag_generator/')
-def bulk_generate_tags(query: TagGenerationQuery, current_user: dict = Depends(get_current_user)):
+async def bulk_generate_tags(query: TagGenerationQuery, current_user: dict = Depends(get_current_user)):
     """
     Generate multiple tags in bulk and save them to the database.
     
@@ -165,47 +212,62 @@ def bulk_generate_tags(query: TagGenerationQuery, current_user: dict = Depends(g
     generated_tags = {"area": [], "context": []}
     skipped_tags = []
     failed_tags = []
-    db = firestore.Client()
-    
-    # Process area tags
-    for tag_id in query.area:
-        try:
-            # Check if tag already exists
-            existing_tag = db.collection('tags').document(tag_id).get()
-            if existing_tag.exists:
-                skipped_tags.append({"tag_id": tag_id, "facet": "area", "reason": "already exists"})
-                continue
-                
-            # Generate tag data
-            tag_data = ai_generate_tag(tag_id, "area", current_user["user_id"], db)
-            
-            # Save to Firestore
-            doc_ref = db.collection('tags').document(tag_id)
-            doc_ref.set(tag_data)
-            
-            generated_tags["area"].append(tag_id)
-        except Exception as e:
-            failed_tags.append({"tag_id": tag_id, "facet": "area", "error": str(e)})
-    
-    # Process context tags
-    for tag_id in query.context:
-        try:
-            # Check if tag already exists
-            existing_tag = db.collection('tags').document(tag_id).get()
-            if existing_tag.exists:
-                skipped_tags.append({"tag_id": tag_id, "facet": "context", "reason": "already exists"})
-                continue
-                
+    db = get_db()
+    user_id = current_user["user_id"]
+    async_db = get_async_db()
+    tags_collection = async_db.collection('tags')
+    
+    requested = [(tag_id, "area") for tag_id in query.area] + [(tag_id, "context") for tag_id in query.context]
+    
+    # Check which tags already exist with a single batched read
+    refs = [tags_collection.document(tag_id) for tag_id, _ in requested]
+    snapshots = [snapshot async for snapshot in async_db.get_all(refs)] if refs else []
+    existing_ids = {snapshot.id for snapshot in snapshots if snapshot.exists}
+    
+    pending = []
+    for tag_id, facet in requested:
+        if tag_id in existing_ids:
+            skipped_tags.append({"tag_id": tag_id, "facet": facet, "reason": "already exists"})
+            continue
+        # A tag requested twice is generated only once
+        existing_ids.add(tag_id)
+        pending.append((tag_id, facet))
+    
+    # Tags of the same facet are generated together, up to TAG_BATCH_SIZE per LLM call
+    chunks = []
+    for facet in ("area", "context"):
+        tag_ids = [tag_id for tag_id, tag_facet in pending if tag_facet == facet]
+        chunks.extend((tag_ids[i:i + TAG_BATCH_SIZE], facet) for i in range(0, len(tag_ids), TAG_BATCH_SIZE))
+    
+    semaphore = asyncio.Semaphore(BULK_TAG_CONCURRENCY)
+    
+    async def generate_chunk(tag_ids: List[str], facet: str) -> List[dict]:
+        async with semaphore:
             # Generate tag data
-            tag_data = ai_generate_tag(tag_id, "context", current_user["user_id"], db)
-            
-            # Save to Firestore
-            doc_ref = db.collection('tags').document(tag_id)
-            doc_ref.set(tag_data)
-            
-            generated_tags["context"].append(tag_id)
-        except Exception as e:
-            failed_tags.append({"tag_id": tag_id, "facet": "context", "error": str(e)})
+            return await ai_generate_tags_batch(tag_ids, facet, user_id, db)
+    
+    results = await asyncio.gather(
+        *[generate_chunk(tag_ids, facet) for tag_ids, facet in chunks],
+        return_exceptions=True
+    )
+    
+    generated = []
+    for (tag_ids, facet), result in zip(chunks, results):
+        if isinstance(result, Exception):
+            failed_tags.extend({"tag_id": tag_id, "facet": facet, "error": str(result)} for tag_id in tag_ids)
+        else:
+            generated.extend((tag_id, facet, tag_data) for tag_id, tag_data in zip(tag_ids, result))
+    
+    # Save all the generated tags to Firestore in one batch
+    try:
+        await acommit_in_batches(
+            async_db, [(tags_collection.document(tag_id), tag_data) for tag_id, _, tag_data in generated]
+        )
+        for tag_id, facet, _ in generated:
+            invalidate_tag(tag_id)
+            generated_tags[facet].append(tag_id)
+    except Exception as e:
+        failed_tags.extend({"tag_id": tag_id, "facet": facet, "error": str(e)} for tag_id, facet, _ in generated)
     
     return {
         "generated_tags": generated_tags,
@@ -213,8 +275,22 @@ def bulk_generate_tags(query: TagGenerationQuery, current_user: dict = Depends(g
         "failed_tags": failed_tags
     }
 
+async def _save_expenses(db, writes: List[tuple]) -> None:
+    """Background save of parsed expenses, logging (rather than raising) a failed write"""
+    try:
+        await acommit_in_batches(db, writes)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Expenses saved with IDs: %s", [doc_ref.id for doc_ref, _ in writes])
+    except Exception:
+        logger.exception("Failed to save expenses %s", [doc_ref.id for doc_ref, _ in writes])
+
 @router.post('/multi_expense_parser/')
-async def parse_multi_expense(query: MultiExpenseQuery, current_user: dict = Depends(get_current_user)):
+async def parse_multi_expense(
+    query: MultiExpenseQuery,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    current_user: dict = Depends(get_current_user)
+):
     """
     Parse multiple expenses from text using AI with parallel processing.
     
@@ -222,6 +298,9 @@ async def parse_multi_expense(query: MultiExpenseQuery, current_user: dict = Dep
     expenses and processes them accordingly. For multiple expenses, it uses parallel
     processing for optimal performance.
     
+    With save_to_db, the expenses are returned with their IDs right away (202 Accepted)
+    and written to Firestore in the background.
+    
     Example:
         Request: {"text": "I spent €15 for lunch and $20 for taxi", "save_to_db": true}
         Response: {
@@ -247,69 +326,55 @@ async def parse_multi_expense(query: MultiExpenseQuery, current_user: dict = Dep
             "error": ""
         }
     """
-    try:
-        print(f"Multi-expense parser endpoint called with: {query.dict()}")
-        
-        # Get the user ID from the authenticated user
-        user_id = current_user["user_id"]
-        print(f"User ID: {user_id}")
-        
-        # Initialize Firestore client
-        db = firestore.Client()
-        
-        # Detect expense count first
-        expense_type = detect_expense_count(query.text)
-        print(f"Detected expense type: {expense_type}")
-        
-        # Parse multiple expenses (now async)
-        result = await parse_multiple_expenses(query.text, user_id, db)
-        
-        # If save_to_db is true, save all expenses to Firestore
-        if query.save_to_db and result.expenses:
-            print(f"Saving {len(result.expenses)} expenses to Firestore")
-            
-            # Enhance expenses with database info (similar to single expense parser)
-            enhanced_expenses = []
-            for expense in result.expenses:
-                # Convert ExpenseData back to dict for saving
-                expense_dict = expense.dict()
-                expense_dict.update({
-                    "user_id": user_id,
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                    "raw_text": query.text  # Keep original text for context
-                })
-                
-                # Save to Firestore
-                doc_ref = db.collection('expenses').add(expense_dict)
-                expense_id = doc_ref[1].id  # Get the document ID
-                print(f"Expense saved with ID: {expense_id}")
-                
-                # Add the database ID to the expense
-                expense_dict["id"] = expense_id
-                enhanced_expenses.append(expense_dict)
-            
-            # Return the enhanced result with full expense data (like single expense parser)
-            return {
-                "expenses": enhanced_expenses,
-                "total_count": result.total_count,
-                "processing_time": result.processing_time,
-                "original_text": result.original_text,
-                "error": result.error
-            }
-        
-        print(f"Returning multi-expense result: {result}")
-        return result
-        
-    except Exception as e:
-        import traceback
-        print(f"Error in parse_multi_expense: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error parsing multiple expenses: {str(e)}"
-        )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Multi-expense parser endpoint called with: %s", query.model_dump())
+    
+    # Get the user ID from the authenticated user
+    user_id = current_user["user_id"]
+    logger.debug("User ID: %s", user_id)
+    
+    # Initialize Firestore client
+    db = get_db()
+    
+    # Parse multiple expenses (texts with a single amount skip the multi-expense LLM calls)
+    result = await parse_multiple_expenses(query.text, user_id, db)
+    
+    # If save_to_db is true, save all expenses to Firestore
+    if query.save_to_db and result.expenses:
+        logger.debug("Saving %d expenses to Firestore", len(result.expenses))
+        
+        # Enhance expenses with database info (similar to single expense parser)
+        # All the expenses of one text share the same user, timestamp and raw text
+        common_fields = {
+            "user_id": user_id,
+            "timestamp": _utc_now_iso(),
+            "raw_text": query.text  # Keep original text for context
+        }
+        enhanced_expenses = [{**expense.model_dump(), **common_fields} for expense in result.expenses]
+        
+        # Pre-generate the documents so all expenses are saved in one batch
+        async_db = get_async_db()
+        expenses_collection = async_db.collection('expenses')
+        writes = [(expenses_collection.document(), expense_dict) for expense_dict in enhanced_expenses]
+        
+        # Save to Firestore once the response is sent: the IDs are already known
+        background_tasks.add_task(_save_expenses, async_db, writes)
+        response.status_code = status.HTTP_202_ACCEPTED
+        
+        # Return the enhanced result with full expense data (like single expense parser),
+        # with the database IDs added to copies so they are not stored in the documents
+        return {
+            "expenses": [{**expense_dict, "id": doc_ref.id} for doc_ref, expense_dict in writes],
+            "total_count": result.total_count,
+            "processing_time": result.processing_time,
+            "original_text": result.original_text,
+            "error": result.error
+        }
+    
+    logger.debug("Returning multi-expense result: %s", result)
+    return result
 
-@router.post('/receipt_parser/')
+@router.post('/receipt_parser/', response_model=ReceiptParseResponse, response_model_exclude_none=True)
 async def parse_receipt(
     file: UploadFile = File(...),
     save_to_db: str = Form("false"),  
@@ -356,50 +421,89 @@ async def parse_receipt(
             "error": ""
         }
     """
-    try:
-        print(f"Receipt parser endpoint called with file: {file.filename}")
-        
-        # Validate file type
-        allowed_types = ['image/jpeg', 'image/jpg', 'image/png', 'image/webp']
-        if file.content_type not in allowed_types:
+    logger.info("Receipt parser endpoint called with file: %s", file.filename)
+    
+    # Validate file type
+    if file.content_type not in _ALLOWED_IMAGE_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid file type. {_ALLOWED_IMAGE_TYPES_DETAIL}"
+        )
+    
+    # Get the user ID from the authenticated user
+    user_id = current_user["user_id"]
+    logger.debug("User ID: %s", user_id)
+    logger.debug("Save to DB parameter: %r", save_to_db)
+    
+    # Convert string save_to_db to boolean
+    save_to_db_bool = save_to_db.lower() in ('true', '1', 'yes')
+    logger.debug("Save to DB converted: %s", save_to_db_bool)
+    
+    await _check_receipt_upload(file)
+    
+    # Process the receipt using the dedicated parser, which decodes the upload from its file
+    result = await parse_receipt_image(
+        image_file=file.file,
+        user_id=user_id,
+        save_to_db=save_to_db_bool,
+        filename=file.filename
+    )
+    
+    return result
+
+@router.post('/receipt_batch/')
+async def submit_receipts_batch(
+    files: List[UploadFile] = File(...),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Submit receipt photos for background parsing through the OpenAI Batch API.
+    
+    Batched parsing costs half as much as `/receipt_parser/` but can take up to 24h,
+    so it is meant for bulk imports. POST `/receipt_batch/{batch_id}/collect/` to collect
+    the result: once the batch is completed, its expenses are parsed and saved.
+    
+    Example:
+        Upload several receipt images
+        Response: {"batch_id": "batch_abc123", "image_count": 3}
+    """
+    for file in files:
+        if file.content_type not in _ALLOWED_IMAGE_TYPES:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Invalid file type. Allowed types: {', '.join(allowed_types)}"
+                detail=f"Invalid file type for {file.filename}. {_ALLOWED_IMAGE_TYPES_DETAIL}"
             )
-        
-        # Get the user ID from the authenticated user
-        user_id = current_user["user_id"]
-        print(f"User ID: {user_id}")
-        print(f"Save to DB parameter: {save_to_db} (type: {type(save_to_db)})")
-        
-        # Convert string save_to_db to boolean
-        save_to_db_bool = save_to_db.lower() in ('true', '1', 'yes')
-        print(f"Save to DB converted: {save_to_db_bool}")
-        
-        # Read the image content
-        image_content = await file.read()
-        
-        # Process the receipt using the dedicated parser
-        result = await parse_receipt_image(
-            image_content=image_content,
-            user_id=user_id,
-            save_to_db=save_to_db_bool,
-            filename=file.filename
-        )
-        
-        return result
-        
-    except HTTPException:
-        # Re-raise HTTP exceptions as-is
-        raise
-    except Exception as e:
-        import traceback
-        print(f"Error in parse_receipt endpoint: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error processing receipt: {str(e)}"
-        )
+    
+    for file in files:
+        await _check_receipt_upload(file)
+    
+    db = get_db()
+    images = [file.file for file in files]
+    batch_id = await submit_receipt_batch(images, current_user["user_id"], db)
+    return {"batch_id": batch_id, "image_count": len(images)}
+
+@router.post('/receipt_batch/collect/')
+async def collect_receipts_batches(current_user: dict = Depends(get_current_user)):
+    """
+    Collect every pending receipt batch of the user, saving the expenses of completed ones.
+    
+    Returns the status of each pending batch.
+    """
+    db = get_db()
+    return await collect_pending_receipt_batches(current_user["user_id"], db)
+
+@router.post('/receipt_batch/{batch_id}/collect/')
+async def collect_receipts_batch(batch_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Get the status of a receipt batch, saving its expenses once it is completed.
+    
+    A batch being collected by a concurrent request reports the status "processing".
+    
+    Example:
+        Response: {"batch_id": "batch_abc123", "status": "completed", "expense_ids": ["..."], "errors": []}
+    """
+    db = get_db()
+    return await collect_receipt_batch(batch_id, current_user["user_id"], db)
 
 @router.get('/usage/summary/')
 def get_usage_summary(current_user: dict = Depends(get_current_user)):
@@ -425,21 +529,13 @@ def get_usage_summary(current_user: dict = Depends(get_current_user)):
             "top_models": [...]
         }
     """
-    try:
-        user_id = current_user["user_id"]
-        
-        # Initialize Firestore and UsageService
-        db = firestore.Client()
-        usage_service = UsageService(db)
-        
-        summary = usage_service.get_usage_summary(user_id)
-        return summary
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error retrieving usage summary: {str(e)}"
-        )
+    user_id = current_user["user_id"]
+    
+    # Shared UsageService (on the shared Firestore client)
+    usage_service = get_usage_service()
+    
+    summary = usage_service.get_usage_summary(user_id)
+    return summary
 
 @router.get('/usage/monthly/')
 def get_monthly_usage(
@@ -466,21 +562,13 @@ def get_monthly_usage(
             ...
         ]
     """
-    try:
-        user_id = current_user["user_id"]
-        
-        # Initialize Firestore and UsageService
-        db = firestore.Client()
-        usage_service = UsageService(db)
-        
-        monthly_data = usage_service.get_monthly_usage(user_id, months)
-        return monthly_data
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error retrieving monthly usage: {str(e)}"
-        )
+    user_id = current_user["user_id"]
+    
+    # Shared UsageService (on the shared Firestore client)
+    usage_service = get_usage_service()
+    
+    monthly_data = usage_service.get_monthly_usage(user_id, months)
+    return monthly_data
 
 @router.get('/usage/agents/')
 def get_agent_breakdown(current_user: dict = Depends(get_current_user)):
@@ -503,21 +591,13 @@ def get_agent_breakdown(current_user: dict = Depends(get_current_user)):
             ...
         ]
     """
-    try:
-        user_id = current_user["user_id"]
-        
-        # Initialize Firestore and UsageService
-        db = firestore.Client()
-        usage_service = UsageService(db)
-        
-        agent_breakdown = usage_service.get_agent_breakdown(user_id)
-        return agent_breakdown
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error retrieving agent breakdown: {str(e)}"
-        )
+    user_id = current_user["user_id"]
+    
+    # Shared UsageService (on the shared Firestore client)
+    usage_service = get_usage_service()
+    
+    agent_breakdown = usage_service.get_agent_breakdown(user_id)
+    return agent_breakdown
 
 @router.get('/usage/models/')
 def get_model_breakdown(current_user: dict = Depends(get_current_user)):
@@ -540,21 +620,13 @@ def get_model_breakdown(current_user: dict = Depends(get_current_user)):
             ...
         ]
     """
-    try:
-        user_id = current_user["user_id"]
-        
-        # Initialize Firestore and UsageService
-        db = firestore.Client()
-        usage_service = UsageService(db)
-        
-        model_breakdown = usage_service.get_model_breakdown(user_id)
-        return model_breakdown
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error retrieving model breakdown: {str(e)}"
-        )
+    user_id = current_user["user_id"]
+    
+    # Shared UsageService (on the shared Firestore client)
+    usage_service = get_usage_service()
+    
+    model_breakdown = usage_service.get_model_breakdown(user_id)
+    return model_breakdown
 
 @router.get('/usage/alerts/')
 def get_usage_alerts(current_user: dict = Depends(get_current_user)):
@@ -573,21 +645,13 @@ def get_usage_alerts(current_user: dict = Depends(get_current_user)):
             ...
         ]
     """
-    try:
-        user_id = current_user["user_id"]
-        
-        # Initialize Firestore and UsageService
-        db = firestore.Client()
-        usage_service = UsageService(db)
-        
-        alerts = usage_service.get_usage_alerts(user_id)
-        return alerts
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error retrieving usage alerts: {str(e)}"
-        )
+    user_id = current_user["user_id"]
+    
+    # Shared UsageService (on the shared Firestore client)
+    usage_service = get_usage_service()
+    
+    alerts = usage_service.get_usage_alerts(user_id)
+    return alerts
 
 @router.get('/usage/recent/')
 def get_recent_requests(
@@ -614,21 +678,10 @@ def get_recent_requests(
             ...
         ]
     """
-    try:
-        user_id = current_user["user_id"]
-        
-        # Limit the number of requests to prevent abuse
-        limit = min(limit, 100)
-        
-        # Initialize Firestore and UsageService
-        db = firestore.Client()
-        usage_service = UsageService(db)
-        
-        recent_requests = usage_service.get_recent_requests(user_id, limit)
-        return recent_requests
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error retrieving recent requests: {str(e)}"
-        )
+    user_id = current_user["user_id"]
+    
+    # Shared UsageService (on the shared Firestore client)
+    usage_service = get_usage_service()
+    
+    recent_requests = usage_service.get_recent_requests(user_id, limit)
+    return recent_requests
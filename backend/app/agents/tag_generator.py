@@ -1,74 +1,47 @@
+import asyncio
+import hashlib
+import logging
 import os
+import threading
 from datetime import datetime, timezone
-from typing import List, Optional, Dict
-from pydantic import BaseModel, Field, validator
-from langchain_core.output_parsers import PydanticOutputParser
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Literal, Optional, Dict, Tuple
+from cachetools import LRUCache
+from pydantic import BaseModel, Field, field_validator
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-from dotenv import load_dotenv
+import orjson
 import time
 from .usage_tracker import track_openai_api_call
+from .llm import get_chat_model
 
-# Load environment variables from .env file
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+class TagColors(BaseModel):
+    """Color scheme of a tag, as hex color codes"""
+    hex: str = Field(description="The main color for borders and highlights")
+    bgHex: str = Field(description="A lighter background color")
+    textHex: str = Field(description="A color for text that contrasts well with bgHex")
 
 class TagData(BaseModel):
     """Data structure for generated tag information"""
     tag_id: str = Field(description="The unique identifier for the tag")
     name: str = Field(description="The display name for the tag (capitalized)")
-    facet: str = Field(description="The facet of the tag (area or context)")
+    facet: Literal["area", "context"] = Field(description="The facet of the tag (area or context)")
     synonyms: List[str] = Field(description="List of synonyms for the tag (3-6 words)")
     icon: str = Field(description="Name of a Font Awesome icon (e.g., 'shopping-cart', 'coffee', 'tag')")
-    colors: Dict[str, str] = Field(description="Color information for the tag in various formats")
-    
-    # Validate facet is either 'area' or 'context'
-    @validator('facet')
-    def facet_must_be_valid(cls, v):
-        if v not in ['area', 'context']:
-            raise ValueError("Facet must be either 'area' or 'context'")
-        return v
+    colors: TagColors = Field(description="Color information for the tag")
     
     # Validate synonyms has 3-6 items
-    @validator('synonyms')
+    @field_validator('synonyms')
+    @classmethod
     def synonyms_length(cls, v):
         if len(v) < 3 or len(v) > 6:
             raise ValueError("Synonyms must contain between 3 and 6 items")
         return v
-        
-    # Validate colors has all required fields
-    @validator('colors')
-    def colors_must_have_required_fields(cls, v):
-        required_fields = ['hex', 'bgHex', 'textHex']
-        for field in required_fields:
-            if field not in v:
-                raise ValueError(f"Colors must include '{field}'")
-        return v
 
-def create_tag_generator():
-    """Create a LangChain parser for tag generation"""
-    # Get API key from environment variable
-    api_key = os.environ.get("OPENAI_API_KEY")
-    
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY environment variable not found")
-    
-    # Initialize the OpenAI model
-    model = ChatOpenAI(
-        model="gpt-4o",
-        temperature=0.2,  # Slightly higher temperature for more creative synonyms
-        openai_api_key=api_key,
-    )
-    
-    # Set up the Pydantic output parser with our TagData model
-    parser = PydanticOutputParser(pydantic_object=TagData)
-    
-    # Create a prompt template
-    prompt = PromptTemplate(
-        template="""
-        You are an AI assistant that generates tag information for an expense tracking system.
-        
-        Given a tag_id and facet, generate a structured tag with appropriate synonyms, a suitable Font Awesome icon, and color information.
-        
+# Tag generation guidelines, shared by the single and the batched prompts
+_TAG_GUIDELINES = """
         For the tag name, capitalize the first letter of each word.
         For synonyms, generate 3-6 related terms that are semantically similar to the tag.
         For the icon, select an appropriate Font Awesome icon name (e.g., 'shopping-cart', 'coffee', 'tag').
@@ -98,92 +71,433 @@ def create_tag_generator():
           - icon: "gift"
           - colors: {{ "hex": "#ec4899", "bgHex": "#fdf2f8", "textHex": "#db2777" }}
         
-        {format_instructions}
+"""
+
+class TagBatchData(BaseModel):
+    """Data structure for several tags generated in one call"""
+    tags: List[TagData] = Field(description="One generated tag per requested tag_id, in the same order")
+
+# Maximum number of tags generated in one batched call: larger batches degrade the answers
+TAG_BATCH_SIZE = 16
+
+# Model generating the tags (overridable for A/B tests; .env is loaded by the llm module)
+TAG_MODEL = os.environ.get("TAG_GEN_MODEL", "gpt-4o-mini")
+
+# Cap on the reply tokens of one generated tag (a TagData is ~150 tokens of JSON)
+TAG_MAX_TOKENS = 256
+
+# Version of the tag prompts: bump it when they change, so tags cached from the
+# previous prompts are generated again
+PROMPT_VERSION = "v1"
+
+# Generated tags are cached in memory and in this collection (shared across instances)
+TAG_CACHE_COLLECTION = "tag_cache"
+
+def normalize_tag_id(tag_id: str) -> str:
+    """
+    Reduce a tag id to the form used to look it up in the priors and the tag cache,
+    so that variants like "Restaurants" and "restaurant" share one generated tag.
+    """
+    normalized = "-".join(tag_id.lower().replace("_", " ").split())
+    if len(normalized) > 4 and normalized.endswith("ies"):
+        return normalized[:-3] + "y"
+    if len(normalized) > 3 and normalized.endswith("s") and not normalized.endswith(("ss", "us", "is")):
+        return normalized[:-1]
+    return normalized
+
+# Hand-written tags for the most common tag ids, returned without any LLM call or cache read
+TAG_PRIORS_PATH = Path(__file__).with_name("tag_priors.json")
+
+def _load_tag_priors() -> Dict[Tuple[str, str], TagData]:
+    """Read the tag priors file, as TagData by (normalized tag_id, facet)"""
+    with open(TAG_PRIORS_PATH, "rb") as f:
+        priors = orjson.loads(f.read())
+    return {
+        (normalize_tag_id(tag_id), facet): TagData.model_validate(tag)
+        for facet, tags in priors.items()
+        for tag_id, tag in tags.items()
+    }
+
+TAG_PRIORS = _load_tag_priors()
+
+# Color schemes of the categories listed in the tag prompt
+CATEGORY_PALETTE = {
+    "food": {"hex": "#f97316", "bgHex": "#fff7ed", "textHex": "#ea580c"},
+    "shopping": {"hex": "#a855f7", "bgHex": "#faf5ff", "textHex": "#9333ea"},
+    "entertainment": {"hex": "#ef4444", "bgHex": "#fef2f2", "textHex": "#dc2626"},
+    "travel": {"hex": "#3b82f6", "bgHex": "#eff6ff", "textHex": "#2563eb"},
+    "health": {"hex": "#22c55e", "bgHex": "#f0fdf4", "textHex": "#16a34a"},
+    "home": {"hex": "#eab308", "bgHex": "#fefce8", "textHex": "#ca8a04"},
+    "education": {"hex": "#2563eb", "bgHex": "#eff6ff", "textHex": "#1d4ed8"},
+    "personal": {"hex": "#6366f1", "bgHex": "#eef2ff", "textHex": "#4f46e5"},
+    "gifts": {"hex": "#ec4899", "bgHex": "#fdf2f8", "textHex": "#db2777"},
+}
+
+# Font Awesome icon and synonyms of a tag classified into each category
+ICON_MAP = {
+    "food": "utensils",
+    "shopping": "shopping-bag",
+    "entertainment": "ticket-alt",
+    "travel": "plane",
+    "health": "heartbeat",
+    "home": "home",
+    "education": "graduation-cap",
+    "personal": "user",
+    "gifts": "gift",
+}
+CATEGORY_SYNONYMS = {
+    "food": ["food", "meal", "eating", "dining"],
+    "shopping": ["shopping", "purchases", "retail", "store"],
+    "entertainment": ["entertainment", "leisure", "fun", "recreation"],
+    "travel": ["travel", "trip", "transport", "journey"],
+    "health": ["health", "wellness", "medical", "care"],
+    "home": ["home", "household", "housing", "bills"],
+    "education": ["education", "learning", "study", "school"],
+    "personal": ["personal", "self-care", "individual", "private"],
+    "gifts": ["gifts", "presents", "giving", "offering"],
+}
+
+# Words (in normalize_tag_id form) that put a tag id in a category
+CATEGORY_KEYWORDS = {
+    "food": ("food", "restaurant", "pizza", "sushi", "burger", "coffee", "cafe", "lunch", "dinner", "breakfast",
+             "brunch", "snack", "grocery", "bakery", "takeaway", "takeout", "meal", "drink", "dessert"),
+    "shopping": ("shopping", "clothe", "clothing", "shoe", "fashion", "electronic", "gadget", "furniture", "store", "mall"),
+    "entertainment": ("entertainment", "movie", "cinema", "concert", "theater", "theatre", "game", "gaming",
+                      "music", "streaming", "party", "festival", "museum"),
+    "travel": ("travel", "trip", "flight", "hotel", "hostel", "airbnb", "vacation", "holiday", "taxi", "bus",
+               "train", "metro", "fuel", "parking", "transport", "transportation"),
+    "health": ("health", "healthcare", "doctor", "dentist", "pharmacy", "medicine", "hospital", "gym",
+               "fitness", "therapy", "medical"),
+    "home": ("home", "rent", "utility", "electricity", "water", "internet", "phone", "repair", "cleaning",
+             "household", "mortgage"),
+    "education": ("education", "school", "university", "course", "tuition", "book", "class", "lesson", "training"),
+    "personal": ("personal", "haircut", "hairdresser", "barber", "beauty", "cosmetic", "spa"),
+    "gifts": ("gift", "present", "birthday", "wedding", "anniversary", "donation", "charity"),
+}
+_KEYWORD_CATEGORIES = {keyword: category for category, keywords in CATEGORY_KEYWORDS.items() for keyword in keywords}
+
+def _classify_tag(tag_id: str, facet: str) -> Optional[TagData]:
+    """
+    Build the tag of a tag id containing a known category keyword, without calling the LLM
+    
+    Returns None when no word of the tag id belongs to a known category.
+    """
+    words = tag_id.lower().replace("_", " ").replace("-", " ").split()
+    category = next((_KEYWORD_CATEGORIES[w] for w in map(normalize_tag_id, words) if w in _KEYWORD_CATEGORIES), None)
+    if category is None:
+        return None
+    
+    synonyms = [synonym for synonym in CATEGORY_SYNONYMS[category] if synonym not in words]
+    if len(synonyms) < 3:
+        return None
+    return TagData(
+        tag_id=tag_id,
+        name=" ".join(word.capitalize() for word in words),
+        facet=facet,
+        synonyms=synonyms[:6],
+        icon=ICON_MAP[category],
+        colors=TagColors(**CATEGORY_PALETTE[category])
+    )
+
+_TAG_CACHE = LRUCache(maxsize=4096)
+_TAG_CACHE_LOCK = threading.Lock()
+
+def _tag_cache_key(tag_id: str, facet: str) -> str:
+    """Cache key of a generated tag: its inputs plus everything that shapes the answer"""
+    return hashlib.blake2b(
+        f"{normalize_tag_id(tag_id)}|{facet}|{TAG_MODEL}|{PROMPT_VERSION}".encode(), digest_size=16
+    ).hexdigest()
+
+def _get_cached_tags(tag_ids: List[str], facet: str, db_client = None) -> Dict[str, TagData]:
+    """
+    Return the known tags among tag_ids, by tag_id.
+    
+    The tag priors, the category keywords and the memory cache are checked first;
+    the remaining tags are read from Firestore with a single get_all.
+    """
+    priors = {
+        tag_id: TAG_PRIORS.get((normalize_tag_id(tag_id), facet)) or _classify_tag(tag_id, facet)
+        for tag_id in tag_ids
+    }
+    found = {tag_id: prior for tag_id, prior in priors.items() if prior is not None}
+    keys = {tag_id: _tag_cache_key(tag_id, facet) for tag_id in tag_ids if tag_id not in found}
+    with _TAG_CACHE_LOCK:
+        found.update({tag_id: _TAG_CACHE[key] for tag_id, key in keys.items() if key in _TAG_CACHE})
+    missing = [tag_id for tag_id in tag_ids if tag_id not in found]
+    if not missing or db_client is None:
+        return found
+    
+    try:
+        collection = db_client.collection(TAG_CACHE_COLLECTION)
+        snapshots = db_client.get_all([collection.document(keys[tag_id]) for tag_id in missing])
+        stored = {snapshot.id: TagData.model_validate(snapshot.to_dict()["result"]) for snapshot in snapshots if snapshot.exists}
+    except Exception as e:
+        logger.warning("Failed to read tag cache: %s", e)
+        return found
+    
+    with _TAG_CACHE_LOCK:
+        for tag_id in missing:
+            if keys[tag_id] in stored:
+                found[tag_id] = _TAG_CACHE[keys[tag_id]] = stored[keys[tag_id]]
+    return found
+
+def _cache_tag(tag_id: str, facet: str, result: TagData, db_client = None) -> None:
+    """Store a generated tag in the memory cache and, with a db client, in Firestore"""
+    key = _tag_cache_key(tag_id, facet)
+    with _TAG_CACHE_LOCK:
+        _TAG_CACHE[key] = result
+    if db_client is None:
+        return
+    
+    try:
+        db_client.collection(TAG_CACHE_COLLECTION).document(key).set({
+            "tag_id": tag_id,
+            "facet": facet,
+            "result": result.model_dump(),
+            "prompt_version": PROMPT_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+        })
+    except Exception as e:
+        logger.warning("Failed to write tag cache: %s", e)
+
+@lru_cache(maxsize=1)
+def create_tag_generator():
+    """Create the LangChain chain for tag generation (built once and reused by every call)"""
+    # Initialize the OpenAI model (shared across calls)
+    model = get_chat_model(TAG_MODEL, 0.2, TAG_MAX_TOKENS)  # Slightly higher temperature for more creative synonyms
+    
+    # Create a prompt template
+    prompt = PromptTemplate(
+        template="""
+        You are an AI assistant that generates tag information for an expense tracking system.
         
+        Given a tag_id and facet, generate a structured tag with appropriate synonyms, a suitable Font Awesome icon, and color information.
+        """ + _TAG_GUIDELINES + """
         Tag ID: {tag_id}
         Facet: {facet}
         """,
         input_variables=["tag_id", "facet"],
-        partial_variables={"format_instructions": parser.get_format_instructions()},
     )
     
-    # Create the chain
-    prompt_and_model = prompt | model
+    # The model replies with JSON constrained to the TagData schema (OpenAI structured outputs)
+    return prompt | model.with_structured_output(TagData, method="json_schema", strict=True)
+
+def _track_tag_generation(user_id: str, db_client, input_text: str, output_text: str, request_duration: float, metadata: dict) -> None:
+    """Record the LLM usage of a tag generation, never failing the generation itself"""
+    try:
+        track_openai_api_call(
+            user_id=user_id,
+            db_client=db_client,
+            agent_name="tag_generator",
+            model=TAG_MODEL,
+            input_text=input_text,
+            output_text=output_text,
+            request_duration=request_duration,
+            metadata=metadata
+        )
+    except Exception as e:
+        logger.warning("Failed to track usage: %s", e)
+
+# Usage tracking tasks still running (the event loop only keeps weak references to tasks)
+_TRACKING_TASKS = set()
+
+def _track_in_background(user_id: str, db_client, input_text: str, output_text: str, request_duration: float, metadata: dict) -> None:
+    """
+    Record the LLM usage of a tag generation in a worker thread, without waiting for it
     
-    return prompt_and_model, parser
+    The (sync) Firestore writes of the tracking then never delay the tags returned to the client.
+    """
+    if not (user_id and db_client):
+        return
+    task = asyncio.create_task(asyncio.to_thread(
+        _track_tag_generation, user_id, db_client, input_text, output_text, request_duration, metadata
+    ))
+    _TRACKING_TASKS.add(task)
+    task.add_done_callback(_TRACKING_TASKS.discard)
 
-def generate_tag(tag_id: str, facet: str, user_id: str = None, db_client = None) -> dict:
+# Maximum number of single-tag LLM calls in flight at once
+TAG_CONCURRENCY = 10
+
+async def _generate_tags_individually(tag_ids: List[str], facet: str, user_id: str = None, db_client = None) -> Dict[str, TagData]:
+    """
+    Generate tags with one LLM call each, run concurrently through the chain's abatch
+    
+    Returns the generated tags by tag_id; tags whose generation failed are left out.
+    """
+    start_time = time.time()
+    outputs = await create_tag_generator().abatch(
+        [{"tag_id": tag_id, "facet": facet} for tag_id in tag_ids],
+        config={"max_concurrency": TAG_CONCURRENCY},
+        return_exceptions=True
+    )
+    end_time = time.time()
+    
+    generated = {}
+    for tag_id, output in zip(tag_ids, outputs):
+        if isinstance(output, Exception):
+            logger.warning("Error generating tag %r: %s", tag_id, output)
+        else:
+            generated[tag_id] = output
+    
+    for tag_id, result in generated.items():
+        _track_in_background(
+            user_id,
+            db_client,
+            f"tag_id: {tag_id}, facet: {facet}",
+            result.model_dump_json(),
+            end_time - start_time,
+            {"function": "generate_tag", "tag_id": tag_id, "facet": facet, "success": True}
+        )
+    
+    await asyncio.to_thread(lambda: [_cache_tag(tag_id, facet, result, db_client) for tag_id, result in generated.items()])
+    return generated
+
+async def generate_tag(tag_id: str, facet: str, user_id: str = None, db_client = None) -> dict:
     """
     Generate tag information and return a structured tag object
     
+    The LLM call is awaited; the (sync) Firestore cache calls run in worker threads and the
+    usage is tracked in the background.
+    
     Args:
         tag_id: The ID of the tag to generate
         facet: The facet of the tag (area or context)
         user_id: Optional user ID for usage tracking
-        db_client: Optional Firestore client for usage tracking
+        db_client: Optional Firestore client for usage tracking and the shared tag cache
         
     Returns:
         A dictionary containing the generated tag information
     """
     try:
-        # Create the generator chain
-        prompt_and_model, parser = create_tag_generator()
-        
-        # Get the model output
-        start_time = time.time()
-        output = prompt_and_model.invoke({"tag_id": tag_id, "facet": facet})
-        end_time = time.time()
-        
-        # Parse the output into our Pydantic model
-        result = parser.invoke(output)
+        # A known tag (a prior, a known category, or generated before by any instance) is reused without calling the LLM
+        cached = await asyncio.to_thread(_get_cached_tags, [tag_id], facet, db_client)
+        if tag_id in cached:
+            return _to_tag_dict(cached[tag_id], tag_id)
         
-        # Track usage if user_id and db_client are provided
-        if user_id and db_client:
-            try:
-                output_text = str(result.dict()) if hasattr(result, 'dict') else str(result)
-                track_openai_api_call(
-                    user_id=user_id,
-                    db_client=db_client,
-                    agent_name="tag_generator",
-                    model="gpt-4.1-nano",
-                    input_text=f"tag_id: {tag_id}, facet: {facet}",
-                    output_text=output_text,
-                    request_duration=end_time - start_time,
-                    metadata={"function": "generate_tag", "tag_id": tag_id, "facet": facet, "success": True}
-                )
-            except Exception as e:
-                print(f"Warning: Failed to track usage: {e}")
+        generated = await _generate_tags_individually([tag_id], facet, user_id, db_client)
+        if tag_id in generated:
+            return _to_tag_dict(generated[tag_id], tag_id)
+    except Exception as e:
+        # Log the error for debugging
+        logger.exception("Error generating tag: %s", e)
+    
+    # If generation fails, return a basic structure
+    return _fallback_tag(tag_id, facet)
+
+def _to_tag_dict(result: TagData, tag_id: str) -> dict:
+    """Convert a generated (or cached) tag to the database document of tag_id"""
+    # Convert to dict and add the created_at, embedding, and active fields
+    result_dict = result.model_dump()
+    
+    # A cached tag may have been generated for a variant of the same tag id
+    result_dict["tag_id"] = tag_id
+    
+    # Add current timestamp
+    result_dict["created_at"] = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+    
+    # Add empty embedding list
+    result_dict["embedding"] = []
+    
+    # Set active to true
+    result_dict["active"] = True
+    
+    return result_dict
+
+def _fallback_tag(tag_id: str, facet: str) -> dict:
+    """Basic tag structure used when generation fails"""
+    return {
+        "tag_id": tag_id,
+        "name": tag_id.capitalize(),
+        "facet": facet,
+        "synonyms": [f"{tag_id}-related-1", f"{tag_id}-related-2", f"{tag_id}-related-3"],
+        "icon": "tag",  # Default Font Awesome icon
+        "colors": {
+            "hex": "#d1d5db",
+            "bgHex": "#f9fafb",
+            "textHex": "#4b5563"
+        },
+        "embedding": [],
+        "created_at": datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+        "active": True
+    }
+
+@lru_cache(maxsize=1)
+def create_tag_batch_generator():
+    """Create the chain that generates several tags of the same facet in one call"""
+    prompt = PromptTemplate(
+        template="""
+        You are an AI assistant that generates tag information for an expense tracking system.
         
-        # Convert to dict and add the created_at, embedding, and active fields
-        result_dict = result.dict()  # Use .dict() instead of model_dump() in Pydantic v1
+        Given a numbered list of tag_ids sharing the same facet, generate a structured tag for EACH of them,
+        with appropriate synonyms, a suitable Font Awesome icon, and color information.
+        Return the tags in the same order as the list, keeping every tag_id exactly as given.
+        """ + _TAG_GUIDELINES + """
+        Facet: {facet}
+        Tag IDs: {tag_ids}
+        """,
+        input_variables=["tag_ids", "facet"],
+    )
+    
+    return prompt | get_chat_model(TAG_MODEL, 0.2, TAG_MAX_TOKENS * TAG_BATCH_SIZE).with_structured_output(TagBatchData, method="json_schema", strict=True)
+
+async def generate_tags_batch(tag_ids: List[str], facet: str, user_id: str = None, db_client = None) -> List[dict]:
+    """
+    Generate the tag information of several tags of the same facet with a single LLM call
+    
+    The shared instructions are sent once for the whole batch instead of once per tag,
+    and only for the tags not found in the tag cache. Tags missing from the model's
+    answer are generated individually, with concurrent single-tag calls.
+    
+    Args:
+        tag_ids: The IDs of the tags to generate (at most TAG_BATCH_SIZE)
+        facet: The facet of the tags (area or context)
+        user_id: Optional user ID for usage tracking
+        db_client: Optional Firestore client for usage tracking and the shared tag cache
         
-        # Add current timestamp
-        result_dict["created_at"] = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+    Returns:
+        A list of tag dictionaries, in the same order as tag_ids
+    """
+    generated = await asyncio.to_thread(_get_cached_tags, tag_ids, facet, db_client)
+    missing = [tag_id for tag_id in tag_ids if tag_id not in generated]
+    if not missing:
+        return [_to_tag_dict(generated[tag_id], tag_id) for tag_id in tag_ids]
+    
+    numbered = " ".join(f"{i}) {tag_id}" for i, tag_id in enumerate(missing, 1))
+    try:
+        start_time = time.time()
+        result = await create_tag_batch_generator().ainvoke({"tag_ids": numbered, "facet": facet})
+        end_time = time.time()
         
-        # Add empty embedding list
-        result_dict["embedding"] = []
+        _track_in_background(
+            user_id,
+            db_client,
+            f"tag_ids: {numbered}, facet: {facet}",
+            result.model_dump_json(),
+            end_time - start_time,
+            {"function": "generate_tags_batch", "tag_count": len(missing), "facet": facet, "success": True}
+        )
         
-        # Set active to true
-        result_dict["active"] = True
-            
-        return result_dict
+        # Match the answers to the requested ids, tolerating case/plural changes by the model
+        requested = {normalize_tag_id(tag_id): tag_id for tag_id in missing}
+        new_tags = {}
+        for tag in result.tags:
+            tag_id = requested.get(normalize_tag_id(tag.tag_id))
+            if tag.facet == facet and tag_id is not None:
+                new_tags[tag_id] = tag
+        generated.update(new_tags)
+        await asyncio.to_thread(lambda: [_cache_tag(tag_id, facet, tag, db_client) for tag_id, tag in new_tags.items()])
     except Exception as e:
-        # Print the error for debugging
-        print(f"Error generating tag: {str(e)}")
-        
-        # If generation fails, return a basic structure
-        return {
-            "tag_id": tag_id,
-            "name": tag_id.capitalize(),
-            "facet": facet,
-            "synonyms": [f"{tag_id}-related-1", f"{tag_id}-related-2", f"{tag_id}-related-3"],
-            "icon": "tag",  # Default Font Awesome icon
-            "colors": {
-                "hex": "#d1d5db",
-                "bgHex": "#f9fafb",
-                "textHex": "#4b5563"
-            },
-            "embedding": [],
-            "created_at": datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
-            "active": True
-        }
+        logger.warning("Error generating tag batch, generating tags one by one: %s", e)
+    
+    # Tags the batch did not return are generated concurrently, one call each
+    fallbacks = [tag_id for tag_id in tag_ids if tag_id not in generated]
+    if fallbacks:
+        try:
+            generated.update(await _generate_tags_individually(fallbacks, facet, user_id, db_client))
+        except Exception as e:
+            logger.exception("Error generating tags: %s", e)
+    
+    return [
+        _to_tag_dict(generated[tag_id], tag_id) if tag_id in generated else _fallback_tag(tag_id, facet)
+        for tag_id in tag_ids
+    ]
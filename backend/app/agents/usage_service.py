@@ -1,7 +1,63 @@
+import calendar
+import heapq
+import threading
+from functools import lru_cache
 from typing import Dict, List, Optional, Any
+from cachetools import TTLCache
 from google.cloud import firestore
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 from fastapi import HTTPException
+from app.db import get_db
+
+# How long a user's usage data is reused by the usage endpoints (polled by the dashboard)
+USAGE_CACHE_TTL_SECONDS = 30
+
+_USAGE_CACHE = TTLCache(maxsize=10_000, ttl=USAGE_CACHE_TTL_SECONDS)
+_USAGE_LOCK = threading.Lock()
+
+# Number of most recent requests read with a user's usage data (and maximum page of the recent requests)
+MAX_RECENT_REQUESTS = 100
+
+# Subcollections of a user document holding the usage of each month (one document
+# per YYYY-MM) and the recent requests (one document per request)
+USAGE_MONTHLY_COLLECTION = "usage_monthly"
+RECENT_REQUESTS_COLLECTION = "recent_requests"
+
+# Number of most recent months read with a user's usage data
+USAGE_MONTHS_READ = 24
+
+def invalidate_user_usage(user_id: str) -> None:
+    """Drop the cached usage data of a user, e.g. after new usage was logged"""
+    with _USAGE_LOCK:
+        _USAGE_CACHE.pop(user_id, None)
+
+def _previous_month(year: int, month: int) -> tuple:
+    """(year, month) of the calendar month before the given one"""
+    return (year - 1, 12) if month == 1 else (year, month - 1)
+
+def _breakdown(by_entity: Dict[str, Dict[str, Any]], usage_data: Dict[str, Any], sort_key: str) -> List[Dict[str, Any]]:
+    """Usage of each agent or model with its share of the totals, largest sort_key first"""
+    total_requests = usage_data.get("total_requests", 1)
+    total_tokens = usage_data.get("total_tokens", 1)
+    total_cost = usage_data.get("total_cost_usd", 1)
+    
+    rows = []
+    for name, data in by_entity.items():
+        requests = max(data["requests"], 1)
+        rows.append({
+            "name": name,
+            "requests": data["requests"],
+            "tokens": data["tokens"],
+            "cost_usd": data["cost_usd"],
+            "request_percentage": round((data["requests"] / total_requests) * 100, 1),
+            "token_percentage": round((data["tokens"] / total_tokens) * 100, 1),
+            "cost_percentage": round((data["cost_usd"] / total_cost) * 100, 1),
+            "avg_tokens_per_request": round(data["tokens"] / requests),
+            "avg_cost_per_request": round(data["cost_usd"] / requests, 6)
+        })
+    
+    rows.sort(key=lambda x: x[sort_key], reverse=True)
+    return rows
 
 class UsageService:
     """Service for retrieving and analyzing AI usage data"""
@@ -10,28 +66,53 @@ class UsageService:
         self.db = db_client
     
     def get_user_usage(self, user_id: str) -> Dict[str, Any]:
-        """Get comprehensive usage data for a user"""
+        """Get comprehensive usage data for a user (cached per user for a few seconds)"""
+        with _USAGE_LOCK:
+            cached = _USAGE_CACHE.get(user_id)
+        if cached is not None:
+            return cached
+        
         try:
             user_ref = self.db.collection('users').document(user_id)
-            user_doc = user_ref.get()
+            # Only the usage field is read, not the whole user document
+            user_doc = user_ref.get(field_paths=["ai_usage"])
             
             if not user_doc.exists:
                 raise HTTPException(status_code=404, detail="User not found")
             
-            user_data = user_doc.to_dict()
-            usage_data = user_data.get("ai_usage", {})
+            usage_data = {
+                "total_requests": 0,
+                "total_tokens": 0,
+                "total_cost_usd": 0.0,
+                "by_agent": {},
+                "by_model": {},
+                "monthly": {},
+                "recent_requests": [],
+                **user_doc.to_dict().get("ai_usage", {})
+            }
             
-            if not usage_data:
-                return {
-                    "total_requests": 0,
-                    "total_tokens": 0,
-                    "total_cost_usd": 0.0,
-                    "by_agent": {},
-                    "by_model": {},
-                    "monthly": {},
-                    "recent_requests": []
-                }
+            # Months and requests live in subcollections; the monthly map and the
+            # recent_requests list of the user document are older data, still shown
+            months = user_ref.collection(USAGE_MONTHLY_COLLECTION) \
+                .order_by("__name__", direction=firestore.Query.DESCENDING) \
+                .limit(USAGE_MONTHS_READ)
+            usage_data["monthly"] = {**usage_data["monthly"], **{doc.id: doc.to_dict() for doc in months.stream()}}
             
+            requests = user_ref.collection(RECENT_REQUESTS_COLLECTION) \
+                .order_by("timestamp", direction=firestore.Query.DESCENDING) \
+                .limit(MAX_RECENT_REQUESTS)
+            recent_requests = [doc.to_dict() for doc in requests.stream()]
+            if recent_requests:
+                for request_data in recent_requests:
+                    request_data.pop("expires_at", None)
+                    # Stored unrounded; rounded here for display
+                    request_data["cost_usd"] = round(request_data.get("cost_usd", 0.0), 6)
+                    request_data["request_duration_seconds"] = round(request_data.get("request_duration_seconds", 0.0), 3)
+                recent_requests.reverse()  # Oldest to newest
+                usage_data["recent_requests"] = recent_requests
+            
+            with _USAGE_LOCK:
+                _USAGE_CACHE[user_id] = usage_data
             return usage_data
             
         except Exception as e:
@@ -41,8 +122,9 @@ class UsageService:
         """Get a summary of user's AI usage"""
         usage_data = self.get_user_usage(user_id)
         
-        current_month = datetime.now(timezone.utc).strftime("%Y-%m")
-        last_month = (datetime.now(timezone.utc) - timedelta(days=30)).strftime("%Y-%m")
+        now = datetime.now(timezone.utc)
+        current_month = f"{now.year:04d}-{now.month:02d}"
+        last_month = "%04d-%02d" % _previous_month(now.year, now.month)
         
         # Calculate month-over-month changes
         current_month_data = usage_data.get("monthly", {}).get(current_month, {})
@@ -62,17 +144,8 @@ class UsageService:
             }
         
         # Get top agents and models
-        top_agents = sorted(
-            usage_data.get("by_agent", {}).items(),
-            key=lambda x: x[1]["requests"],
-            reverse=True
-        )[:5]
-        
-        top_models = sorted(
-            usage_data.get("by_model", {}).items(),
-            key=lambda x: x[1]["tokens"],
-            reverse=True
-        )[:5]
+        top_agents = heapq.nlargest(5, usage_data.get("by_agent", {}).items(), key=lambda x: x[1]["requests"])
+        top_models = heapq.nlargest(5, usage_data.get("by_model", {}).items(), key=lambda x: x[1]["tokens"])
         
         return {
             "overview": {
@@ -120,18 +193,19 @@ class UsageService:
         }
     
     def get_monthly_usage(self, user_id: str, months: int = 12) -> List[Dict[str, Any]]:
-        """Get monthly usage data for the last N months"""
+        """Get monthly usage data for the last N months (months older than USAGE_MONTHS_READ count as empty)"""
         usage_data = self.get_user_usage(user_id)
         monthly_data = usage_data.get("monthly", {})
         
-        # Generate list of months
-        current_date = datetime.now(timezone.utc)
+        # Generate list of months, walking back one calendar month at a time
+        now = datetime.now(timezone.utc)
+        year, month = now.year, now.month
         month_list = []
         
-        for i in range(months):
-            month_date = current_date - timedelta(days=30 * i)
-            month_key = month_date.strftime("%Y-%m")
-            month_name = month_date.strftime("%B %Y")
+        for _ in range(months):
+            month_key = f"{year:04d}-{month:02d}"
+            month_name = f"{calendar.month_name[month]} {year}"
+            year, month = _previous_month(year, month)
             
             data = monthly_data.get(month_key, {
                 "requests": 0,
@@ -156,60 +230,25 @@ class UsageService:
     def get_agent_breakdown(self, user_id: str) -> List[Dict[str, Any]]:
         """Get detailed breakdown by agent"""
         usage_data = self.get_user_usage(user_id)
-        by_agent = usage_data.get("by_agent", {})
-        
-        total_requests = usage_data.get("total_requests", 1)
-        total_tokens = usage_data.get("total_tokens", 1)
-        total_cost = usage_data.get("total_cost_usd", 1)
-        
-        agents = []
-        for agent_name, data in by_agent.items():
-            agents.append({
-                "name": agent_name,
-                "requests": data["requests"],
-                "tokens": data["tokens"],
-                "cost_usd": data["cost_usd"],
-                "request_percentage": round((data["requests"] / total_requests) * 100, 1),
-                "token_percentage": round((data["tokens"] / total_tokens) * 100, 1),
-                "cost_percentage": round((data["cost_usd"] / total_cost) * 100, 1),
-                "avg_tokens_per_request": round(data["tokens"] / max(data["requests"], 1)),
-                "avg_cost_per_request": round(data["cost_usd"] / max(data["requests"], 1), 6)
-            })
-        
-        return sorted(agents, key=lambda x: x["requests"], reverse=True)
+        return _breakdown(usage_data.get("by_agent", {}), usage_data, "requests")
     
     def get_model_breakdown(self, user_id: str) -> List[Dict[str, Any]]:
         """Get detailed breakdown by model"""
         usage_data = self.get_user_usage(user_id)
-        by_model = usage_data.get("by_model", {})
-        
-        total_requests = usage_data.get("total_requests", 1)
-        total_tokens = usage_data.get("total_tokens", 1)
-        total_cost = usage_data.get("total_cost_usd", 1)
-        
-        models = []
-        for model_name, data in by_model.items():
-            models.append({
-                "name": model_name,
-                "requests": data["requests"],
-                "tokens": data["tokens"],
-                "cost_usd": data["cost_usd"],
-                "request_percentage": round((data["requests"] / total_requests) * 100, 1),
-                "token_percentage": round((data["tokens"] / total_tokens) * 100, 1),
-                "cost_percentage": round((data["cost_usd"] / total_cost) * 100, 1),
-                "avg_tokens_per_request": round(data["tokens"] / max(data["requests"], 1)),
-                "avg_cost_per_request": round(data["cost_usd"] / max(data["requests"], 1), 6)
-            })
-        
-        return sorted(models, key=lambda x: x["tokens"], reverse=True)
+        return _breakdown(usage_data.get("by_model", {}), usage_data, "tokens")
     
     def get_recent_requests(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
-        """Get recent AI requests for debugging/monitoring"""
+        """
+        Get recent AI requests for debugging/monitoring
+        
+        At most MAX_RECENT_REQUESTS are read, so limit is capped to that.
+        """
         usage_data = self.get_user_usage(user_id)
         recent_requests = usage_data.get("recent_requests", [])
         
         # Return the most recent requests
-        return recent_requests[-limit:] if len(recent_requests) > limit else recent_requests
+        limit = min(limit, MAX_RECENT_REQUESTS)
+        return recent_requests[-limit:] if limit > 0 else []
     
     def get_usage_alerts(self, user_id: str) -> List[Dict[str, Any]]:
         """Get usage alerts based on thresholds"""
@@ -256,3 +295,8 @@ class UsageService:
             })
         
         return alerts
+
+@lru_cache(maxsize=1)
+def get_usage_service() -> UsageService:
+    """Shared UsageService bound to the shared Firestore client"""
+    return UsageService(get_db())
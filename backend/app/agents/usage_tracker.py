@@ -1,18 +1,168 @@
+import logging
 import os
+import random
+import threading
 import time
 import tiktoken
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Optional, Any, Callable
-from functools import wraps
+from functools import lru_cache, wraps
 from google.cloud import firestore
 import asyncio
+import inspect
+from .usage_service import RECENT_REQUESTS_COLLECTION, USAGE_MONTHLY_COLLECTION, invalidate_user_usage
+
+logger = logging.getLogger(__name__)
+
+def _new_usage_entry(db: firestore.Client) -> Dict[str, Any]:
+    """Empty aggregate of the usage of one user, not yet written to Firestore"""
+    return {"db": db, "totals": [0, 0, 0.0], "by_agent": {}, "by_model": {}, "monthly": {}, "recent_requests": []}
+
+def _add_usage(entry: Dict[str, Any], agent_name: str, model: str, month: str, total_tokens: int, cost: float, request_data: Dict[str, Any]) -> None:
+    """Add one request to a usage aggregate"""
+    monthly = entry["monthly"].setdefault(month, {"totals": [0, 0, 0.0], "by_agent": {}, "by_model": {}})
+    for counts in (
+        entry["totals"],
+        entry["by_agent"].setdefault(agent_name, [0, 0, 0.0]),
+        entry["by_model"].setdefault(model, [0, 0, 0.0]),
+        monthly["totals"],
+        monthly["by_agent"].setdefault(agent_name, [0, 0, 0.0]),
+        monthly["by_model"].setdefault(model, [0, 0, 0.0]),
+    ):
+        counts[0] += 1
+        counts[1] += total_tokens
+        counts[2] += cost
+    entry["recent_requests"].append(request_data)
+
+def _increments(counts: List) -> Dict[str, Any]:
+    """Increments of [requests, tokens, cost] on a {requests, tokens, cost_usd} usage entry"""
+    return {
+        "requests": firestore.Increment(counts[0]),
+        "tokens": firestore.Increment(counts[1]),
+        "cost_usd": firestore.Increment(counts[2])
+    }
+
+def _stage_usage(batch: firestore.WriteBatch, db: firestore.Client, user_id: str, entry: Dict[str, Any]) -> None:
+    """
+    Add the writes applying a usage aggregate to a batch
+    
+    The all-time totals stay in the user document, each month goes to its own
+    users/{uid}/usage_monthly/{YYYY-MM} document, and each request to its own
+    users/{uid}/recent_requests document, so the user document no longer grows with
+    the history. Every counter is incremented server-side (no read, and concurrent
+    updates cannot overwrite each other); set(merge=True) creates missing maps.
+    Nested dicts are used rather than dotted paths because model names contain dots.
+    """
+    user_ref = db.collection('users').document(user_id)
+    requests, tokens, cost = entry["totals"]
+    batch.set(user_ref, {
+        "ai_usage": {
+            "total_requests": firestore.Increment(requests),
+            "total_tokens": firestore.Increment(tokens),
+            "total_cost_usd": firestore.Increment(cost),
+            "by_agent": {name: _increments(counts) for name, counts in entry["by_agent"].items()},
+            "by_model": {name: _increments(counts) for name, counts in entry["by_model"].items()}
+        }
+    }, merge=True)
+    
+    for month, monthly in entry["monthly"].items():
+        batch.set(user_ref.collection(USAGE_MONTHLY_COLLECTION).document(month), {
+            **_increments(monthly["totals"]),
+            "by_agent": {name: _increments(counts) for name, counts in monthly["by_agent"].items()},
+            "by_model": {name: _increments(counts) for name, counts in monthly["by_model"].items()}
+        }, merge=True)
+    
+    # Deleted by a Firestore TTL policy on the expires_at field of the recent_requests collection group
+    expires_at = datetime.now(timezone.utc) + timedelta(days=RECENT_REQUESTS_TTL_DAYS)
+    recent_requests = user_ref.collection(RECENT_REQUESTS_COLLECTION)
+    for request_data in entry["recent_requests"]:
+        batch.set(recent_requests.document(), {**request_data, "expires_at": expires_at})
+
+# Days a request stays in the recent requests before the TTL policy deletes it
+RECENT_REQUESTS_TTL_DAYS = 30
+
+# Usage updates are queued in memory, merged per user, and written by a background
+# thread every USAGE_FLUSH_INTERVAL_SECONDS: tracked calls never wait on Firestore,
+# and a burst of calls by one user costs a single batch commit
+USAGE_FLUSH_INTERVAL_SECONDS = 0.5
+
+_pending_usage: Dict[str, Dict[str, Any]] = {}
+_pending_lock = threading.Lock()
+_flusher: Optional[threading.Thread] = None
+
+def _queue_usage(db: firestore.Client, user_id: str, *usage) -> None:
+    """Queue the usage of one request (agent_name, model, month, total_tokens, cost, request_data)"""
+    global _flusher
+    with _pending_lock:
+        if user_id not in _pending_usage:
+            _pending_usage[user_id] = _new_usage_entry(db)
+        _add_usage(_pending_usage[user_id], *usage)
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="usage-flusher", daemon=True)
+            _flusher.start()
+
+def flush_usage() -> None:
+    """Write the queued usage updates to Firestore (run periodically, and on shutdown)"""
+    with _pending_lock:
+        pending = dict(_pending_usage)
+        _pending_usage.clear()
+    
+    for user_id, entry in pending.items():
+        db = entry["db"]
+        try:
+            batch = db.batch()
+            _stage_usage(batch, db, user_id, entry)
+            batch.commit()
+            invalidate_user_usage(user_id)
+        except Exception as e:
+            logger.warning("Error writing usage of user %s: %s", user_id, e)
+
+def _flush_loop() -> None:
+    """Body of the background thread writing the queued usage updates"""
+    while True:
+        time.sleep(USAGE_FLUSH_INTERVAL_SECONDS)
+        flush_usage()
+
+# Token counts only feed the in-app usage statistics (OpenAI bills from its own counts,
+# and every model is counted with cl100k_base anyway), so by default they are estimated
+# from the text length. USAGE_EXACT_TOKENS=true counts every request with tiktoken;
+# otherwise a USAGE_EXACT_TOKENS_SAMPLE_RATE share of requests is counted exactly and
+# stored with its estimate, to check the estimate against
+EXACT_TOKEN_COUNTS = os.environ.get("USAGE_EXACT_TOKENS", "false").lower() == "true"
+EXACT_TOKEN_SAMPLE_RATE = float(os.environ.get("USAGE_EXACT_TOKENS_SAMPLE_RATE", "0.01"))
+
+# Longest text prefix tokenized exactly when counting tokens
+TOKEN_COUNT_MAX_CHARS = 200_000
+
+# ASCII texts shorter than this are estimated even in exact counts (1-2 tokens either way)
+TOKEN_COUNT_MIN_CHARS = 8
+
+@lru_cache(maxsize=1)
+def _cl100k_encoding() -> Optional[tiktoken.Encoding]:
+    """The cl100k_base encoding, loaded on the first exact count (None when it cannot be loaded)"""
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning("Could not load the cl100k_base encoding, estimating tokens instead: %s", e)
+        return None
+
+def estimate_tokens(text: str) -> int:
+    """Length-based token estimate: ~4 characters per token, or per 4 UTF-8 bytes for non-ASCII text"""
+    size = len(text) if text.isascii() else len(text.encode('utf-8'))
+    return (size + 3) // 4
 
 class UsageTracker:
     """Track API usage for AI agents including tokens, requests, and costs"""
     
-    def __init__(self, db_client: firestore.Client):
+    def __init__(
+        self,
+        db_client: firestore.Client,
+        exact_tokens: bool = EXACT_TOKEN_COUNTS,
+        exact_sample_rate: float = EXACT_TOKEN_SAMPLE_RATE
+    ):
         self.db = db_client
-        self.encoders = {}  # Cache for tiktoken encoders
+        self.exact_tokens = exact_tokens
+        self.exact_sample_rate = exact_sample_rate
         
         # Model pricing per 1M tokens (input/output) as of 2024
         self.model_pricing = {
@@ -22,48 +172,53 @@ class UsageTracker:
             "gpt-4-turbo": {"input": 10.00, "output": 30.00},
             "gpt-3.5-turbo": {"input": 0.50, "output": 1.50},
         }
-    
-    def get_encoder(self, model: str) -> tiktoken.Encoding:
-        """Get or create tiktoken encoder for a model"""
-        if model not in self.encoders:
-            try:
-                # For most OpenAI models, use cl100k_base encoding
-                encoding_name = "cl100k_base"
-                if "gpt-3.5" in model:
-                    encoding_name = "cl100k_base"
-                elif "gpt-4" in model:
-                    encoding_name = "cl100k_base"
-                
-                self.encoders[model] = tiktoken.get_encoding(encoding_name)
-            except Exception as e:
-                print(f"Warning: Could not get encoder for {model}, using default: {e}")
-                self.encoders[model] = tiktoken.get_encoding("cl100k_base")
         
-        return self.encoders[model]
+        # Same prices per single token (input, output), with the default of unknown models
+        self._price_per_token = {
+            model: (pricing["input"] * 1e-6, pricing["output"] * 1e-6)
+            for model, pricing in self.model_pricing.items()
+        }
+        self._default_price_per_token = (0.001 * 1e-6, 0.002 * 1e-6)
+    
+    def get_encoder(self, model: str) -> Optional[tiktoken.Encoding]:
+        """Get the tiktoken encoder for a model (None when it could not be loaded)"""
+        # Every tracked model is counted with the cl100k_base encoding
+        return _cl100k_encoding()
     
-    def count_tokens(self, text: str, model: str) -> int:
-        """Count tokens in text for a specific model"""
+    def count_tokens(self, text: str, model: str, exact: Optional[bool] = None) -> int:
+        """
+        Count tokens in text for a specific model
+        
+        Estimated from the text length unless exact (default: the tracker's exact_tokens).
+        Special tokens are not looked for: the texts are plain user and model text.
+        Only the first TOKEN_COUNT_MAX_CHARS characters are encoded (BPE gets slow on
+        very long or adversarial inputs); the rest is estimated at ~4 characters per token.
+        """
         if not text:
             return 0
         
+        text = str(text)
+        if exact is None:
+            exact = self.exact_tokens
+        if not exact or (len(text) < TOKEN_COUNT_MIN_CHARS and text.isascii()):
+            return estimate_tokens(text)
+        
         try:
             encoder = self.get_encoder(model)
-            return len(encoder.encode(str(text)))
+            if encoder is None:
+                return len(text) // 4
+            return len(encoder.encode_ordinary(text[:TOKEN_COUNT_MAX_CHARS])) + len(text[TOKEN_COUNT_MAX_CHARS:]) // 4
         except Exception as e:
-            print(f"Error counting tokens: {e}")
+            logger.warning("Error counting tokens: %s", e)
             # Fallback estimation: ~4 characters per token
-            return len(str(text)) // 4
+            return len(text) // 4
     
     def calculate_cost(self, input_tokens: int, output_tokens: int, model: str) -> float:
         """Calculate cost in USD for token usage"""
-        pricing = self.model_pricing.get(model, {"input": 0.001, "output": 0.002})
-        
-        input_cost = (input_tokens / 1_000_000) * pricing["input"]
-        output_cost = (output_tokens / 1_000_000) * pricing["output"]
-        
-        return input_cost + output_cost
+        input_price, output_price = self._price_per_token.get(model, self._default_price_per_token)
+        return input_tokens * input_price + output_tokens * output_price
     
-    async def log_usage(
+    def log_usage(
         self,
         user_id: str,
         agent_name: str,
@@ -71,142 +226,82 @@ class UsageTracker:
         input_text: str = "",
         output_text: str = "",
         request_duration: float = 0.0,
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        batch: Optional[firestore.WriteBatch] = None
     ):
-        """Log usage data to user's Firestore document"""
+        """
+        Log usage data to user's Firestore document
+        
+        The update is queued and written shortly after by the usage flusher thread. When
+        `batch` is given it is set on that batch instead, so it commits together with the
+        caller's other writes.
+        """
         try:
-            # Count tokens
-            input_tokens = self.count_tokens(input_text, model)
-            output_tokens = self.count_tokens(output_text, model)
+            # Count tokens: estimated, except in exact mode and on the sampled requests
+            sampled = not self.exact_tokens and random.random() < self.exact_sample_rate
+            exact = self.exact_tokens or sampled
+            input_tokens = self.count_tokens(input_text, model, exact)
+            output_tokens = self.count_tokens(output_text, model, exact)
             total_tokens = input_tokens + output_tokens
             
             # Calculate cost
             cost = self.calculate_cost(input_tokens, output_tokens, model)
             
-            # Prepare usage data
+            # Prepare usage data (native Firestore types; rounding is left to the read path)
+            now = datetime.now(timezone.utc)
             request_data = {
-                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "timestamp": now,
                 "agent": agent_name,
                 "model": model,
                 "tokens": {
                     "input": input_tokens,
                     "output": output_tokens,
-                    "total": total_tokens
+                    "total": total_tokens,
+                    "exact": exact
                 },
-                "cost_usd": round(cost, 6),
-                "request_duration_seconds": round(request_duration, 3),
+                "cost_usd": cost,
+                "request_duration_seconds": request_duration,
                 "metadata": metadata or {}
             }
+            if sampled:
+                # The estimate of a sampled request, to compare with its exact count
+                request_data["tokens"]["estimated_total"] = (
+                    self.count_tokens(input_text, model, False) + self.count_tokens(output_text, model, False)
+                )
             
-            # Get current date for monthly aggregation
-            current_month = datetime.now(timezone.utc).strftime("%Y-%m")
-            
-            # Update user's usage document
-            user_ref = self.db.collection('users').document(user_id)
-            
-            # Get current user doc
-            user_doc = user_ref.get()
-            user_data = user_doc.to_dict() if user_doc.exists else {}
-            
-            # Initialize usage structure if not exists
-            if "ai_usage" not in user_data:
-                user_data["ai_usage"] = {
-                    "total_requests": 0,
-                    "total_tokens": 0,
-                    "total_cost_usd": 0.0,
-                    "by_agent": {},
-                    "by_model": {},
-                    "monthly": {},
-                    "recent_requests": []
-                }
-            
-            usage = user_data["ai_usage"]
-            
-            # Update totals
-            usage["total_requests"] += 1
-            usage["total_tokens"] += total_tokens
-            usage["total_cost_usd"] = round(usage["total_cost_usd"] + cost, 6)
-            
-            # Update by agent
-            if agent_name not in usage["by_agent"]:
-                usage["by_agent"][agent_name] = {
-                    "requests": 0,
-                    "tokens": 0,
-                    "cost_usd": 0.0
-                }
-            
-            usage["by_agent"][agent_name]["requests"] += 1
-            usage["by_agent"][agent_name]["tokens"] += total_tokens
-            usage["by_agent"][agent_name]["cost_usd"] = round(
-                usage["by_agent"][agent_name]["cost_usd"] + cost, 6
-            )
-            
-            # Update by model
-            if model not in usage["by_model"]:
-                usage["by_model"][model] = {
-                    "requests": 0,
-                    "tokens": 0,
-                    "cost_usd": 0.0
-                }
-            
-            usage["by_model"][model]["requests"] += 1
-            usage["by_model"][model]["tokens"] += total_tokens
-            usage["by_model"][model]["cost_usd"] = round(
-                usage["by_model"][model]["cost_usd"] + cost, 6
-            )
-            
-            # Update monthly stats
-            if current_month not in usage["monthly"]:
-                usage["monthly"][current_month] = {
-                    "requests": 0,
-                    "tokens": 0,
-                    "cost_usd": 0.0,
-                    "by_agent": {},
-                    "by_model": {}
-                }
-            
-            monthly = usage["monthly"][current_month]
-            monthly["requests"] += 1
-            monthly["tokens"] += total_tokens
-            monthly["cost_usd"] = round(monthly["cost_usd"] + cost, 6)
-            
-            # Update monthly by agent
-            if agent_name not in monthly["by_agent"]:
-                monthly["by_agent"][agent_name] = {"requests": 0, "tokens": 0, "cost_usd": 0.0}
-            monthly["by_agent"][agent_name]["requests"] += 1
-            monthly["by_agent"][agent_name]["tokens"] += total_tokens
-            monthly["by_agent"][agent_name]["cost_usd"] = round(
-                monthly["by_agent"][agent_name]["cost_usd"] + cost, 6
-            )
-            
-            # Update monthly by model
-            if model not in monthly["by_model"]:
-                monthly["by_model"][model] = {"requests": 0, "tokens": 0, "cost_usd": 0.0}
-            monthly["by_model"][model]["requests"] += 1
-            monthly["by_model"][model]["tokens"] += total_tokens
-            monthly["by_model"][model]["cost_usd"] = round(
-                monthly["by_model"][model]["cost_usd"] + cost, 6
-            )
-            
-            # Add to recent requests (keep last 100)
-            usage["recent_requests"].append(request_data)
-            if len(usage["recent_requests"]) > 100:
-                usage["recent_requests"] = usage["recent_requests"][-100:]
+            # Month of the request for monthly aggregation (same clock reading as the timestamp)
+            current_month = f"{now.year:04d}-{now.month:02d}"
+            usage = (agent_name, model, current_month, total_tokens, cost, request_data)
             
-            # Update the document
-            user_ref.set(user_data, merge=True)
+            if batch is not None:
+                # Queued on the caller's batch, committed with its other writes
+                entry = _new_usage_entry(self.db)
+                _add_usage(entry, *usage)
+                _stage_usage(batch, self.db, user_id, entry)
+                invalidate_user_usage(user_id)
+            else:
+                _queue_usage(self.db, user_id, *usage)
             
-            print(f"✅ Usage logged: {agent_name} | {model} | {total_tokens} tokens | ${cost:.6f}")
+            logger.debug("Usage queued: %s | %s | %d tokens | $%.6f", agent_name, model, total_tokens, cost)
             
         except Exception as e:
-            print(f"❌ Error logging usage: {e}")
+            logger.warning("Error logging usage: %s", e)
             # Don't raise exception to avoid breaking the main functionality
 
 
+@lru_cache(maxsize=4)
+def get_usage_tracker(db_client: firestore.Client) -> UsageTracker:
+    """Shared UsageTracker of a Firestore client, so its tokenizer cache survives across calls"""
+    return UsageTracker(db_client)
+
+
 def track_ai_usage(agent_name: str, model: str = None):
     """
     Decorator to track AI usage for agent functions
     
+    The wrapped function must take `user_id` and `db_client` parameters; the input
+    text is read from its `text` or `query` parameter.
+    
     Usage:
         @track_ai_usage("expense_parser", "gpt-4.1-nano")
         def my_agent_function(text: str, user_id: str, db_client: firestore.Client):
@@ -214,92 +309,79 @@ def track_ai_usage(agent_name: str, model: str = None):
             return result
     """
     def decorator(func: Callable):
-        @wraps(func)
-        async def async_wrapper(*args, **kwargs):
-            # Extract user_id and db_client from arguments
-            user_id = None
-            db_client = None
-            input_text = ""
+        # Positions of the parameters the tracking reads, resolved once at decoration time
+        positions = {name: i for i, name in enumerate(inspect.signature(func).parameters)}
+        text_param = next((name for name in ("text", "query") if name in positions), "text")
+        
+        def argument(name, args, kwargs):
+            """Value of a parameter of the wrapped function in a call (None if not given)"""
+            if name in kwargs:
+                return kwargs[name]
+            i = positions.get(name)
+            return args[i] if i is not None and i < len(args) else None
+        
+        def call_info(args, kwargs):
+            """Extract user_id, db_client and the input text from the call arguments"""
+            user_id = argument("user_id", args, kwargs)
+            db_client = argument("db_client", args, kwargs)
+            input_text = argument(text_param, args, kwargs) or ""
             
-            # Try to extract from positional args (common patterns)
-            for arg in args:
-                if isinstance(arg, str) and len(arg) > 10 and '.' not in arg:
-                    if not input_text:
-                        input_text = arg
-                elif isinstance(arg, str) and ('.' in arg or len(arg) < 50):
-                    if not user_id:
-                        user_id = arg
-                elif hasattr(arg, 'collection'):  # Firestore client
-                    db_client = arg
+            if not user_id or not db_client:
+                logger.warning("Usage tracking skipped for %s: missing user_id or db_client", agent_name)
+            return user_id, db_client, input_text
+        
+        def log(user_id, db_client, input_text, start_time, result=None, error=None):
+            """Log the usage of one call (failed when error is set)"""
+            # Extract output text from result
+            output_text = ""
+            if isinstance(result, dict):
+                output_text = str(result.get('short_text', '')) + str(result.get('raw_text', ''))
+            elif isinstance(result, str):
+                output_text = result
             
-            # Try to extract from keyword args
-            user_id = user_id or kwargs.get('user_id')
-            db_client = db_client or kwargs.get('db_client')
-            input_text = input_text or kwargs.get('text', '') or kwargs.get('query', '')
+            metadata = {"function": func.__name__, "success": error is None}
+            if error is not None:
+                metadata["error"] = str(error)
             
+            get_usage_tracker(db_client).log_usage(
+                user_id=user_id,
+                agent_name=agent_name,
+                model=model or "unknown",
+                input_text=input_text,
+                output_text=output_text,
+                request_duration=time.time() - start_time,
+                metadata=metadata
+            )
+        
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            user_id, db_client, input_text = call_info(args, kwargs)
             if not user_id or not db_client:
-                print(f"⚠️  Usage tracking skipped for {agent_name}: missing user_id or db_client")
                 return await func(*args, **kwargs)
             
-            # Initialize tracker
-            tracker = UsageTracker(db_client)
             start_time = time.time()
-            
             try:
-                # Execute the original function
                 result = await func(*args, **kwargs)
-                end_time = time.time()
-                
-                # Extract output text from result
-                output_text = ""
-                if isinstance(result, dict):
-                    output_text = str(result.get('short_text', '')) + str(result.get('raw_text', ''))
-                elif isinstance(result, str):
-                    output_text = result
-                
-                # Log usage
-                await tracker.log_usage(
-                    user_id=user_id,
-                    agent_name=agent_name,
-                    model=model or "unknown",
-                    input_text=input_text,
-                    output_text=output_text,
-                    request_duration=end_time - start_time,
-                    metadata={
-                        "function": func.__name__,
-                        "success": True
-                    }
-                )
-                
-                return result
-                
             except Exception as e:
-                end_time = time.time()
-                
-                # Log failed usage
-                await tracker.log_usage(
-                    user_id=user_id,
-                    agent_name=agent_name,
-                    model=model or "unknown",
-                    input_text=input_text,
-                    output_text="",
-                    request_duration=end_time - start_time,
-                    metadata={
-                        "function": func.__name__,
-                        "success": False,
-                        "error": str(e)
-                    }
-                )
-                
+                log(user_id, db_client, input_text, start_time, error=e)
                 raise
+            log(user_id, db_client, input_text, start_time, result=result)
+            return result
         
         @wraps(func)
         def sync_wrapper(*args, **kwargs):
-            # Convert sync function to async for tracking
-            async def async_func():
+            user_id, db_client, input_text = call_info(args, kwargs)
+            if not user_id or not db_client:
                 return func(*args, **kwargs)
             
-            return asyncio.run(async_wrapper(*args, **kwargs))
+            start_time = time.time()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                log(user_id, db_client, input_text, start_time, error=e)
+                raise
+            log(user_id, db_client, input_text, start_time, result=result)
+            return result
         
         # Return async wrapper for async functions, sync wrapper for sync functions
         if asyncio.iscoroutinefunction(func):
@@ -318,22 +400,24 @@ def track_openai_api_call(
     input_text: str,
     output_text: str,
     request_duration: float = 0.0,
-    metadata: Optional[Dict[str, Any]] = None
+    metadata: Optional[Dict[str, Any]] = None,
+    batch: Optional[firestore.WriteBatch] = None
 ):
     """
     Standalone function to track OpenAI API calls
     Use this for manual tracking when the decorator isn't suitable
-    """
-    async def log():
-        tracker = UsageTracker(db_client)
-        await tracker.log_usage(
-            user_id=user_id,
-            agent_name=agent_name,
-            model=model,
-            input_text=input_text,
-            output_text=output_text,
-            request_duration=request_duration,
-            metadata=metadata
-        )
+    Pass `batch` to queue the usage update on a WriteBatch committed by the caller
     
-    asyncio.run(log())
+    Plain sync call, safe from both threads and coroutines: the Firestore write itself
+    is done by the usage flusher thread.
+    """
+    get_usage_tracker(db_client).log_usage(
+        user_id=user_id,
+        agent_name=agent_name,
+        model=model,
+        input_text=input_text,
+        output_text=output_text,
+        request_duration=request_duration,
+        metadata=metadata,
+        batch=batch
+    )
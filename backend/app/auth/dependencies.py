@@ -1,6 +1,8 @@
 from fastapi import Depends, HTTPException, status, Security
 from fastapi.security import OAuth2PasswordBearer
 from .firebase_admin import verify_firebase_token
+import base64
+import binascii
 import json
 from typing import Optional, Dict, Any
 
@@ -63,3 +65,23 @@ def get_current_user(token: Optional[str] = Security(oauth2_scheme)):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Errore di autenticazione: {str(e)}"
         )
+
+def unverified_user_id(token: Optional[str]) -> Optional[str]:
+    """
+    User ID claimed by a token, read from its payload WITHOUT verifying it.
+
+    Only for starting a read before `get_current_user` returns: its result must be
+    discarded unless the verified user_id matches.
+    """
+    if not token:
+        return None
+    if token == MOCK_TOKEN:
+        return MOCK_USER["user_id"]
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError, binascii.Error):
+        return None
+    user_id = claims.get("user_id") or claims.get("sub") if isinstance(claims, dict) else None
+    # Anything that is not a plain document id is left to the verified path
+    return user_id if isinstance(user_id, str) and user_id and "/" not in user_id else None
@@ -1,7 +1,13 @@
 import firebase_admin
 from firebase_admin import credentials, auth
+import hashlib
+import logging
 import os
-import traceback
+import threading
+import time
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
 
 # Path to the Firebase Admin SDK service account key
 cred_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
@@ -11,24 +17,34 @@ try:
     # Check if the Firebase app is already initialized
     try:
         firebase_app = firebase_admin.get_app()
-        print("Firebase app already initialized")
+        logger.info("Firebase app already initialized")
     except ValueError:
         # Not initialized yet, initialize the app
-        print(f"Initializing Firebase admin with credentials from: {cred_path}")
+        logger.info("Initializing Firebase admin with credentials from: %s", cred_path)
         if cred_path and os.path.exists(cred_path):
             cred = credentials.Certificate(cred_path)
             firebase_app = firebase_admin.initialize_app(cred)
         else:
-            print(f"Warning: Firebase credentials file not found at {cred_path}")
+            logger.warning("Firebase credentials file not found at %s", cred_path)
             # Initialize with no credentials for development (will only work with mock token)
             firebase_app = firebase_admin.initialize_app()
-            print("Firebase initialized without credentials - only mock authentication will work")
+            logger.warning("Firebase initialized without credentials - only mock authentication will work")
 except Exception as e:
-    print(f"Error initializing Firebase: {e}")
-    traceback.print_exc()
+    logger.exception("Error initializing Firebase: %s", e)
     # Define the app as None, will rely on mock authentication
     firebase_app = None
 
+# Decoded tokens are reused for a few minutes (never past their own expiry), so the
+# requests a client sends with the same token are verified only once
+TOKEN_CACHE_TTL_SECONDS = 300
+
+_TOKEN_CACHE = TTLCache(maxsize=10_000, ttl=TOKEN_CACHE_TTL_SECONDS)
+_TOKEN_LOCK = threading.Lock()
+
+def _token_cache_key(id_token: str) -> bytes:
+    """Cache key of a token: a hash, so the cache never holds usable tokens"""
+    return hashlib.blake2b(id_token.encode(), digest_size=16).digest()
+
 def verify_firebase_token(id_token):
     """
     Verify the Firebase ID token and return the decoded token.
@@ -36,7 +52,7 @@ def verify_firebase_token(id_token):
     try:
         # Special case for development
         if id_token == "test-token-for-swagger-ui":
-            print("Using test token for authentication")
+            logger.debug("Using test token for authentication")
             return {
                 "uid": "admin",
                 "email": "admin@admin.com",
@@ -45,25 +61,31 @@ def verify_firebase_token(id_token):
             
         # Proceed with normal verification
         if firebase_app is None:
-            print("Firebase app not initialized, cannot verify token")
+            logger.warning("Firebase app not initialized, cannot verify token")
             return None
             
-        # Verify the ID token with more detailed logging
-        print(f"Verifying token: {id_token[:10]}...")
+        key = _token_cache_key(id_token)
+        with _TOKEN_LOCK:
+            decoded_token = _TOKEN_CACHE.get(key)
+        if decoded_token is not None and decoded_token.get("exp", 0) > time.time():
+            return decoded_token
+        
+        # Verify the ID token
         decoded_token = auth.verify_id_token(id_token)
-        print(f"Token verified successfully for user: {decoded_token.get('uid')}")
+        logger.debug("Token verified successfully for user: %s", decoded_token.get('uid'))
+        with _TOKEN_LOCK:
+            _TOKEN_CACHE[key] = decoded_token
         return decoded_token
     except auth.InvalidIdTokenError:
-        print(f"Invalid ID token provided")
+        logger.info("Invalid ID token provided")
         return None
     except auth.ExpiredIdTokenError:
-        print(f"Expired ID token provided")
+        logger.info("Expired ID token provided")
         return None
     except auth.RevokedIdTokenError:
-        print(f"Revoked ID token provided")
+        logger.info("Revoked ID token provided")
         return None
     except Exception as e:
         # Handle token verification errors with traceback
-        print(f"Token verification error: {e}")
-        traceback.print_exc()
+        logger.exception("Token verification error: %s", e)
         return None
@@ -1,12 +1,19 @@
+import asyncio
+import logging
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional, Literal
 from datetime import datetime
 from pydantic import BaseModel
-from firebase_admin import firestore
+from google.cloud import firestore
 from app.auth.dependencies import get_current_user
+from app.db import FIRESTORE_BATCH_LIMIT, get_async_db
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["Chat"])
-db = firestore.client()
+
+# Maximum number of delete batches committed at once when clearing a chat
+DELETE_CONCURRENCY = 8
 
 # Pydantic models for request and response
 class MessageCreate(BaseModel):
@@ -23,11 +30,6 @@ class Message(BaseModel):
     message_type: Literal["user", "system"]
     expense_data: Optional[dict] = None  # Include expense data in response
     expense_ids: Optional[List[str]] = None  # Include expense IDs in response
-    
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
 
 @router.post("/messages", response_model=Message, status_code=status.HTTP_201_CREATED)
 async def create_message(
@@ -50,11 +52,11 @@ async def create_message(
     }
     
     # Add the message to Firestore
-    message_ref = db.collection("messages").document()
-    message_ref.set(message_data)
+    message_ref = get_async_db().collection("messages").document()
+    await message_ref.set(message_data)
     
     # Get the created message (to return the server timestamp)
-    created_message = message_ref.get()
+    created_message = await message_ref.get()
     message_dict = created_message.to_dict()
     
     # Return the created message with its ID
@@ -82,27 +84,22 @@ async def get_messages(
     
     try:
         # Simple query for the most recent messages
-        query = db.collection("messages") \
+        query = get_async_db().collection("messages") \
                  .where("user_id", "==", user_id) \
                  .order_by("timestamp", direction=firestore.Query.DESCENDING) \
                  .limit(limit)
         
         messages = []
-        for doc in query.stream():
+        async for doc in query.stream():
             try:
                 message_data = doc.to_dict()
                 
-                # Handle timestamp - ensure it's a datetime
-                timestamp = message_data.get("timestamp")
-                if not isinstance(timestamp, datetime):
-                    # Convert Firestore timestamp to datetime if needed
-                    if hasattr(timestamp, "seconds"):
-                        timestamp = datetime.fromtimestamp(timestamp.seconds)
-                    else:
-                        timestamp = datetime.now()
+                # Firestore returns timestamps as datetimes already; fall back to now if missing
+                timestamp = message_data.get("timestamp") or datetime.now()
                 
+                # Documents written by create_message: built without re-validating them
                 messages.append(
-                    Message(
+                    Message.model_construct(
                         id=doc.id,
                         content=message_data["content"],
                         user_id=message_data["user_id"],
@@ -113,11 +110,12 @@ async def get_messages(
                     )
                 )
             except Exception as e:
-                print(f"Error processing message document {doc.id}: {e}")
+                logger.warning("Error processing message document %s: %s", doc.id, e)
                 continue
         
-        # Return messages in chronological order (oldest to newest)
-        return sorted(messages, key=lambda x: x.timestamp)
+        # Return messages in chronological order (oldest to newest): the query returned them newest first
+        messages.reverse()
+        return messages
         
     except Exception as e:
         raise HTTPException(
@@ -136,8 +134,8 @@ async def delete_message(
     user_id = current_user["user_id"]
     
     # Get the message
-    message_ref = db.collection("messages").document(message_id)
-    message = message_ref.get()
+    message_ref = get_async_db().collection("messages").document(message_id)
+    message = await message_ref.get()
     
     # Check if message exists
     if not message.exists:
@@ -155,7 +153,7 @@ async def delete_message(
         )
     
     # Delete the message
-    message_ref.delete()
+    await message_ref.delete()
     
     return None
 
@@ -168,24 +166,24 @@ async def delete_all_messages(
     """
     user_id = current_user["user_id"]
     
-    # Query all messages for the current user
+    # Only the references are needed: fetch the user's messages without their fields
+    db = get_async_db()
     messages_ref = db.collection("messages").where("user_id", "==", user_id)
-    
-    # Delete messages in batches (Firestore has a limit of 500 operations per batch)
-    batch_size = 450  # Leave some room for other potential operations
-    
-    while True:
-        batch = db.batch()
-        docs = messages_ref.limit(batch_size).stream()
-        
-        count = 0
-        for doc in docs:
-            batch.delete(doc.reference)
-            count += 1
-        
-        if count == 0:
-            break
-        
-        batch.commit()
+    refs = [doc.reference async for doc in messages_ref.select([]).stream()]
+    
+    # Delete them in batches of up to 500 deletes, committed concurrently
+    semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+    
+    async def delete_batch(batch_refs):
+        async with semaphore:
+            batch = db.batch()
+            for ref in batch_refs:
+                batch.delete(ref)
+            await batch.commit()
+    
+    await asyncio.gather(*[
+        delete_batch(refs[i:i + FIRESTORE_BATCH_LIMIT])
+        for i in range(0, len(refs), FIRESTORE_BATCH_LIMIT)
+    ])
     
     return None
@@ -0,0 +1,73 @@
+from functools import lru_cache
+from itertools import islice
+from typing import Iterable, Optional, Tuple
+from google.cloud import firestore
+
+@lru_cache(maxsize=1)
+def get_db() -> firestore.Client:
+    """
+    Shared Firestore client.
+
+    Creating a client resolves credentials and opens gRPC channels, so it is
+    done once per process and reused by every request.
+    """
+    return firestore.Client()
+
+@lru_cache(maxsize=1)
+def get_async_db() -> firestore.AsyncClient:
+    """
+    Shared async Firestore client, for reads and writes awaited directly by async
+    endpoints instead of being offloaded to worker threads.
+
+    Created lazily, on the first call from the running event loop.
+    """
+    return firestore.AsyncClient()
+
+# Maximum number of writes Firestore accepts in one batch
+FIRESTORE_BATCH_LIMIT = 500
+
+# Writes a batch passed to commit_in_batches may already hold (e.g. a usage update)
+BATCH_HEADROOM = 10
+
+def commit_in_batches(
+    db: firestore.Client,
+    writes: Iterable[Tuple[firestore.DocumentReference, dict]],
+    batch: Optional[firestore.WriteBatch] = None
+) -> None:
+    """
+    Set many documents with as few round-trips as possible.
+
+    Args:
+        db: Firestore client instance
+        writes: (document reference, data) pairs, committed in WriteBatches of up to 500 writes
+        batch: Optional batch already holding a few writes (at most BATCH_HEADROOM,
+            e.g. a usage update), committed together with the first writes
+    """
+    writes = iter(writes)
+    if batch is not None:
+        for ref, data in islice(writes, FIRESTORE_BATCH_LIMIT - BATCH_HEADROOM):
+            batch.set(ref, data)
+        batch.commit()
+    while chunk := list(islice(writes, FIRESTORE_BATCH_LIMIT)):
+        batch = db.batch()
+        for ref, data in chunk:
+            batch.set(ref, data)
+        batch.commit()
+
+async def acommit_in_batches(
+    db: firestore.AsyncClient,
+    writes: Iterable[Tuple[firestore.AsyncDocumentReference, dict]]
+) -> None:
+    """
+    Async variant of `commit_in_batches`: set many documents in WriteBatches of up to 500 writes.
+
+    Args:
+        db: Async Firestore client instance
+        writes: (document reference, data) pairs
+    """
+    writes = iter(writes)
+    while chunk := list(islice(writes, FIRESTORE_BATCH_LIMIT)):
+        batch = db.batch()
+        for ref, data in chunk:
+            batch.set(ref, data)
+        await batch.commit()
@@ -1,8 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from google.cloud import firestore
 from pydantic import BaseModel
 from typing import List, Optional, Dict
 from app.auth.dependencies import get_current_user
+from app.db import get_async_db
+from app.tags.cache import add_main_tag_icons
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["Expenses"])
 
@@ -17,42 +23,69 @@ class Expense(BaseModel):
     short_text: str = ""  # A short description of what was purchased
     main_tag_icon: Optional[str] = None # Font Awesome icon for the primary area tag
 
-def _enrich_expense_with_icon(expense_data: Dict, db_client: firestore.Client) -> Dict:
-    """Fetches and adds the main_tag_icon to expense_data based on the first area_tag."""
-    expense_data['main_tag_icon'] = "tag"  # Default icon
-    if expense_data.get("area_tags") and len(expense_data["area_tags"]) > 0:
-        first_area_tag_id = expense_data["area_tags"][0].lower()
-        try:
-            tag_ref = db_client.collection('tags').document(first_area_tag_id)
-            tag_doc = tag_ref.get()
-            if tag_doc.exists:
-                tag_data_db = tag_doc.to_dict()
-                if tag_data_db and 'icon' in tag_data_db:
-                    expense_data['main_tag_icon'] = tag_data_db['icon']
-            # else: tag not found, default 'tag' icon remains
-        except Exception as e:
-            print(f"Error fetching tag '{first_area_tag_id}' for icon: {str(e)}")
-            # In case of error, default 'tag' icon remains
+# Fields returned by list_expenses (extra fields stored by the parsers, e.g. receipt flags, are left out)
+EXPENSE_LIST_FIELDS = list(Expense.model_fields)
+
+# Largest page of expenses returned by list_expenses
+MAX_PAGE_SIZE = 500
+
+# Response header holding the cursor of the next page of expenses
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+async def _cursor_snapshot(db_client: firestore.AsyncClient, cursor: str) -> firestore.DocumentSnapshot:
+    """Expense a page cursor refers to (the last expense of the previous page)"""
+    cursor_doc = await db_client.collection('expenses').document(cursor).get()
+    if not cursor_doc.exists:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid cursor')
+    return cursor_doc
+
+async def _enrich_expense_with_icon(expense_data: Dict, db_client: firestore.AsyncClient) -> Dict:
+    """Adds the main_tag_icon to expense_data based on the first area_tag ('tag' if it has none)."""
+    await add_main_tag_icons([expense_data], db_client)
     return expense_data
 
 @router.get('/')
-def list_expenses(current_user: dict = Depends(get_current_user)):
+async def list_expenses(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    List the user's expenses.
+    
+    - limit: Page size. Without it all the expenses are returned; with it the newest
+      ones, newest first, and the X-Next-Cursor header holds the cursor of the next page
+    - cursor: Cursor of the page to return (from X-Next-Cursor)
+    """
     user_id = current_user["user_id"]
-    db = firestore.Client()
-    docs_stream = db.collection('expenses').where('user_id', '==', user_id).stream()
+    db = get_async_db()
+    query = db.collection('expenses').where('user_id', '==', user_id).select(EXPENSE_LIST_FIELDS)
+    if limit is not None:
+        # Served by the (user_id, timestamp desc) composite index of firestore.indexes.json
+        query = query.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit)
+        if cursor:
+            query = query.start_after(await _cursor_snapshot(db, cursor))
+    
     expenses = []
-    for doc in docs_stream:
+    async for doc in query.stream():
         expense_data = doc.to_dict()
         expense_data['id'] = doc.id # Ensure ID is included
-        enriched_expense = _enrich_expense_with_icon(expense_data, db)
-        expenses.append(enriched_expense)
+        expenses.append(expense_data)
+    
+    # A full page may be followed by another one
+    if limit is not None and len(expenses) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = expenses[-1]['id']
+    
+    # The icon is stored with the expense; only expenses saved without one need their tag read
+    await add_main_tag_icons(expenses, db, missing_only=True)
     return expenses
 
 @router.get('/{expense_id}')
-def get_expense(expense_id: str, current_user: dict = Depends(get_current_user)):
-    db = firestore.Client()
+async def get_expense(expense_id: str, current_user: dict = Depends(get_current_user)):
+    db = get_async_db()
     doc_ref = db.collection('expenses').document(expense_id)
-    doc = doc_ref.get()
+    doc = await doc_ref.get()
     
     if not doc.exists:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Expense not found')
@@ -65,30 +98,30 @@ def get_expense(expense_id: str, current_user: dict = Depends(get_current_user))
             detail="Cannot access expenses of other users"
         )
     
-    enriched_expense_data = _enrich_expense_with_icon(expense_data, db)
-    return enriched_expense_data
+    await add_main_tag_icons([expense_data], db, missing_only=True)
+    return expense_data
 
 @router.post('/')
-def create_expense(expense: Expense, current_user: dict = Depends(get_current_user)):
+async def create_expense(expense: Expense, current_user: dict = Depends(get_current_user)):
     if expense.user_id != current_user["user_id"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Cannot create expenses for other users"
         )
     
-    db = firestore.Client()
-    data = expense.dict()
+    db = get_async_db()
+    data = expense.model_dump()
     # Enrich with icon before saving
-    enriched_data = _enrich_expense_with_icon(data, db)
+    enriched_data = await _enrich_expense_with_icon(data, db)
     
-    doc_ref = db.collection('expenses').add(enriched_data)
+    doc_ref = await db.collection('expenses').add(enriched_data)
     return {'id': doc_ref[1].id, **enriched_data}
 
 @router.patch('/{expense_id}')
-def update_expense(expense_id: str, expense_update: dict, current_user: dict = Depends(get_current_user)):
-    db = firestore.Client()
+async def update_expense(expense_id: str, expense_update: dict, current_user: dict = Depends(get_current_user)):
+    db = get_async_db()
     doc_ref = db.collection('expenses').document(expense_id)
-    doc = doc_ref.get()
+    doc = await doc_ref.get()
     
     if not doc.exists:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Expense not found')
@@ -108,17 +141,20 @@ def update_expense(expense_id: str, expense_update: dict, current_user: dict = D
             detail="Cannot change expense ownership"
         )
     
-    doc_ref.update(expense_update)
+    # The stored icon follows the first area tag
+    if 'area_tags' in expense_update:
+        await _enrich_expense_with_icon(expense_update, db)
     
-    # Get the updated document
-    updated_doc = doc_ref.get()
-    return updated_doc.to_dict()
+    await doc_ref.update(expense_update)
+    
+    # The updated document is the one read above with the update applied: no second read
+    return {**expense_data, **expense_update}
 
 @router.delete('/{expense_id}')
-def delete_expense(expense_id: str, current_user: dict = Depends(get_current_user)):
-    db = firestore.Client()
+async def delete_expense(expense_id: str, current_user: dict = Depends(get_current_user)):
+    db = get_async_db()
     doc_ref = db.collection('expenses').document(expense_id)
-    doc = doc_ref.get()
+    doc = await doc_ref.get()
     
     if not doc.exists:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Expense not found')
@@ -131,17 +167,25 @@ def delete_expense(expense_id: str, current_user: dict = Depends(get_current_use
             detail="Cannot delete expenses of other users"
         )
     
-    doc_ref.delete()
+    await doc_ref.delete()
     return {'status': 'deleted'}
 
 @router.get('/by-tag/{tag_id}')
-def get_expenses_by_tag(tag_id: str, current_user: dict = Depends(get_current_user)):
+async def get_expenses_by_tag(tag_id: str, current_user: dict = Depends(get_current_user)):
     """Get all expenses associated with a specific tag"""
     user_id = current_user["user_id"]
-    db = firestore.Client()
+    db = get_async_db()
+    
+    # Expenses have the tag in either of their tag arrays: one array-contains query per array, run concurrently
+    user_expenses = db.collection('expenses').where('user_id', '==', user_id)
+    
+    async def matching(field: str) -> list:
+        return [doc async for doc in user_expenses.where(field, 'array_contains', tag_id).stream()]
     
-    # Query expenses that have this tag in their tags array
-    # Firestore array-contains query
-    docs = db.collection('expenses').where('user_id', '==', user_id).where('tags', 'array_contains', tag_id).stream()
+    area_docs, context_docs = await asyncio.gather(matching('area_tags'), matching('context_tags'))
     
-    return [doc.to_dict() for doc in docs]
+    # An expense with the tag in both arrays is returned once
+    expenses = {}
+    for doc in area_docs + context_docs:
+        expenses.setdefault(doc.id, {**doc.to_dict(), 'id': doc.id})
+    return list(expenses.values())
@@ -1,13 +1,44 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from anyio import to_thread
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from app.agents.router import router as agents_router
-from app.expenses.router import router as expenses_router
+from app.expenses.router import NEXT_CURSOR_HEADER, router as expenses_router
 from app.auth.router import router as auth_router
 from app.reports.router import router as reports_router
 from app.chat.router import router as chat_router
 from app.tags.router import router as tags_router
 from app.users.router import router as users_router
+from app.agents.llm import OPENAI_API_KEY, aclose_http_clients
+from app.agents.usage_tracker import flush_usage
 from fastapi.middleware.cors import CORSMiddleware
 
+# Application-wide logging: INFO by default, LOG_LEVEL=DEBUG for the verbose parser traces.
+# Records are queued by the request handlers and written to stderr by a
+# background listener thread, so requests never block on console I/O.
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler queuing records as they are: only the listener's handler formats them"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_handler)
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    handlers=[_DeferredQueueHandler(_log_queue)]
+)
+_log_listener.start()
+
+logger = logging.getLogger(__name__)
+
 # Define tags metadata for Swagger UI organization
 tags_metadata = [
     {
@@ -40,19 +71,76 @@ tags_metadata = [
     }
 ]
 
+# Swagger UI, ReDoc and the OpenAPI schema are served unless API_DOCS=false (e.g. in production)
+API_DOCS = os.environ.get("API_DOCS", "true").lower() == "true"
+
+# Size of the thread pools running blocking work (sync endpoints, Firestore and LLM calls)
+WORKER_THREADS = 200
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fail fast on a missing OpenAI key rather than on the first AI request
+    if not OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY environment variable not found: the AI agents cannot run without it")
+    
+    # Raise the worker thread caps: anyio's (sync endpoints, default 40) and the
+    # event loop's default executor (asyncio.to_thread, default min(32, cpus + 4))
+    to_thread.current_default_thread_limiter().total_tokens = WORKER_THREADS
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=WORKER_THREADS))
+    # Build the OpenAPI schema now rather than on the first docs request
+    if API_DOCS:
+        app.openapi()
+    yield
+    # Write the AI usage still queued for the usage flusher
+    await asyncio.to_thread(flush_usage)
+    # Release the pooled connections to the OpenAI API
+    await aclose_http_clients()
+    # Flush the queued log records
+    _log_listener.stop()
+
 app = FastAPI(
     title="MoneyManager API",
     description="Backend API for the MoneyManager expense tracking application",
     version="1.0.0",
-    openapi_tags=tags_metadata
+    openapi_tags=tags_metadata,
+    lifespan=lifespan,
+    docs_url="/docs" if API_DOCS else None,
+    redoc_url="/redoc" if API_DOCS else None,
+    openapi_url="/openapi.json" if API_DOCS else None,
+    # Serialize every JSON response with orjson instead of the stdlib json module
+    default_response_class=ORJSONResponse
 )
 
+@app.middleware("http")
+async def handle_unexpected_errors(request: Request, call_next):
+    """
+    Log unexpected errors once, centrally, and answer them with a JSON 500.
+    
+    Registered before the CORS middleware so error responses still carry CORS headers.
+    """
+    try:
+        return await call_next(request)
+    except Exception as e:
+        logger.exception("Unhandled error on %s %s", request.method, request.url.path)
+        return ORJSONResponse(
+            status_code=500,
+            content={"detail": f"Internal server error: {str(e)}"}
+        )
+
+# Origins allowed to call the API: the hosted frontend and the local dev server,
+# overridable with a comma-separated CORS_ORIGINS
+CORS_ORIGINS = os.environ.get(
+    "CORS_ORIGINS",
+    "https://moneymanager-f7891.web.app,https://moneymanager-f7891.firebaseapp.com,http://localhost:3000"
+).split(",")
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=[origin.strip() for origin in CORS_ORIGINS if origin.strip()],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PATCH", "DELETE"],
+    allow_headers=["Authorization", "Content-Type"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 app.include_router(agents_router, prefix='/api/agents')
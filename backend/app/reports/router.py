@@ -1,15 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import JSONResponse
-from google.cloud import firestore
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from app.auth.dependencies import get_current_user
+from app.db import get_async_db
 
 router = APIRouter(tags=["Reports"])
 
+# Largest page of aggregates returned by get_report
+MAX_PAGE_SIZE = 500
+
 @router.get("/{period}")
-def get_report(period: str, current_user: dict = Depends(get_current_user)):
+async def get_report(
+    period: str,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Aggregates of a period for the authenticated user.
+    
+    - limit: Page size (by document id). Without it all the aggregates are returned;
+      with it next_cursor is the cursor of the next page (None on the last one)
+    - cursor: Cursor of the page to return (a previous next_cursor)
+    """
     user_id = current_user["user_id"]
-    db = firestore.Client()
+    db = get_async_db()
     # Fetch aggregates by period for the authenticated user
-    docs = db.collection('aggregates').where('periodKey', '==', period).where('user_id', '==', user_id).stream()
+    query = db.collection('aggregates').where('periodKey', '==', period).where('user_id', '==', user_id)
+    if limit is not None:
+        query = query.order_by('__name__').limit(limit)
+        if cursor:
+            query = query.start_after({'__name__': db.collection('aggregates').document(cursor)})
+    
+    docs = [doc async for doc in query.stream()]
+    next_cursor = docs[-1].id if limit is not None and len(docs) == limit else None
     data = [doc.to_dict() for doc in docs]
-    return JSONResponse(content={"period": period, "data": data})
+    # Returned as a dict: FastAPI encodes Firestore timestamps before the default ORJSONResponse serializes it
+    return {"period": period, "data": data, "next_cursor": next_cursor}
@@ -0,0 +1,25 @@
+import hashlib
+from typing import Any
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+
+def etag_response(request: Request, content: Any) -> Response:
+    """
+    JSON response carrying a weak ETag of its body, or an empty 304 when the
+    client's If-None-Match already holds that ETag.
+
+    Clients revalidate on every fetch (no-cache), so a change is seen right away;
+    an unchanged response costs only the headers.
+    """
+    # Encoded like FastAPI does for returned values (e.g. Firestore timestamps): orjson rejects their subclass
+    response = ORJSONResponse(jsonable_encoder(content))
+    etag = 'W/"%s"' % hashlib.blake2b(response.body, digest_size=16).hexdigest()
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return response
@@ -0,0 +1,52 @@
+# Run from backend/: python -m app.scripts.backfill_main_tag_icons
+from dotenv import load_dotenv
+from app.db import get_db
+
+# Load environment variables
+load_dotenv()
+
+# Expenses read per page while scanning the collection
+PAGE_SIZE = 500
+
+# Function to load the icon of every tag (the tags collection is small: one read of it all)
+def load_tag_icons(db):
+    icons = {}
+    for doc in db.collection('tags').select(['icon']).stream():
+        icon = (doc.to_dict() or {}).get('icon')
+        if icon:
+            icons[doc.id] = icon
+    return icons
+
+# Function to store main_tag_icon on the expenses saved without one
+def backfill_main_tag_icons():
+    db = get_db()
+    icons = load_tag_icons(db)
+    print(f"Loaded icons of {len(icons)} tags")
+
+    # BulkWriter sends the updates in parallel batches, throttled to Firestore's ramp-up limits
+    bulk_writer = db.bulk_writer()
+    query = db.collection('expenses').select(['area_tags', 'main_tag_icon']).order_by('__name__').limit(PAGE_SIZE)
+
+    scanned = updated = 0
+    last_doc = None
+    while True:
+        page = list((query.start_after(last_doc) if last_doc else query).stream())
+        if not page:
+            break
+        for doc in page:
+            expense_data = doc.to_dict()
+            if not expense_data.get('main_tag_icon'):
+                area_tags = expense_data.get('area_tags')
+                icon = icons.get(area_tags[0].lower(), "tag") if area_tags else "tag"
+                bulk_writer.update(doc.reference, {'main_tag_icon': icon})
+                updated += 1
+        scanned += len(page)
+        last_doc = page[-1]
+        print(f"Scanned {scanned} expenses, {updated} to update")
+
+    bulk_writer.close()
+    print(f"Done: stored main_tag_icon on {updated} of {scanned} expenses")
+
+if __name__ == "__main__":
+    print("Backfilling main_tag_icon on expenses...")
+    backfill_main_tag_icons()
@@ -1,6 +1,7 @@
 import requests
 import json
 import os
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -9,6 +10,11 @@ load_dotenv()
 # API URL
 API_URL = os.getenv("API_URL", "http://localhost:8000")
 
+# Shared session: the token and tag generation calls reuse the same keep-alive connection
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
 # Common expense categories
 common_area_tags = [
     "food", "groceries", "restaurant", "coffee", "clothes", "shopping", 
@@ -25,7 +31,7 @@ common_context_tags = [
 # Function to get a test token for authentication
 def get_test_token():
     try:
-        response = requests.post(
+        response = SESSION.post(
             f"{API_URL}/api/auth/token",
             data={"username": "admin", "password": "admin"}
         )
@@ -48,7 +54,7 @@ def generate_tags(token):
             "context": common_context_tags
         }
         
-        response = requests.post(
+        response = SESSION.post(
             f"{API_URL}/api/agents/bulk_tag_generator/",
             headers=headers,
             json=payload
@@ -0,0 +1,79 @@
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+from cachetools import TTLCache
+from google.cloud import firestore
+from app.agents.expense_parser import invalidate_tags_snapshot
+
+logger = logging.getLogger(__name__)
+
+# How long a tag read for its icon is reused (tags change rarely, and every write below invalidates)
+TAG_CACHE_TTL_SECONDS = 300
+
+# Tag id -> {icon, facet, name}, or None for a tag that does not exist
+_TAG_CACHE = TTLCache(maxsize=2048, ttl=TAG_CACHE_TTL_SECONDS)
+_TAG_LOCK = threading.Lock()
+
+def invalidate_tag(tag_id: str) -> None:
+    """
+    Drop the cached data of a tag, e.g. after it was created, updated or deleted.
+
+    The expense parsers' tags snapshot is dropped too: the icon they resolve is
+    stored on the expenses they save, so it must not lag behind tag writes.
+    """
+    with _TAG_LOCK:
+        _TAG_CACHE.pop(tag_id, None)
+    invalidate_tags_snapshot()
+
+async def get_cached_tags(tag_ids: Iterable[str], db_client: firestore.AsyncClient) -> Dict[str, Optional[Dict]]:
+    """
+    Icon, facet and name of the given tags (None for missing ones).
+
+    Tags not cached yet are fetched with a single get_all round-trip; on a read
+    error they are left out of the result.
+    """
+    tag_ids = set(tag_ids)
+    tags = {}
+    with _TAG_LOCK:
+        for tag_id in tag_ids:
+            if tag_id in _TAG_CACHE:
+                tags[tag_id] = _TAG_CACHE[tag_id]
+
+    missing = [tag_id for tag_id in tag_ids if tag_id not in tags]
+    if not missing:
+        return tags
+
+    tag_refs = [db_client.collection('tags').document(tag_id) for tag_id in missing]
+    try:
+        fetched = {}
+        async for tag_doc in db_client.get_all(tag_refs, field_paths=['icon', 'facet', 'name']):
+            fetched[tag_doc.id] = (tag_doc.to_dict() or {}) if tag_doc.exists else None
+    except Exception as e:
+        logger.warning("Error fetching tags %s: %s", missing, e)
+        return tags
+
+    with _TAG_LOCK:
+        _TAG_CACHE.update(fetched)
+    tags.update(fetched)
+    return tags
+
+async def add_main_tag_icons(
+    expenses: List[Dict],
+    db_client: firestore.AsyncClient,
+    missing_only: bool = False
+) -> None:
+    """
+    Set main_tag_icon on expenses: the icon of their first area tag ('tag' if there is none).
+
+    The icon is stored on the expense documents when they are written, so reads
+    only fill it in (missing_only) for expenses saved without one.
+    """
+    if missing_only:
+        expenses = [expense_data for expense_data in expenses if not expense_data.get('main_tag_icon')]
+    # First area tag of each expense; tag ids are lower-cased and icons resolved once per distinct tag
+    main_tags = [(expense_data.get('area_tags') or [None])[0] for expense_data in expenses]
+    tag_ids = {tag: tag.lower() for tag in set(main_tags) if tag}
+    tags = await get_cached_tags(tag_ids.values(), db_client) if tag_ids else {}
+    icons = {tag: (tags.get(tag_id) or {}).get('icon') or "tag" for tag, tag_id in tag_ids.items()}
+    for expense_data, tag in zip(expenses, main_tags):
+        expense_data['main_tag_icon'] = icons.get(tag, "tag")
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from google.cloud import firestore
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from google.api_core.exceptions import AlreadyExists, NotFound
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
 from app.auth.dependencies import get_current_user
+from app.db import get_async_db
+from app.responses import etag_response
+from app.tags.cache import invalidate_tag
 
 router = APIRouter(tags=["Tags"])
 
@@ -25,69 +28,73 @@ class TagCreate(TagBase):
     """Model for creating a new tag without requiring created_at field"""
     pass
 
+# Fields returned by the tag reads: everything but the (large) embedding. Listed
+# explicitly: tags also hold fields the models above don't declare (colors)
+TAG_LIST_FIELDS = ['tag_id', 'name', 'facet', 'synonyms', 'icon', 'colors', 'active', 'created_at']
+
 @router.get('/')
-def list_tags(current_user: dict = Depends(get_current_user)):
-    """List all active tags"""
-    db = firestore.Client()
-    docs = db.collection('tags').where('active', '==', True).stream()
-    return [doc.to_dict() for doc in docs]
+async def list_tags(request: Request, current_user: dict = Depends(get_current_user)):
+    """List all active tags (304 when unchanged since the client's copy)"""
+    db = get_async_db()
+    docs = db.collection('tags').where('active', '==', True).select(TAG_LIST_FIELDS).stream()
+    return etag_response(request, [doc.to_dict() async for doc in docs])
 
 @router.get('/{tag_id}')
-def get_tag(tag_id: str, current_user: dict = Depends(get_current_user)):
-    """Get a specific tag by ID"""
-    db = firestore.Client()
+async def get_tag(tag_id: str, request: Request, current_user: dict = Depends(get_current_user)):
+    """Get a specific tag by ID (304 when unchanged since the client's copy)"""
+    db = get_async_db()
     doc_ref = db.collection('tags').document(tag_id)
-    doc = doc_ref.get()
+    doc = await doc_ref.get(field_paths=TAG_LIST_FIELDS)
     
     if not doc.exists:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Tag not found')
     
-    return doc.to_dict()
+    return etag_response(request, doc.to_dict())
 
 @router.get('/{facet}/{tag_id}')
-def get_tag_by_facet(facet: str, tag_id: str, current_user: dict = Depends(get_current_user)):
+async def get_tag_by_facet(facet: str, tag_id: str, current_user: dict = Depends(get_current_user)):
     """Get a specific tag by facet and ID"""
     if facet not in ['area', 'context']:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Facet must be either "area" or "context"')
     
-    db = firestore.Client()
-    # Query tags collection with filters for both facet and tag_id
-    query = db.collection('tags').where('facet', '==', facet).where('tag_id', '==', tag_id)
-    docs = list(query.stream())
+    db = get_async_db()
+    # Tags are stored under their tag_id: a point read, then the facet is checked
+    doc = await db.collection('tags').document(tag_id).get(field_paths=TAG_LIST_FIELDS)
+    tag_data = doc.to_dict() if doc.exists else None
     
-    if not docs:
+    if not tag_data or tag_data.get('facet') != facet:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Tag not found with facet {facet} and id {tag_id}')
     
-    return docs[0].to_dict()
+    return tag_data
 
 @router.post('/')
-def create_tag(tag: TagCreate, current_user: dict = Depends(get_current_user)):
+async def create_tag(tag: TagCreate, current_user: dict = Depends(get_current_user)):
     """Create a new tag"""
-    db = firestore.Client()
-    
-    # Check if tag_id already exists
-    existing_doc = db.collection('tags').document(tag.tag_id).get()
-    if existing_doc.exists:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail=f"Tag with ID '{tag.tag_id}' already exists"
-        )
+    db = get_async_db()
     
     # Convert to dict and add created_at with current timestamp
-    data = tag.dict()
+    data = tag.model_dump()
     data['created_at'] = datetime.utcnow().isoformat() + "Z"
     
+    # create() fails if the tag_id already exists: no separate existence read
     doc_ref = db.collection('tags').document(tag.tag_id)
-    doc_ref.set(data)
+    try:
+        await doc_ref.create(data)
+    except AlreadyExists:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Tag with ID '{tag.tag_id}' already exists"
+        )
+    invalidate_tag(tag.tag_id)
     
     return {'tag_id': tag.tag_id, 'status': 'created'}
 
 @router.patch('/{tag_id}')
-def update_tag(tag_id: str, tag_update: dict, current_user: dict = Depends(get_current_user)):
+async def update_tag(tag_id: str, tag_update: dict, current_user: dict = Depends(get_current_user)):
     """Update an existing tag"""
-    db = firestore.Client()
+    db = get_async_db()
     doc_ref = db.collection('tags').document(tag_id)
-    doc = doc_ref.get()
+    doc = await doc_ref.get(field_paths=TAG_LIST_FIELDS)
     
     if not doc.exists:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Tag not found')
@@ -100,38 +107,38 @@ def update_tag(tag_id: str, tag_update: dict, current_user: dict = Depends(get_c
     if 'created_at' in tag_update:
         del tag_update['created_at']
     
-    doc_ref.update(tag_update)
+    await doc_ref.update(tag_update)
+    invalidate_tag(tag_id)
     
-    # Get the updated document
-    updated_doc = doc_ref.get()
-    return updated_doc.to_dict()
+    # The updated document is the one read above with the update applied: no second read
+    return {**doc.to_dict(), **tag_update}
 
 @router.delete('/{tag_id}')
-def delete_tag(tag_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_tag(tag_id: str, current_user: dict = Depends(get_current_user)):
     """Delete a tag (mark as inactive)"""
-    db = firestore.Client()
+    db = get_async_db()
     doc_ref = db.collection('tags').document(tag_id)
-    doc = doc_ref.get()
     
-    if not doc.exists:
+    # Soft delete - mark as inactive (update() fails on a missing tag: no existence read)
+    try:
+        await doc_ref.update({'active': False})
+    except NotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Tag not found')
-    
-    # Soft delete - mark as inactive
-    doc_ref.update({'active': False})
+    invalidate_tag(tag_id)
     
     return {'tag_id': tag_id, 'status': 'deleted'}
 
 @router.delete('/{tag_id}/permanent')
-def permanent_delete_tag(tag_id: str, current_user: dict = Depends(get_current_user)):
+async def permanent_delete_tag(tag_id: str, current_user: dict = Depends(get_current_user)):
     """Permanently delete a tag from the database"""
-    db = firestore.Client()
+    db = get_async_db()
     doc_ref = db.collection('tags').document(tag_id)
-    doc = doc_ref.get()
     
-    if not doc.exists:
+    # Hard delete, with an exists precondition instead of an existence read
+    try:
+        await doc_ref.delete(option=db.write_option(exists=True))
+    except NotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Tag not found')
-    
-    # Hard delete
-    doc_ref.delete()
+    invalidate_tag(tag_id)
     
     return {'tag_id': tag_id, 'status': 'permanently deleted'}
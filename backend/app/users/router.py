@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from google.cloud import firestore
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Request, Security, status
 from pydantic import BaseModel
 from typing import Dict, Any, Optional
-from app.auth.dependencies import get_current_user
+from app.auth.dependencies import get_current_user, oauth2_scheme, unverified_user_id
+from app.db import get_async_db
+from app.responses import etag_response
+from app.agents.expense_parser import invalidate_default_currency
 
 router = APIRouter(tags=["Users"])
 
@@ -14,24 +17,47 @@ class UserUpdate(BaseModel):
     # currency_preference: Optional[str] = None
     # theme: Optional[str] = None
 
+def _discard(task: asyncio.Future) -> None:
+    """Cancel a speculative read, retrieving its exception if it already failed"""
+    task.cancel()
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
 @router.get('/me')
-def get_user_data(current_user: dict = Depends(get_current_user)):
-    """Get the current user's data from Firestore"""
+async def get_user_data(request: Request, token: Optional[str] = Security(oauth2_scheme)):
+    """Get the current user's data from Firestore (304 when unchanged since the client's copy)"""
+    db = get_async_db()
+    
+    # The user document of the uid claimed by the token is fetched while the token is
+    # verified; it is only used if verification confirms that uid
+    claimed_user_id = unverified_user_id(token)
+    user_doc_task = (
+        asyncio.ensure_future(db.collection('users').document(claimed_user_id).get())
+        if claimed_user_id else None
+    )
+    try:
+        current_user = await asyncio.to_thread(get_current_user, token)
+    except Exception:
+        if user_doc_task is not None:
+            _discard(user_doc_task)
+        raise
     user_id = current_user["user_id"]
-    db = firestore.Client()
     
     # Get user document from Firestore
-    user_ref = db.collection('users').document(user_id)
-    user_doc = user_ref.get()
+    if user_doc_task is not None and claimed_user_id == user_id:
+        user_doc = await user_doc_task
+    else:
+        if user_doc_task is not None:
+            _discard(user_doc_task)
+        user_doc = await db.collection('users').document(user_id).get()
     
     # If user document doesn't exist, return empty data
     if not user_doc.exists:
-        return {
+        return etag_response(request, {
             "user_id": user_id,
             "email": current_user.get("email", ""),
             "name": current_user.get("name", ""),
             "budget": None
-        }
+        })
     
     # Return user data
     user_data = user_doc.to_dict()
@@ -45,19 +71,19 @@ def get_user_data(current_user: dict = Depends(get_current_user)):
     if "name" not in user_data:
         user_data["name"] = current_user.get("name", "")
     
-    return user_data
+    return etag_response(request, user_data)
 
 @router.patch('/me')
-def update_user_data(update_data: UserUpdate, current_user: dict = Depends(get_current_user)):
+async def update_user_data(update_data: UserUpdate, current_user: dict = Depends(get_current_user)):
     """Update the current user's data in Firestore"""
     user_id = current_user["user_id"]
-    db = firestore.Client()
+    db = get_async_db()
     
     # Get user document reference
     user_ref = db.collection('users').document(user_id)
     
     # Convert Pydantic model to dict, excluding None values
-    update_dict = {k: v for k, v in update_data.dict().items() if v is not None}
+    update_dict = update_data.model_dump(exclude_none=True)
     
     if not update_dict:
         raise HTTPException(
@@ -66,10 +92,11 @@ def update_user_data(update_data: UserUpdate, current_user: dict = Depends(get_c
         )
     
     # Update or create user document
-    user_ref.set(update_dict, merge=True)
+    await user_ref.set(update_dict, merge=True)
+    invalidate_default_currency(user_id)
     
     # Get updated user data
-    updated_doc = user_ref.get()
+    updated_doc = await user_ref.get()
     
     if not updated_doc.exists:
         raise HTTPException(
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The app modules are imported as `app.…` from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# llm.py requires an OpenAI key at import time; no request reaches OpenAI in the tests
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
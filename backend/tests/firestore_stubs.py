@@ -0,0 +1,104 @@
+"""In-memory stand-ins for the async Firestore client, applying field projections like Firestore does"""
+
+
+def _project(data, field_paths):
+    if field_paths is None:
+        return dict(data)
+    return {field: data[field] for field in field_paths if field in data}
+
+
+class StubSnapshot:
+    def __init__(self, doc_id, data, field_paths=None):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = None if data is None else _project(data, field_paths)
+
+    def to_dict(self):
+        return None if self._data is None else dict(self._data)
+
+
+class StubDocument:
+    def __init__(self, collection, doc_id):
+        self.collection = collection
+        self.id = doc_id
+
+    async def get(self, field_paths=None):
+        return StubSnapshot(self.id, self.collection.docs.get(self.id), field_paths)
+
+    async def update(self, data):
+        self.collection.docs[self.id].update(data)
+
+
+class StubQuery:
+    DESCENDING = "DESCENDING"
+
+    def __init__(self, collection, filters=(), field_paths=None, order=None, count=None, after=None):
+        self.collection = collection
+        self.filters = filters
+        self.field_paths = field_paths
+        self.order = order
+        self.count = count
+        self.after = after
+
+    def _with(self, **changes):
+        state = dict(filters=self.filters, field_paths=self.field_paths, order=self.order, count=self.count, after=self.after)
+        state.update(changes)
+        return StubQuery(self.collection, **state)
+
+    def where(self, field, op, value):
+        assert op == "=="
+        return self._with(filters=self.filters + ((field, value),))
+
+    def select(self, field_paths):
+        self.collection.client.selected.append(list(field_paths))
+        return self._with(field_paths=list(field_paths))
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._with(order=(field, direction == self.DESCENDING))
+
+    def limit(self, count):
+        return self._with(count=count)
+
+    def start_after(self, snapshot):
+        return self._with(after=snapshot.id)
+
+    async def stream(self):
+        matches = [
+            (doc_id, data) for doc_id, data in self.collection.docs.items()
+            if all(data.get(field) == value for field, value in self.filters)
+        ]
+        if self.order:
+            field, descending = self.order
+            matches.sort(key=lambda match: (match[1][field], match[0]), reverse=descending)
+        if self.after is not None:
+            ids = [doc_id for doc_id, _ in matches]
+            matches = matches[ids.index(self.after) + 1:]
+        if self.count is not None:
+            matches = matches[:self.count]
+        for doc_id, data in matches:
+            yield StubSnapshot(doc_id, data, self.field_paths)
+
+
+class StubCollection(StubQuery):
+    def __init__(self, client, docs):
+        super().__init__(self)
+        self.client = client
+        self.docs = docs
+
+    def document(self, doc_id):
+        return StubDocument(self, doc_id)
+
+
+class StubAsyncClient:
+    def __init__(self, collections):
+        self.collections = {name: StubCollection(self, docs) for name, docs in collections.items()}
+        self.selected = []
+        self.get_all_calls = []
+
+    def collection(self, name):
+        return self.collections[name]
+
+    async def get_all(self, references, field_paths=None):
+        self.get_all_calls.append([reference.id for reference in references])
+        for reference in references:
+            yield await reference.get(field_paths)
@@ -0,0 +1,97 @@
+from app.agents import expense_parser
+from app.agents.expense_parser import TagsSnapshot, _icon_map, _load_tags, invalidate_tags_snapshot
+
+
+class _Doc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class _Query:
+    def __init__(self, client, filters=()):
+        self.client = client
+        self.filters = filters
+
+    def where(self, filter):
+        return _Query(self.client, self.filters + (filter,))
+
+    def select(self, field_paths):
+        self.client.selected.append(list(field_paths))
+        return self
+
+    def stream(self):
+        self.client.streams += 1
+        facet = next(f.value for f in self.filters if f.field_path == "facet")
+        return [_Doc(doc_id, data) for doc_id, data in self.client.tags[facet]]
+
+
+class _StubClient:
+    """Firestore client stub serving the `tags` collection queries of the expense parser"""
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.streams = 0
+        self.selected = []
+
+    def collection(self, name):
+        assert name == "tags"
+        return _Query(self)
+
+
+TAGS = {
+    "area": [("food", {"tag_id": "food", "icon": "utensils"}), ("travel", {"tag_id": "travel"})],
+    "context": [("work", {"tag_id": "work", "icon": "briefcase"})],
+}
+
+
+def setup_function():
+    _load_tags.cache.clear()
+
+
+def test_load_tags_indexes_each_facet():
+    client = _StubClient(TAGS)
+
+    snapshot = _load_tags(client)
+
+    assert snapshot == TagsSnapshot("food, travel", "work", {"food": "utensils", "work": "briefcase"})
+    assert client.selected == [["tag_id", "icon"], ["tag_id", "icon"]]
+
+
+def test_load_tags_is_cached():
+    client = _StubClient(TAGS)
+
+    first = _load_tags(client)
+    second = _load_tags(client)
+
+    assert first is second
+    assert client.streams == 2  # One query per facet, on the first call only
+
+
+def test_icon_map_uses_the_cached_snapshot():
+    client = _StubClient(TAGS)
+
+    assert _icon_map(client) == {"food": "utensils", "work": "briefcase"}
+    assert _icon_map(client) == {"food": "utensils", "work": "briefcase"}
+    assert client.streams == 2
+
+
+def test_active_tags_is_not_cached():
+    client = _StubClient(TAGS)
+
+    assert [doc_id for doc_id, _ in expense_parser._active_tags(client, "area")] == ["food", "travel"]
+    assert [doc_id for doc_id, _ in expense_parser._active_tags(client, "context")] == ["work"]
+    assert client.streams == 2
+
+
+def test_invalidate_tags_snapshot_reloads_tags():
+    client = _StubClient(TAGS)
+    _load_tags(client)
+
+    invalidate_tags_snapshot()
+    _load_tags(client)
+
+    assert client.streams == 4
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException, Response
+
+from app.expenses import router as expenses_router
+from firestore_stubs import StubAsyncClient
+
+USER = {"user_id": "user-1", "email": "", "name": ""}
+
+
+def _expense(day, user_id="user-1"):
+    return {
+        "user_id": user_id,
+        "timestamp": f"2025-05-{day:02d}T12:00:00Z",
+        "amount": float(day),
+        "currency": "EUR",
+        "raw_text": f"expense {day}",
+        "area_tags": ["food"],
+        "context_tags": [],
+        "short_text": "",
+        "main_tag_icon": "utensils",
+        "receipt_source": True,
+    }
+
+
+@pytest.fixture
+def db(monkeypatch):
+    docs = {f"e{day}": _expense(day) for day in range(1, 6)}
+    docs["other"] = _expense(6, user_id="user-2")
+    client = StubAsyncClient({"expenses": docs})
+    monkeypatch.setattr(expenses_router, "get_async_db", lambda: client)
+    return client
+
+
+def _list(limit=None, cursor=None):
+    response = Response()
+    expenses = asyncio.run(expenses_router.list_expenses(response, limit=limit, cursor=cursor, current_user=USER))
+    return expenses, response.headers.get(expenses_router.NEXT_CURSOR_HEADER)
+
+
+def test_without_limit_every_expense_of_the_user_is_returned(db):
+    expenses, next_cursor = _list()
+
+    assert sorted(expense["id"] for expense in expenses) == ["e1", "e2", "e3", "e4", "e5"]
+    assert next_cursor is None
+
+
+def test_list_projects_to_the_expense_fields(db):
+    expenses, _ = _list()
+
+    assert db.selected == [expenses_router.EXPENSE_LIST_FIELDS]
+    assert all("receipt_source" not in expense for expense in expenses)
+
+
+def test_pages_are_newest_first_and_chained_by_cursor(db):
+    first, cursor = _list(limit=2)
+    second, cursor = _list(limit=2, cursor=cursor)
+    last, cursor = _list(limit=2, cursor=cursor)
+
+    assert [expense["id"] for expense in first + second + last] == ["e5", "e4", "e3", "e2", "e1"]
+    assert cursor is None
+
+
+def test_unknown_cursor_is_rejected(db):
+    with pytest.raises(HTTPException) as error:
+        _list(limit=2, cursor="missing")
+
+    assert error.value.status_code == 400
@@ -0,0 +1,27 @@
+import io
+import logging
+import queue
+from logging.handlers import QueueListener
+
+from app.main import _DeferredQueueHandler
+
+
+def test_records_are_formatted_once_by_the_listener():
+    log_queue = queue.SimpleQueue()
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(name)s: %(message)s"))
+    listener = QueueListener(log_queue, handler)
+
+    logger = logging.getLogger("tests.deferred")
+    logger.handlers = [_DeferredQueueHandler(log_queue)]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    listener.start()
+    try:
+        logger.info("HTTP Request: %s %s", "POST", "/chat/completions")
+    finally:
+        listener.stop()
+
+    assert stream.getvalue() == "INFO tests.deferred: HTTP Request: POST /chat/completions\n"
@@ -0,0 +1,98 @@
+import asyncio
+
+from app.agents import multi_expense_parser
+from app.agents.expense_parser import ExpenseData
+from app.agents.multi_expense_parser import parse_multiple_expenses
+
+TEXT = "$10 for coffee, $15 for lunch"
+
+
+def _expense(amount, short_text):
+    return ExpenseData(amount=amount, currency="USD", area_tags=["food"], short_text=short_text)
+
+
+def _stub_icons(monkeypatch):
+    def attach_main_tag_icons(db_client, expenses):
+        for expense in expenses:
+            expense.main_tag_icon = "utensils"
+        return expenses
+
+    monkeypatch.setattr(multi_expense_parser, "attach_main_tag_icons", attach_main_tag_icons)
+
+
+def _fail(*args, **kwargs):
+    raise AssertionError("the split fallback must not run")
+
+
+def test_batched_parse_is_used(monkeypatch):
+    async def parse_expenses_batch(text, user_id, db_client):
+        return [_expense(10, "coffee"), _expense(15, "lunch")]
+
+    monkeypatch.setattr(multi_expense_parser, "parse_expenses_batch", parse_expenses_batch)
+    monkeypatch.setattr(multi_expense_parser, "split_multi_expense_text", _fail)
+
+    result = asyncio.run(parse_multiple_expenses(TEXT, "u1", None))
+
+    assert [expense.short_text for expense in result.expenses] == ["coffee", "lunch"]
+    assert result.total_count == 2
+    assert result.error == ""
+
+
+def test_failed_batched_parse_falls_back_to_split(monkeypatch):
+    async def parse_expenses_batch(text, user_id, db_client):
+        raise ValueError("output does not match the schema")
+
+    async def split_multi_expense_text(text, user_id, db_client):
+        return ["$10 for coffee", "$15 for lunch"]
+
+    async def aparse_expense_data(expense_text, user_id, db_client):
+        amount, short_text = expense_text.lstrip("$").split(" for ")
+        return _expense(float(amount), short_text)
+
+    monkeypatch.setattr(multi_expense_parser, "parse_expenses_batch", parse_expenses_batch)
+    monkeypatch.setattr(multi_expense_parser, "split_multi_expense_text", split_multi_expense_text)
+    monkeypatch.setattr(multi_expense_parser, "aparse_expense_data", aparse_expense_data)
+    _stub_icons(monkeypatch)
+
+    result = asyncio.run(parse_multiple_expenses(TEXT, "u1", None))
+
+    assert [(expense.amount, expense.short_text) for expense in result.expenses] == [(10, "coffee"), (15, "lunch")]
+    assert all(expense.main_tag_icon == "utensils" for expense in result.expenses)
+    assert result.error == ""
+
+
+def test_empty_batched_parse_falls_back_to_split(monkeypatch):
+    async def parse_expenses_batch(text, user_id, db_client):
+        return []
+
+    async def split_multi_expense_text(text, user_id, db_client):
+        return ["$10 for coffee", "lunch"]
+
+    async def aparse_expense_data(expense_text, user_id, db_client):
+        if expense_text == "lunch":
+            raise ValueError("no amount")
+        return _expense(10, "coffee")
+
+    monkeypatch.setattr(multi_expense_parser, "parse_expenses_batch", parse_expenses_batch)
+    monkeypatch.setattr(multi_expense_parser, "split_multi_expense_text", split_multi_expense_text)
+    monkeypatch.setattr(multi_expense_parser, "aparse_expense_data", aparse_expense_data)
+    _stub_icons(monkeypatch)
+
+    result = asyncio.run(parse_multiple_expenses(TEXT, "u1", None))
+
+    assert [expense.short_text for expense in result.expenses] == ["coffee"]
+    assert result.error == "Error parsing 'lunch': no amount"
+
+
+def test_single_amount_skips_batching(monkeypatch):
+    async def aparse_expense_data(expense_text, user_id, db_client):
+        return _expense(10, "coffee")
+
+    monkeypatch.setattr(multi_expense_parser, "parse_expenses_batch", _fail)
+    monkeypatch.setattr(multi_expense_parser, "aparse_expense_data", aparse_expense_data)
+    _stub_icons(monkeypatch)
+
+    result = asyncio.run(parse_multiple_expenses("$10 for coffee", "u1", None))
+
+    assert result.total_count == 1
+    assert result.expenses[0].main_tag_icon == "utensils"
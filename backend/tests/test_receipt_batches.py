@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from google.api_core.exceptions import FailedPrecondition
+
+from app.agents import receipt_parser
+from app.agents.receipt_parser import _claim_receipt_batch, collect_receipt_batch
+
+
+class _BatchRef:
+    """Sync document reference honoring last_update_time preconditions"""
+
+    def __init__(self, data):
+        self.data = data
+        self.update_time = 1
+
+    def get(self):
+        return SimpleNamespace(exists=True, to_dict=lambda: dict(self.data), update_time=self.update_time)
+
+    def update(self, data, option=None):
+        if option is not None and option.last_update_time != self.update_time:
+            raise FailedPrecondition("document changed")
+        self.data.update(data)
+        self.update_time += 1
+
+
+class _StubClient:
+    def __init__(self, batch_ref):
+        self.batch_ref = batch_ref
+
+    def collection(self, name):
+        return SimpleNamespace(document=lambda doc_id: self.batch_ref)
+
+    def write_option(self, last_update_time):
+        return SimpleNamespace(last_update_time=last_update_time)
+
+
+def _no_openai():
+    raise AssertionError("a claimed batch must not be fetched again")
+
+
+def test_only_one_concurrent_collect_claims_the_batch():
+    batch_ref = _BatchRef({"user_id": "u1", "status": "completed", "processed": False})
+    db = _StubClient(batch_ref)
+    batch_doc = batch_ref.get()
+
+    assert asyncio.run(_claim_receipt_batch(db, batch_ref, batch_doc)) is True
+    # A second collect that read the batch before the claim loses the race
+    assert asyncio.run(_claim_receipt_batch(db, batch_ref, batch_doc)) is False
+    assert "claimed_at" in batch_ref.data
+
+
+def test_claimed_batch_reports_processing(monkeypatch):
+    batch_ref = _BatchRef({"user_id": "u1", "status": "completed", "claimed_at": datetime.now(timezone.utc)})
+    monkeypatch.setattr(receipt_parser, "get_openai_client", _no_openai)
+
+    result = asyncio.run(collect_receipt_batch("batch_1", "u1", _StubClient(batch_ref)))
+
+    assert result == {"batch_id": "batch_1", "status": "processing", "expense_ids": []}
+
+
+def test_abandoned_claim_can_be_taken_over(monkeypatch):
+    claimed_at = datetime.now(timezone.utc) - timedelta(seconds=receipt_parser.RECEIPT_BATCH_CLAIM_SECONDS + 1)
+    batch_ref = _BatchRef({"user_id": "u1", "status": "in_progress", "claimed_at": claimed_at})
+    openai_batch = SimpleNamespace(status="in_progress", output_file_id=None)
+
+    async def retrieve(batch_id):
+        return openai_batch
+
+    monkeypatch.setattr(
+        receipt_parser, "get_openai_client",
+        lambda: SimpleNamespace(batches=SimpleNamespace(retrieve=retrieve))
+    )
+
+    result = asyncio.run(collect_receipt_batch("batch_1", "u1", _StubClient(batch_ref)))
+
+    assert result == {"batch_id": "batch_1", "status": "in_progress", "expense_ids": []}
@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+
+import orjson
+from starlette.requests import Request
+
+from app.responses import etag_response
+
+
+class _Timestamp(datetime):
+    """Stand-in for Firestore's DatetimeWithNanoseconds (a datetime subclass)"""
+
+
+def _request(if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_response_carries_etag():
+    response = etag_response(_request(), {"tag_id": "food"})
+
+    assert response.status_code == 200
+    assert response.headers["etag"].startswith('W/"')
+    assert response.headers["cache-control"] == "private, no-cache"
+    assert orjson.loads(response.body) == {"tag_id": "food"}
+
+
+def test_matching_etag_returns_304():
+    etag = etag_response(_request(), {"tag_id": "food"}).headers["etag"]
+
+    response = etag_response(_request(f'W/"other", {etag}'), {"tag_id": "food"})
+
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == etag
+
+
+def test_changed_content_gets_new_etag():
+    etag = etag_response(_request(), {"tag_id": "food"}).headers["etag"]
+
+    response = etag_response(_request(etag), {"tag_id": "food", "icon": "Pizza"})
+
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_firestore_timestamps_are_encoded():
+    created_at = _Timestamp(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+
+    response = etag_response(_request(), [{"tag_id": "food", "created_at": created_at}])
+
+    assert orjson.loads(response.body) == [{"tag_id": "food", "created_at": "2024-05-01T12:30:00+00:00"}]
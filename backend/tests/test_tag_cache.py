@@ -0,0 +1,69 @@
+import asyncio
+
+from app.tags import cache
+from app.tags.cache import add_main_tag_icons, get_cached_tags, invalidate_tag
+from firestore_stubs import StubAsyncClient
+
+TAGS = {
+    "food": {"tag_id": "food", "name": "Food", "facet": "area", "icon": "utensils", "embedding": [0.1, 0.2]},
+    "travel": {"tag_id": "travel", "name": "Travel", "facet": "area"},
+}
+
+
+def setup_function():
+    cache._TAG_CACHE.clear()
+
+
+def test_missing_tags_are_fetched_once():
+    client = StubAsyncClient({"tags": dict(TAGS)})
+
+    tags = asyncio.run(get_cached_tags(["food", "unknown"], client))
+    again = asyncio.run(get_cached_tags(["food", "unknown"], client))
+
+    assert tags == again == {"food": {"icon": "utensils", "facet": "area", "name": "Food"}, "unknown": None}
+    assert [sorted(ids) for ids in client.get_all_calls] == [["food", "unknown"]]
+
+
+def test_invalidated_tag_is_fetched_again():
+    client = StubAsyncClient({"tags": dict(TAGS)})
+    asyncio.run(get_cached_tags(["food", "travel"], client))
+
+    client.collection("tags").docs["food"] = {**TAGS["food"], "icon": "pizza"}
+    invalidate_tag("food")
+    tags = asyncio.run(get_cached_tags(["food", "travel"], client))
+
+    assert tags["food"]["icon"] == "pizza"
+    assert client.get_all_calls[-1] == ["food"]
+
+
+def test_main_tag_icons_resolved_once_per_distinct_tag():
+    client = StubAsyncClient({"tags": dict(TAGS)})
+    expenses = [
+        {"area_tags": ["Food", "restaurant"]},
+        {"area_tags": ["food"]},
+        {"area_tags": ["travel"]},
+        {"area_tags": []},
+    ]
+
+    asyncio.run(add_main_tag_icons(expenses, client))
+
+    assert [expense["main_tag_icon"] for expense in expenses] == ["utensils", "utensils", "tag", "tag"]
+    assert [sorted(ids) for ids in client.get_all_calls] == [["food", "travel"]]
+
+
+def test_missing_only_keeps_stored_icons():
+    client = StubAsyncClient({"tags": dict(TAGS)})
+    expenses = [{"area_tags": ["food"], "main_tag_icon": "coffee"}, {"area_tags": ["food"]}]
+
+    asyncio.run(add_main_tag_icons(expenses, client, missing_only=True))
+
+    assert [expense["main_tag_icon"] for expense in expenses] == ["coffee", "utensils"]
+
+
+def test_invalidate_tag_drops_the_parser_tags_snapshot(monkeypatch):
+    dropped = []
+    monkeypatch.setattr(cache, "invalidate_tags_snapshot", lambda: dropped.append(True))
+
+    invalidate_tag("food")
+
+    assert dropped == [True]
@@ -0,0 +1,65 @@
+import asyncio
+
+import orjson
+import pytest
+from starlette.requests import Request
+
+from app.tags import router as tags_router
+from firestore_stubs import StubAsyncClient
+
+USER = {"user_id": "user-1", "email": "", "name": ""}
+
+FOOD = {
+    "tag_id": "food",
+    "name": "Food",
+    "facet": "area",
+    "synonyms": ["meal", "snack", "dish"],
+    "icon": "utensils",
+    "colors": {"hex": "#f97316", "bgHex": "#fff7ed", "textHex": "#9a3412"},
+    "embedding": [0.1] * 1536,
+    "created_at": "2025-05-06T18:47:43Z",
+    "active": True,
+}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    client = StubAsyncClient({"tags": {"food": dict(FOOD)}})
+    monkeypatch.setattr(tags_router, "get_async_db", lambda: client)
+    return client
+
+
+def _request():
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": []})
+
+
+def _expected():
+    return {field: value for field, value in FOOD.items() if field != "embedding"}
+
+
+def test_list_fields_keep_everything_but_the_embedding():
+    assert "embedding" not in tags_router.TAG_LIST_FIELDS
+    assert set(tags_router.TAG_LIST_FIELDS) == set(FOOD) - {"embedding"}
+
+
+def test_list_tags_keeps_colors(db):
+    response = asyncio.run(tags_router.list_tags(_request(), current_user=USER))
+
+    assert orjson.loads(response.body) == [_expected()]
+    assert db.selected == [tags_router.TAG_LIST_FIELDS]
+
+
+def test_get_tag_keeps_colors(db):
+    response = asyncio.run(tags_router.get_tag("food", _request(), current_user=USER))
+
+    assert orjson.loads(response.body) == _expected()
+
+
+def test_get_tag_by_facet_keeps_colors(db):
+    assert asyncio.run(tags_router.get_tag_by_facet("area", "food", current_user=USER)) == _expected()
+
+
+def test_update_tag_returns_the_patched_tag(db):
+    updated = asyncio.run(tags_router.update_tag("food", {"icon": "burger"}, current_user=USER))
+
+    assert updated == {**_expected(), "icon": "burger"}
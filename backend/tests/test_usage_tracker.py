@@ -0,0 +1,53 @@
+import pytest
+
+from app.agents import usage_tracker
+from app.agents.usage_tracker import UsageTracker, estimate_tokens
+
+TEXT = "Pizza margherita 12.50 EUR, ordered at Da Michele with friends"
+
+
+class _FakeEncoding:
+    """Stand-in for the cl100k_base encoding (one token per word), so no encoding file is downloaded"""
+
+    def encode_ordinary(self, text):
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def fake_encoding(monkeypatch):
+    monkeypatch.setattr(usage_tracker, "_cl100k_encoding", lambda: _FakeEncoding())
+
+
+def test_tokens_are_estimated_by_default():
+    tracker = UsageTracker(db_client=None, exact_tokens=False)
+
+    assert tracker.count_tokens(TEXT, "gpt-4o-mini") == (len(TEXT) + 3) // 4
+
+
+def test_non_ascii_estimate_counts_utf8_bytes():
+    assert estimate_tokens("café crème") == (len("café crème".encode("utf-8")) + 3) // 4
+
+
+def test_exact_mode_uses_the_tokenizer():
+    tracker = UsageTracker(db_client=None, exact_tokens=True)
+
+    assert tracker.count_tokens(TEXT, "gpt-4o-mini") == len(TEXT.split())
+
+
+def test_sampled_requests_are_counted_exactly(monkeypatch):
+    queued = []
+    monkeypatch.setattr(usage_tracker, "_queue_usage", lambda db, user_id, *usage: queued.append(usage))
+    tracker = UsageTracker(db_client=None, exact_tokens=False, exact_sample_rate=1.0)
+
+    tracker.log_usage("u1", "expense_parser", "gpt-4.1-nano", input_text=TEXT, output_text="pizza")
+
+    tokens = queued[0][-1]["tokens"]
+    assert tokens["exact"] is True
+    assert tokens["total"] == len(TEXT.split()) + 2  # "pizza" is too short to be encoded
+    assert tokens["estimated_total"] == (len(TEXT) + 3) // 4 + 2
+
+
+def test_cost_of_token_counts():
+    tracker = UsageTracker(db_client=None)
+
+    assert tracker.calculate_cost(1_000_000, 1_000_000, "gpt-4o-mini") == pytest.approx(0.150 + 0.600)